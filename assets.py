@@ -0,0 +1,123 @@
+"""On-disk cache for the icon and logo images derived from logo.png.
+
+Derived files live in a per-user cache directory, in a subdirectory named
+after the source image's SHA-256. The source's mtime and size are recorded
+next to the hash so unchanged files are not re-hashed on every launch.
+Everything returned is a PNG/ICO path that Tk and Qt can load natively, so a
+warm start needs no PIL at all.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+ICO_SIZES = [16, 32, 48, 64, 128]
+ICON_SIZES = [16, 32, 48, 64, 128, 256]
+LOGO_SIZE = 100
+INDEX_FILE = "index.json"
+
+
+def cache_root() -> str:
+    """Return the per-user cache directory shared by the app's caches."""
+    base = (os.environ.get("LOCALAPPDATA")
+            or os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "InternetSpeedTest")
+
+
+def default_cache_dir() -> str:
+    """Return the per-user cache directory for derived image assets."""
+    return os.path.join(cache_root(), "assets")
+
+
+def write_atomic(path: str, save) -> None:
+    """Call ``save(tmp_path)`` and move the result into place."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class AssetCache:
+    """Build the derived logo assets once and reuse them across launches."""
+
+    def __init__(self, source: str, cache_dir: Optional[str] = None):
+        self.source = os.path.abspath(source)
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def source_key(self) -> str:
+        """Return the source file's SHA-256, re-hashing only if mtime or size changed."""
+        stat = os.stat(self.source)
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        entry = index.get(self.source)
+        if entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            return entry["sha256"]
+
+        digest = hashlib.sha256()
+        with open(self.source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+
+        index[self.source] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": sha256}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(index_path, lambda p: self._dump_json(index, p))
+        return sha256
+
+    @staticmethod
+    def _dump_json(data, path):
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def paths(self, key: str) -> Dict:
+        """Return the derived file paths for a source key."""
+        directory = os.path.join(self.cache_dir, key[:16])
+        return {
+            "dir": directory,
+            "ico": os.path.join(directory, "app_icon.ico"),
+            "icons": [os.path.join(directory, f"icon_{size}.png") for size in ICON_SIZES],
+            "logos": {
+                "Dark": os.path.join(directory, "logo_dark.png"),
+                "Light": os.path.join(directory, "logo_light.png"),
+            },
+        }
+
+    def get(self) -> Dict:
+        """Return cached asset paths, building any that are missing."""
+        paths = self.paths(self.source_key())
+        wanted: List[str] = [paths["ico"], *paths["icons"], *paths["logos"].values()]
+        if not all(os.path.exists(p) for p in wanted):
+            self.build(paths)
+        return paths
+
+    def build(self, paths: Dict) -> None:
+        """Derive the ICO, icon PNGs and themed logos from the source image."""
+        from PIL import Image, ImageOps
+
+        os.makedirs(paths["dir"], exist_ok=True)
+        logo = Image.open(self.source).convert("RGBA")
+
+        write_atomic(paths["ico"], lambda p: logo.save(
+            p, format="ICO", sizes=[(s, s) for s in ICO_SIZES]))
+
+        for size, path in zip(ICON_SIZES, paths["icons"]):
+            icon = logo.resize((size, size), Image.Resampling.LANCZOS)
+            write_atomic(path, lambda p: icon.save(p, format="PNG"))
+
+        logo_resized = logo.resize((LOGO_SIZE, LOGO_SIZE), Image.Resampling.LANCZOS)
+        write_atomic(paths["logos"]["Dark"], lambda p: logo_resized.save(p, format="PNG"))
+
+        # The light theme uses an inverted copy with the original alpha
+        r, g, b, a = logo_resized.split()
+        inverted_image = ImageOps.invert(Image.merge("RGB", (r, g, b)))
+        inverted_image.putalpha(a)
+        write_atomic(paths["logos"]["Light"], lambda p: inverted_image.save(p, format="PNG"))
@@ -0,0 +1,1086 @@
+"""asyncio measurement core.
+
+Config retrieval, server discovery, latency probes and throughput streams all
+run as coroutines on one event loop instead of speedtest-cli's blocking
+urllib calls and thread pools. Cancelling the task closes every open
+connection through the ``finally`` blocks below, so teardown is immediate
+and deterministic.
+
+``TestRunner`` owns a single long-lived loop thread and is the adapter the
+GUIs use to start and cancel tests.
+"""
+import asyncio
+import math
+import ssl
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import engine
+
+CONFIG_URL = "https://www.speedtest.net/speedtest-config.php"
+SERVER_LIST_URLS = [
+    "https://www.speedtest.net/speedtest-servers-static.php",
+    "http://c.speedtest.net/speedtest-servers-static.php",
+]
+USER_AGENT = "Mozilla/5.0 (InternetSpeedTest) speedtest-cli compatible"
+TIMEOUT = 10
+READ_SIZE = 64 * 1024
+RECV_BUFFER_SIZE = 256 * 1024
+LATENCY_PROBES = 3
+
+# Fixed-byte mode, modelled on speedtest-cli's defaults
+DOWNLOAD_SIZES = [350, 500, 750, 1000, 1500, 2000, 2500, 3000, 3500, 4000]
+DOWNLOAD_REPEAT = 4
+UPLOAD_SIZES = [32768, 65536, 131072, 262144, 524288, 1048576, 7340032]
+UPLOAD_REPEAT = 5
+DEFAULT_THREADS = 4
+DURATION_UPLOAD_SIZE = 1_000_000
+FINAL_REQUEST_SECONDS = 0.5  # Smallest request, in seconds of a stream's rate, near the deadline
+DRAIN_TIMEOUT = 1.0  # Seconds streams get to finish their last request after the deadline
+SEND_SIZE = 256 * 1024
+SAMPLE_INTERVAL = 0.1
+
+
+class HTTPError(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Minimal HTTP/1.1 over asyncio streams
+# ---------------------------------------------------------------------------
+
+def split_url(url: str) -> Tuple[str, str, int, str]:
+    """Return ``(scheme, host, port, path_with_query)``."""
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    return parts.scheme, parts.hostname, port, path
+
+
+async def open_stream(scheme: str, host: str, port: int, address: Optional[str] = None):
+    """Connect to ``host``, or to an already resolved ``address`` for it."""
+    ssl_context = ssl.create_default_context() if scheme == "https" else None
+    return await asyncio.wait_for(
+        asyncio.open_connection(address or host, port, ssl=ssl_context,
+                                server_hostname=host if ssl_context else None), TIMEOUT)
+
+
+def request_head(method: str, host: str, path: str, content_length: Optional[int] = None,
+                 keep_alive: bool = True, content_type: Optional[str] = None) -> bytes:
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        f"User-Agent: {USER_AGENT}",
+        "Cache-Control: no-cache",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if content_type:
+        lines.append(f"Content-Type: {content_type}")
+    if content_length is not None:
+        lines.append(f"Content-Length: {content_length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+    return parse_head(await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), TIMEOUT))
+
+
+def parse_head(raw: bytes) -> Tuple[int, Dict[str, str]]:
+    """Return the status and lower-cased headers of a response head."""
+    lines = raw.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def read_body(reader: asyncio.StreamReader, headers: Dict[str, str],
+                    on_chunk: Optional[Callable[[bytes], None]] = None,
+                    keep: bool = True) -> bytes:
+    """Read a response body, passing each chunk to ``on_chunk``; returns it if ``keep``."""
+    parts: List[bytes] = []
+
+    def take(chunk: bytes):
+        if on_chunk:
+            on_chunk(chunk)
+        if keep:
+            parts.append(chunk)
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                break
+            remaining = size
+            while remaining:
+                chunk = await reader.read(min(remaining, READ_SIZE))
+                if not chunk:
+                    raise HTTPError("connection closed mid-chunk")
+                remaining -= len(chunk)
+                take(chunk)
+            await reader.readline()
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            chunk = await reader.read(min(remaining, READ_SIZE))
+            if not chunk:
+                raise HTTPError("connection closed mid-body")
+            remaining -= len(chunk)
+            take(chunk)
+    else:
+        while True:
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                break
+            take(chunk)
+    return b"".join(parts)
+
+
+async def close_stream(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+
+
+async def fetch(url: str, redirects: int = 3) -> bytes:
+    """GET ``url`` on a fresh connection and return the body."""
+    scheme, host, port, path = split_url(url)
+    reader, writer = await open_stream(scheme, host, port)
+    try:
+        writer.write(request_head("GET", host, path, keep_alive=False))
+        await writer.drain()
+        status, headers = await read_head(reader)
+        if status in (301, 302, 303, 307, 308) and redirects and "location" in headers:
+            return await fetch(urllib.parse.urljoin(url, headers["location"]), redirects - 1)
+        if status >= 400:
+            raise HTTPError(f"{url} returned HTTP {status}")
+        return await read_body(reader, headers)
+    finally:
+        await close_stream(writer)
+
+
+# Response states of a BodyReceiver
+IDLE, HEAD, BODY_LENGTH, BODY_CLOSE, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILER = range(8)
+LINE_STATES = (HEAD, CHUNK_SIZE, CHUNK_END, TRAILER)
+
+
+class BodyReceiver(asyncio.BufferedProtocol):
+    """Keep-alive HTTP/1.1 connection that counts response bodies without keeping them.
+
+    The transport reads straight into ``buffer`` (``recv_into`` on plain
+    TCP) and body bytes are only passed to ``on_bytes`` as counts, so a read
+    allocates nothing. Heads and chunk-size lines are collected in a small
+    side buffer. ``reads`` and ``received`` give the bytes per read, and
+    ``parser_objects`` counts the buffers and byte strings the parser itself
+    creates: the receive buffer plus one per head or chunk line. It is not
+    a count of every Python allocation; header dicts, strings and callbacks
+    are left out.
+    """
+
+    def __init__(self, on_bytes: Callable[[int], None], size: int = RECV_BUFFER_SIZE):
+        self.on_bytes = on_bytes
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.line = bytearray()
+        self.transport: Optional[asyncio.Transport] = None
+        self.state = IDLE
+        self.remaining = 0
+        self.reads = 0
+        self.received = 0
+        self.parser_objects = 1
+        self.head_waiter: Optional[asyncio.Future] = None
+        self.body_waiter: Optional[asyncio.Future] = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def reuse(self, on_bytes: Callable[[int], None]) -> None:
+        """Hand a pooled connection to a new stream, with fresh counters."""
+        self.on_bytes = on_bytes
+        self.reads = self.received = self.parser_objects = 0
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.view
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.reads += 1
+        self.received += nbytes
+        start = 0
+        while start < nbytes and self.state != IDLE:
+            start = self._feed(start, nbytes)
+
+    def _feed(self, start: int, end: int) -> int:
+        """Consume ``buffer[start:end]`` in the current state; returns where it stopped."""
+        if self.state in LINE_STATES:
+            return self._feed_line(start, end)
+        if self.state == BODY_CLOSE:
+            self.on_bytes(end - start)
+            return end
+        take = min(self.remaining, end - start)
+        self.on_bytes(take)
+        self.remaining -= take
+        if not self.remaining:
+            if self.state == BODY_LENGTH:
+                self._finish()
+            else:
+                self.state = CHUNK_END
+        return start + take
+
+    def _feed_line(self, start: int, end: int) -> int:
+        newline = self.buffer.find(b"\n", start, end)
+        stop = end if newline < 0 else newline + 1
+        self.line += self.view[start:stop]
+        if newline < 0:
+            return end
+        if self.state == HEAD:
+            if self.line.endswith(b"\r\n\r\n"):
+                self._start_body(*parse_head(bytes(self.line)))
+                self.line.clear()
+            return stop
+        line = bytes(self.line).strip()
+        self.line.clear()
+        self.parser_objects += 1
+        if self.state == CHUNK_SIZE:
+            self.remaining = int(line.split(b";")[0] or b"0", 16)
+            self.state = CHUNK_DATA if self.remaining else TRAILER
+        elif self.state == CHUNK_END:
+            self.state = CHUNK_SIZE
+        elif not line:
+            self._finish()
+        return stop
+
+    def _start_body(self, status: int, headers: Dict[str, str]) -> None:
+        self.parser_objects += 1
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            self.state = CHUNK_SIZE
+        elif "content-length" in headers:
+            self.remaining = int(headers["content-length"])
+            self.state = BODY_LENGTH
+        else:
+            self.state = BODY_CLOSE
+        if not self.head_waiter.done():
+            self.head_waiter.set_result((status, headers))
+        if self.state == BODY_LENGTH and not self.remaining:
+            self._finish()
+
+    def _finish(self) -> None:
+        self.state = IDLE
+        if not self.body_waiter.done():
+            self.body_waiter.set_result(None)
+
+    def eof_received(self) -> None:
+        if self.state == BODY_CLOSE:
+            self._finish()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        error = exc or HTTPError("connection closed mid-response")
+        for waiter in (self.head_waiter, self.body_waiter):
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(error)
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    async def request(self, host: str, path: str) -> Tuple[int, Dict[str, str]]:
+        """Send a GET and return the response status and headers."""
+        if self.transport is None or self.transport.is_closing():
+            raise HTTPError("connection closed")
+        loop = asyncio.get_running_loop()
+        self.head_waiter, self.body_waiter = loop.create_future(), loop.create_future()
+        self.state = HEAD
+        self.transport.write(request_head("GET", host, path))
+        return await asyncio.wait_for(self.head_waiter, TIMEOUT)
+
+    async def read_body(self) -> None:
+        """Wait until the body of the current response has been counted."""
+        await self.body_waiter
+
+    async def close(self) -> None:
+        for waiter in (self.head_waiter, self.body_waiter):
+            if waiter is not None and not waiter.done():
+                waiter.cancel()
+        if self.transport is not None:
+            self.transport.close()
+            await self.closed
+
+
+async def open_receiver(scheme: str, host: str, port: int, on_bytes: Callable[[int], None],
+                        address: Optional[str] = None) -> BodyReceiver:
+    loop = asyncio.get_running_loop()
+    ssl_context = ssl.create_default_context() if scheme == "https" else None
+    _, protocol = await asyncio.wait_for(
+        loop.create_connection(lambda: BodyReceiver(on_bytes), address or host, port, ssl=ssl_context,
+                               server_hostname=host if ssl_context else None), TIMEOUT)
+    return protocol
+
+
+# ---------------------------------------------------------------------------
+# Config, server discovery and latency
+# ---------------------------------------------------------------------------
+
+def distance(origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
+    """Great-circle distance in km, as computed by speedtest-cli."""
+    lat1, lon1 = origin
+    lat2, lon2 = destination
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+async def get_config() -> Dict:
+    try:
+        root = ET.fromstring(await fetch(CONFIG_URL))
+        client = root.find("client").attrib
+        server_config = root.find("server-config").attrib
+    except Exception as e:
+        raise engine.ConfigRetrievalError(str(e)) from e
+    ignore = {i for i in server_config.get("ignoreids", "").split(",") if i}
+    return {
+        "client": client,
+        "location": (float(client["lat"]), float(client["lon"])),
+        "ignore_ids": ignore,
+    }
+
+
+def parse_servers(data: bytes, config: Dict) -> List[Dict]:
+    servers = []
+    for element in ET.fromstring(data).iter("server"):
+        server = dict(element.attrib)
+        if server.get("id") in config["ignore_ids"]:
+            continue
+        try:
+            server["d"] = distance(config["location"], (float(server["lat"]), float(server["lon"])))
+        except (KeyError, ValueError):
+            continue
+        servers.append(server)
+    return servers
+
+
+async def get_servers(config: Dict) -> List[Dict]:
+    """Fetch the server list, trying each mirror in turn."""
+    last_error: Optional[BaseException] = None
+    for url in SERVER_LIST_URLS:
+        try:
+            servers = parse_servers(await fetch(url), config)
+            if servers:
+                return servers
+        except (OSError, asyncio.TimeoutError, HTTPError, ET.ParseError) as e:
+            last_error = e
+    raise engine.NoMatchedServers(str(last_error) if last_error else "empty server list")
+
+
+async def measure_latency(server: Dict, probes: int = LATENCY_PROBES) -> float:
+    """Average HTTP latency to a server's latency.txt in ms (inf if unreachable)."""
+    base = server["url"].rsplit("/", 1)[0]
+    scheme, host, port, path = split_url(f"{base}/latency.txt")
+    total = 0.0
+    for i in range(probes):
+        started = time.perf_counter()
+        try:
+            reader, writer = await open_stream(scheme, host, port)
+            try:
+                writer.write(request_head("GET", host, f"{path}?x={time.time()}.{i}", keep_alive=False))
+                await writer.drain()
+                status, headers = await read_head(reader)
+                body = await read_body(reader, headers)
+            finally:
+                await close_stream(writer)
+        except (OSError, asyncio.TimeoutError, HTTPError, ValueError):
+            return math.inf
+        if status != 200 or not body.startswith(b"test=test"):
+            return math.inf
+        total += time.perf_counter() - started
+    return total / probes * 1000
+
+
+# ---------------------------------------------------------------------------
+# Throughput streams
+# ---------------------------------------------------------------------------
+
+async def run_workers(workers) -> None:
+    """Run worker coroutines; on failure or cancellation cancel and await the rest."""
+    tasks = [asyncio.ensure_future(w) for w in workers]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class UploadPayload:
+    """One upload body, built once and shared by every upload request.
+
+    The server only reads a ``content1=...`` form body, so each request sends
+    a prefix of the same bytes: ``view(size)`` is a zero-copy memoryview of
+    it, and ``file()`` holds the same bytes in a temporary file for
+    ``loop.sendfile``, which sends them with ``os.sendfile`` (``TransmitFile``
+    on Windows) without the body passing through Python at all.
+    """
+
+    def __init__(self, size: int):
+        self.data = b"content1=" + b"0" * (size - len(b"content1="))
+        self._file = None
+
+    def view(self, size: int) -> memoryview:
+        return memoryview(self.data)[:size]
+
+    def file(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self.data)
+            self._file.flush()
+        return self._file
+
+
+_payload: Optional[UploadPayload] = None
+
+
+def upload_payload() -> UploadPayload:
+    """Return the shared payload, big enough for the largest upload request."""
+    global _payload
+    if _payload is None:
+        _payload = UploadPayload(max(max(UPLOAD_SIZES), DURATION_UPLOAD_SIZE))
+    return _payload
+
+
+class PhaseSampler:
+    """Periodic ``sample`` events for a phase with ``bytes``, ``fraction()``,
+    ``direction``, ``emit``, ``interval`` and ``samples``."""
+
+    async def _sample(self) -> None:
+        started = last_time = time.perf_counter()
+        last_bytes = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            now, moved = time.perf_counter(), self.bytes
+            bps = (moved - last_bytes) * 8 / (now - last_time)
+            elapsed = now - started
+            self.samples.append((round(elapsed, 3), round(bps, 1)))
+            self.emit("sample", {"phase": self.direction, "elapsed": elapsed, "bps": bps,
+                                 "bytes": moved, "fraction": self.fraction(elapsed)})
+            last_time, last_bytes = now, moved
+
+
+class ThroughputPhase(PhaseSampler):
+    """One download or upload phase with ``threads`` concurrent streams.
+
+    In fixed-duration mode each stream keeps issuing requests until the
+    deadline and bytes moved during the warm-up window are excluded. Request
+    sizes follow the stream's rate so the last ones end near the deadline;
+    streams then get ``DRAIN_TIMEOUT`` to finish them, so their connections
+    go back to the session instead of being cut mid-response. In fixed-byte
+    mode the streams share a queue of request sizes.
+
+    Every ``interval`` seconds the phase emits a ``sample`` event with the
+    throughput over that interval and the fraction of the phase completed,
+    and appends ``(elapsed, bps)`` to ``samples``.
+
+    ``cpu_seconds`` is the CPU time the loop thread used during ``run`` and
+    ``elapsed`` its wall time; ``engine.cpu_report`` turns them into the
+    per-byte cost stored with the result. Uploads send slices of the shared
+    ``UploadPayload``, with ``loop.sendfile`` on plain-HTTP streams and
+    memoryview writes otherwise (``upload_method``). Downloads read through
+    a ``BodyReceiver`` per stream, whose read and parser object counts are
+    added to the download report.
+    """
+
+    def __init__(self, server: Dict, direction: str, options: "engine.TestOptions",
+                 emit: Optional["engine.EventCallback"] = None, interval: float = SAMPLE_INTERVAL,
+                 trace=None, session=None):
+        self.direction = direction
+        self.trace = trace  # Optional tracing.Trace; each stream gets its own track
+        self.session = session  # Optional session.Session to take connections from and return them to
+        self.options = options
+        self.emit = emit or engine.ignore_event
+        self.interval = interval
+        self.threads = options.threads or DEFAULT_THREADS
+        self.scheme, self.host, self.port, self.upload_path = split_url(server["url"])
+        self.base_path = self.upload_path.rsplit("/", 1)[0]
+        self.bytes = 0
+        self.stream_bytes = [0] * self.threads
+        self.stopping = False
+        self.deadline = 0.0
+        self.samples: List[Tuple[float, float]] = []
+        self.jobs: Optional[asyncio.Queue] = None
+        self.total_jobs = 0
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+        self.upload_method = "sendfile" if self.scheme == "http" else "write"
+        self.recv_calls = 0
+        self.recv_bytes = 0
+        self.parser_objects = 0
+        # (first stream, total streams) when worker processes run the other streams
+        self.share: Optional[Tuple[int, int]] = None
+
+    def count(self, index: int, size: int) -> None:
+        self.bytes += size
+        self.stream_bytes[index] += size
+
+    async def run(self) -> float:
+        """Return the measured speed in bits per second."""
+        sampler = asyncio.ensure_future(self._sample())
+        cpu, started = time.thread_time(), time.perf_counter()
+        try:
+            if self.options.duration:
+                return await self._run_for_duration()
+            return await self._run_fixed_bytes()
+        finally:
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+            self.cpu_seconds = time.thread_time() - cpu
+            self.elapsed = time.perf_counter() - started
+
+    def cpu_report(self) -> Dict:
+        report = engine.cpu_report(self.cpu_seconds, self.elapsed, self.bytes)
+        if self.direction == "upload":
+            report["method"] = self.upload_method
+        else:
+            report["recv_calls"] = self.recv_calls
+            report["bytes_per_recv"] = round(self.recv_bytes / self.recv_calls) if self.recv_calls else None
+            report["parser_objects"] = self.parser_objects
+            report["parser_objects_per_second"] = (round(self.parser_objects / self.elapsed, 1)
+                                                   if self.elapsed > 0 else None)
+        return report
+
+    def fraction(self, elapsed: float) -> float:
+        """Fraction of the phase completed, by time or by requests handed out."""
+        if self.options.duration:
+            return min(1.0, elapsed / (self.options.warmup + self.options.duration))
+        if self.jobs is None or not self.total_jobs:
+            return 0.0
+        return 1.0 - self.jobs.qsize() / self.total_jobs
+
+    async def _run_for_duration(self) -> float:
+        jobs = None
+        self.deadline = time.perf_counter() + self.options.warmup + self.options.duration
+        task = asyncio.ensure_future(run_workers(
+            self._worker(i, jobs) for i in range(self.threads)))
+        try:
+            await self._wait(task, self.options.warmup)
+            start_bytes, start_time = self.bytes, time.perf_counter()
+            await self._wait(task, self.options.duration)
+            end_bytes, elapsed = self.bytes, time.perf_counter() - start_time
+            # Let in-flight requests finish so their connections can be pooled
+            self.stopping = True
+            await asyncio.wait([task], timeout=DRAIN_TIMEOUT)
+        finally:
+            self.stopping = True
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return (end_bytes - start_bytes) * 8 / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    async def _wait(task: asyncio.Future, seconds: float) -> None:
+        """Sleep for ``seconds`` but surface a worker failure immediately."""
+        done, _ = await asyncio.wait([task], timeout=seconds)
+        if done:
+            task.result()
+            raise HTTPError("throughput streams stopped early")
+
+    async def _run_fixed_bytes(self) -> float:
+        if self.direction == "download":
+            sizes = [size for size in DOWNLOAD_SIZES for _ in range(DOWNLOAD_REPEAT)]
+        else:
+            sizes = [size for size in UPLOAD_SIZES for _ in range(UPLOAD_REPEAT)]
+        first, total = self.share or (0, self.threads)
+        jobs: asyncio.Queue = asyncio.Queue()
+        for i, size in enumerate(sizes):
+            # Deal requests out per stream so each process gets its streams' part
+            if first <= i % total < first + self.threads:
+                jobs.put_nowait(size)
+        self.jobs, self.total_jobs = jobs, jobs.qsize()
+
+        started = time.perf_counter()
+        await run_workers(self._worker(i, jobs) for i in range(self.threads))
+        elapsed = time.perf_counter() - started
+        return self.bytes * 8 / elapsed if elapsed > 0 else 0.0
+
+    def _next_job(self, jobs: Optional[asyncio.Queue], index: int, started: float):
+        if jobs is None:
+            return None if self.stopping else self._timed_size(index, started)
+        try:
+            return jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def _timed_size(self, index: int, started: float) -> int:
+        """Request size for about the rest of the phase at this stream's rate, within the usual sizes."""
+        now = time.perf_counter()
+        rate = self.stream_bytes[index] / (now - started) if now > started else 0.0
+        budget = rate * max(self.deadline - now, FINAL_REQUEST_SECONDS)
+        if self.direction == "download":
+            # randomNxN.jpg is about 2*N*N bytes
+            fitting = [size for size in DOWNLOAD_SIZES if 2 * size * size <= budget]
+            return fitting[-1] if fitting else DOWNLOAD_SIZES[0]
+        return int(min(max(budget, UPLOAD_SIZES[0]), DURATION_UPLOAD_SIZE))
+
+    async def _worker(self, index: int, jobs: Optional[asyncio.Queue]) -> None:
+        started = self.trace.now_ns() if self.trace else 0
+        request = 0
+        clean = False
+        connection, reused = await self._connect(index)
+        stream_started = time.perf_counter()
+        try:
+            while True:
+                size = self._next_job(jobs, index, stream_started)
+                if size is None:
+                    break
+                request += 1
+                query = f"?x={time.time()}.{index}.{request}"
+                try:
+                    await self._request(connection, size, query, index)
+                except (OSError, EOFError, HTTPError):
+                    if not reused:
+                        raise
+                    # The server dropped the pooled connection while it sat idle
+                    await self._disconnect(connection, clean=False)
+                    connection = None  # Already counted and closed if reconnecting fails
+                    connection, reused = await self._connect(index, fresh=True)
+                    await self._request(connection, size, query, index)
+                reused = False
+            clean = True
+        finally:
+            if connection is not None:
+                await self._disconnect(connection, clean)
+            if self.trace:
+                track = self.trace.track(f"{self.direction} stream {index}")
+                self.trace.add(f"{self.direction} stream", started, self.trace.now_ns(),
+                               self.stream_bytes[index], track, requests=request)
+
+    async def _connect(self, index: int, fresh: bool = False):
+        """Return ``(connection, reused)``: a ``BodyReceiver`` or a ``(reader, writer)`` pair."""
+        if self.direction == "download":
+            on_bytes = lambda size: self.count(index, size)
+            if self.session is not None:
+                return await self.session.open_receiver(self.scheme, self.host, self.port, on_bytes, fresh)
+            return await open_receiver(self.scheme, self.host, self.port, on_bytes), False
+        if self.session is not None:
+            reader, writer, reused = await self.session.open_stream(self.scheme, self.host, self.port, fresh)
+            return (reader, writer), reused
+        return await open_stream(self.scheme, self.host, self.port), False
+
+    async def _disconnect(self, connection, clean: bool) -> None:
+        """Return a connection to the session if its last response completed, else close it."""
+        pool = clean and self.session is not None
+        if self.direction == "download":
+            self.recv_calls += connection.reads
+            self.recv_bytes += connection.received
+            self.parser_objects += connection.parser_objects
+            if pool:
+                self.session.release_receiver(self.scheme, self.host, self.port, connection)
+            else:
+                await connection.close()
+        elif pool:
+            self.session.release_stream(self.scheme, self.host, self.port, *connection)
+        else:
+            await close_stream(connection[1])
+
+    async def _request(self, connection, size: int, query: str, index: int) -> None:
+        if self.direction == "download":
+            await self._download(connection, f"{self.base_path}/random{size}x{size}.jpg{query}")
+        else:
+            await self._upload(*connection, f"{self.upload_path}{query}", size, index)
+
+    async def _download(self, connection: BodyReceiver, path: str) -> None:
+        status, _ = await connection.request(self.host, path)
+        if status >= 400:
+            raise HTTPError(f"download returned HTTP {status}")
+        await connection.read_body()
+
+    async def _upload(self, reader, writer, path: str, size: int, index: int) -> None:
+        writer.write(request_head("POST", self.host, path, content_length=size,
+                                  content_type="application/x-www-form-urlencoded"))
+        payload = upload_payload()
+        offset = 0
+        if self.upload_method == "sendfile":
+            offset = await self._sendfile(writer, payload, size, index)
+        view = payload.view(size)
+        for offset in range(offset, size, SEND_SIZE):
+            chunk = view[offset:offset + SEND_SIZE]
+            writer.write(chunk)
+            await writer.drain()
+            self.count(index, len(chunk))
+        status, headers = await read_head(reader)
+        await read_body(reader, headers, keep=False)
+        if status >= 400:
+            raise HTTPError(f"upload returned HTTP {status}")
+
+    async def _sendfile(self, writer, payload: UploadPayload, size: int, index: int) -> int:
+        """Send as much of the body as ``loop.sendfile`` can; returns the bytes sent."""
+        loop = asyncio.get_running_loop()
+        try:
+            source = payload.file()
+        except OSError:
+            self.upload_method = "write"
+            return 0
+        await writer.drain()
+        sent = 0
+        try:
+            while sent < size:
+                count = min(SEND_SIZE, size - sent)
+                await loop.sendfile(writer.transport, source, sent, count, fallback=False)
+                sent += count
+                self.count(index, count)
+        except (asyncio.SendfileNotAvailableError, NotImplementedError):
+            # Not supported by this loop or transport; the caller writes the rest
+            self.upload_method = "write"
+        return sent
+
+
+class MultiServerPhase(PhaseSampler):
+    """One direction against several servers at once, for aggregate capacity.
+
+    Each server gets its own ``ThroughputPhase`` with the full stream count
+    and all of them run concurrently on the loop. Sample events and
+    ``samples`` cover the combined bytes. The aggregate is the sum of the
+    per-server rates in fixed-duration mode, whose measurement windows line
+    up, and total bytes over the common wall time in fixed-byte mode.
+    ``per_server`` holds each server's own result after ``run``.
+    """
+
+    def __init__(self, servers: List[Dict], direction: str, options: "engine.TestOptions",
+                 emit: Optional["engine.EventCallback"] = None, interval: float = SAMPLE_INTERVAL,
+                 trace=None, session=None):
+        self.servers = servers
+        self.direction = direction
+        self.options = options
+        self.emit = emit or engine.ignore_event
+        self.interval = interval
+        self.phases = [ThroughputPhase(server, direction, options, None, interval, trace, session)
+                       for server in servers]
+        self.threads = sum(phase.threads for phase in self.phases)
+        self.samples: List[Tuple[float, float]] = []
+        self.per_server: List[Dict] = []
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def bytes(self) -> int:
+        return sum(phase.bytes for phase in self.phases)
+
+    def fraction(self, elapsed: float) -> float:
+        return min(phase.fraction(elapsed) for phase in self.phases)
+
+    async def run(self) -> float:
+        """Return the aggregate speed in bits per second."""
+        sampler = asyncio.ensure_future(self._sample())
+        tasks = [asyncio.ensure_future(phase.run()) for phase in self.phases]
+        cpu, started = time.thread_time(), time.perf_counter()
+        try:
+            speeds = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + [sampler]:
+                task.cancel()
+            await asyncio.gather(*tasks, sampler, return_exceptions=True)
+            self.cpu_seconds = time.thread_time() - cpu
+            self.elapsed = time.perf_counter() - started
+        self.per_server = [{"server": f"{server['sponsor']} ({server['country']})",
+                            "server_id": str(server.get("id", "")),
+                            "bps": speed, "bytes": phase.bytes}
+                           for server, phase, speed in zip(self.servers, self.phases, speeds)]
+        if self.options.duration:
+            return sum(speeds)
+        return self.bytes * 8 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def cpu_report(self) -> Dict:
+        # The streams share the loop thread, so CPU is measured once for all of them
+        report = engine.cpu_report(self.cpu_seconds, self.elapsed, self.bytes)
+        if self.direction == "upload":
+            report["method"] = self.phases[0].upload_method
+        else:
+            recv_calls = sum(phase.recv_calls for phase in self.phases)
+            parser_objects = sum(phase.parser_objects for phase in self.phases)
+            report["recv_calls"] = recv_calls
+            report["bytes_per_recv"] = (round(sum(phase.recv_bytes for phase in self.phases) / recv_calls)
+                                        if recv_calls else None)
+            report["parser_objects"] = parser_objects
+            report["parser_objects_per_second"] = (round(parser_objects / self.elapsed, 1)
+                                                   if self.elapsed > 0 else None)
+        return report
+
+
+# ---------------------------------------------------------------------------
+# Full test
+# ---------------------------------------------------------------------------
+
+async def run_speed_test(emit: Optional["engine.EventCallback"] = None,
+                         options: Optional["engine.TestOptions"] = None,
+                         selector=None, session=None) -> Dict:
+    """Coroutine version of ``engine.run_speed_test`` with the same events and result.
+
+    ``session`` is a ``session.Session`` whose pooled connections, DNS and
+    config are reused (``TestRunner`` keeps one per app). Without one, a
+    session is made for this test, around ``selector`` (a
+    ``servers.ServerSelector``, by default backed by the on-disk server
+    cache), and closed afterwards. With ``options.trace`` set the run's trace
+    is written there even when the test fails, so a timeout shows which
+    phase it was stuck in.
+    """
+    from session import Session
+    from tracing import Trace
+
+    options = options or engine.TestOptions()
+    own_session = session is None
+    session = session or Session(selector)
+    trace = Trace()
+    try:
+        return await _run_traced(emit or engine.ignore_event, options, session, trace)
+    finally:
+        if own_session:
+            await session.close()
+        if options.trace:
+            trace.write_chrome(options.trace)
+
+
+async def _run_traced(emit: "engine.EventCallback", options: "engine.TestOptions",
+                      session, trace) -> Dict:
+    import latency
+
+    await session.begin(cold=options.cold)
+
+    emit("status", "Initializing speed test...")
+    emit("progress", 0)
+
+    emit("status", "Finding best server...")
+    emit("progress", 10)
+    with trace.span("server") as info:
+        servers = await session.selector.select_top(options.servers, rediscover=options.rediscover)
+        best = servers[0]
+        info["reused"] = best.get("reused", False)
+        info["servers"] = len(servers)
+    names = [f"{server['sponsor']} ({server['country']})" for server in servers]
+    server_name = " + ".join(names)
+    emit("server", f"Server: {server_name}" if len(servers) == 1 else f"Servers: {', '.join(names)}")
+    emit("progress", 20)
+
+    # Idle latency, jitter and loss
+    latencies = {}
+    if options.probes > 0:
+        emit("status", "Measuring latency...")
+        with trace.span("latency") as info:
+            latencies["idle"] = await latency.measure_idle(best, options, session)
+            info["probes"] = options.probes
+    emit("progress", 25)
+
+    def make_phase(direction: str, progress: "engine.EventCallback"):
+        if options.processes > 0:
+            from workers import ProcessPhase
+            return ProcessPhase(session.worker_pool(options.processes), servers, direction, options,
+                                progress, trace=trace, session=session)
+        if len(servers) == 1:
+            return ThroughputPhase(best, direction, options, progress, trace=trace, session=session)
+        return MultiServerPhase(servers, direction, options, progress, trace=trace, session=session)
+
+    async def measure(phase) -> float:
+        # Loaded latency is probed against the best server alongside the phase
+        with trace.span(phase.direction) as info:
+            if options.probes <= 0:
+                speed = await phase.run()
+            else:
+                interval = latency.BUFFERBLOAT_INTERVAL if options.bufferbloat else latency.LOADED_INTERVAL
+                speed, latencies[phase.direction] = await latency.measure_during(
+                    best, options, phase.run(), interval, session)
+            info["bytes"] = phase.bytes
+            info["streams"] = phase.threads
+        return speed
+
+    # Download test
+    emit("status", "Testing download speed...")
+    emit("progress", 30)
+    download = make_phase("download", engine.phase_progress(emit, 30, 60))
+    download_speed = await measure(download)
+    emit("download", download_speed)
+    emit("progress", 60)
+
+    # Upload test
+    emit("status", "Testing upload speed...")
+    emit("progress", 70)
+    upload = make_phase("upload", engine.phase_progress(emit, 70, 90))
+    upload_speed = await measure(upload)
+    emit("upload", upload_speed)
+    emit("progress", 90)
+
+    # Ping: median idle RTT, or the server-selection latency without probes
+    idle = latencies.get("idle", {})
+    ping = idle.get("median", best["latency"])
+    emit("ping", ping)
+    emit("progress", 100)
+
+    now = datetime.now()
+    result = {
+        "timestamp": now.timestamp(),
+        "date": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "time": now.strftime("%H:%M:%S"),
+        "download": download_speed,
+        "upload": upload_speed,
+        "ping": ping,
+        "server": server_name,
+        "server_id": str(best.get("id", "")),
+        "server_reused": best.get("reused", False),
+        "settings": options.as_settings(),
+        "latency": latencies,
+        "durations": trace.durations(),
+        "trace": trace.breakdown(),
+        "samples": {
+            "interval": SAMPLE_INTERVAL,
+            "download": download.samples,
+            "upload": upload.samples,
+        },
+        "cpu": {"download": download.cpu_report(), "upload": upload.cpu_report()},
+        "session": session.usage(),
+    }
+    if len(servers) > 1:
+        result["servers"] = [{"server": name, "server_id": str(server.get("id", "")),
+                              "latency": server["latency"]} for name, server in zip(names, servers)]
+        result["per_server"] = {"download": download.per_server, "upload": upload.per_server}
+    if options.bufferbloat:
+        result["bufferbloat"] = latency.bufferbloat_report(latencies)
+    return result
+
+
+class TestRunner:
+    """Run tests on one shared event-loop thread and allow real cancellation.
+
+    ``on_done(result, error)`` is called from the loop thread once a test has
+    fully finished, including closing its connections; ``error`` is ``None``
+    on success and a ``CancelledError`` when the test was cancelled. Callers
+    marshal it onto their UI thread.
+
+    The runner owns a ``session.Session``, so repeated and scheduled tests
+    reuse its pooled connections, resolved addresses and configuration.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.future: Optional[Future] = None
+        self.task: Optional[asyncio.Task] = None
+        self.idle_callbacks: List[Callable[[], None]] = []
+        self.session = None  # session.Session, made on the loop thread by the first test
+        self.lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever,
+                                           name="speedtest-loop", daemon=True)
+            self.thread.start()
+        return self.loop
+
+    def is_running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    async def _run(self, emit, options) -> Dict:
+        from session import Session
+
+        self.task = asyncio.current_task()
+        if self.session is None:
+            self.session = Session()
+        try:
+            return await engine.run_speed_test_async(emit, options, self.session)
+        finally:
+            self.task = None
+
+    def run(self, emit: "engine.EventCallback", options: "engine.TestOptions") -> Dict:
+        """Run a test on the loop thread and wait for it; raises the test's error."""
+        with self.lock:
+            if self.is_running():
+                raise RuntimeError("a test is already running")
+            loop = self._ensure_loop()
+            self.future = asyncio.run_coroutine_threadsafe(self._run(emit, options), loop)
+        return self.future.result()
+
+    def start(self, emit: "engine.EventCallback", options: "engine.TestOptions",
+              on_done: Callable[[Optional[Dict], Optional[BaseException]], None]) -> bool:
+        """Start a test unless one is already running; returns whether it started."""
+        with self.lock:
+            if self.is_running():
+                return False
+            loop = self._ensure_loop()
+            self.future = asyncio.run_coroutine_threadsafe(self._run(emit, options), loop)
+
+        def finished(future: Future):
+            try:
+                if future.cancelled():
+                    on_done(None, asyncio.CancelledError())
+                elif future.exception() is not None:
+                    on_done(None, future.exception())
+                else:
+                    on_done(future.result(), None)
+            finally:
+                with self.lock:
+                    callbacks, self.idle_callbacks = self.idle_callbacks, []
+                for callback in callbacks:
+                    loop.call_soon_threadsafe(callback)
+
+        self.future.add_done_callback(finished)
+        return True
+
+    def call_soon(self, callback: Callable[[], None]) -> None:
+        """Run ``callback`` on the loop thread, starting the loop if needed."""
+        with self.lock:
+            loop = self._ensure_loop()
+        loop.call_soon_threadsafe(callback)
+
+    def when_idle(self, callback: Callable[[], None]) -> None:
+        """Run ``callback`` on the loop thread once no test is in flight."""
+        with self.lock:
+            if self.is_running():
+                self.idle_callbacks.append(callback)
+                return
+            loop = self._ensure_loop()
+        loop.call_soon_threadsafe(callback)
+
+    def cancel(self) -> bool:
+        """Cancel the running test; ``on_done`` fires after its connections are closed."""
+        with self.lock:
+            if not self.is_running() or self.loop is None:
+                return False
+
+            def cancel_task():
+                if self.task is not None:
+                    self.task.cancel()
+                elif self.future is not None:
+                    self.future.cancel()
+
+            self.loop.call_soon_threadsafe(cancel_task)
+            return True
+
+    def shutdown(self) -> None:
+        """Cancel any running test and stop the loop thread."""
+        self.cancel()
+        if self.loop is not None:
+            if self.future is not None:
+                try:
+                    self.future.result(TIMEOUT)
+                except BaseException:
+                    pass
+            if self.session is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result(TIMEOUT)
+                except BaseException:
+                    pass
+                self.session = None
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(TIMEOUT)
+            if not self.thread.is_alive():
+                # A loop stuck in a callback is left to the daemon thread rather than raising here
+                self.loop.close()
+            self.loop = None
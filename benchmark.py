@@ -0,0 +1,168 @@
+"""Offline benchmark of the measurement pipeline against ``mock_server.py``.
+
+Usage:
+    python benchmark.py --rate 200M --latency 20 --runs 3
+    python benchmark.py --download-rate 1G --upload-rate 100M --duration 5 --json bench.json
+    python benchmark.py --rate 50M --backend speedtest-cli
+
+The mock server runs in a subprocess so its CPU is not counted. Each run is a
+full test through the same entry points the GUIs use, with the async core's
+server list cached in a temporary directory instead of the user cache. For
+every run the report gives measured speeds and their accuracy against the
+shaped rates, ping against the injected latency, wall time, and this
+process's CPU seconds per Gbit moved in each throughput phase. The medians
+over all runs make engine changes comparable offline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import async_engine
+import engine
+from mock_server import add_server_arguments, parse_rate
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py")
+COLUMNS = (("download_mbps", "down Mbps"), ("download_accuracy", "down %"),
+           ("upload_mbps", "up Mbps"), ("upload_accuracy", "up %"),
+           ("ping", "ping ms"), ("wall", "wall s"), ("cpu", "cpu s"),
+           ("download_cpu_per_gbit", "down cpu/Gbit"), ("upload_cpu_per_gbit", "up cpu/Gbit"))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the speed test against a local mock server.")
+    parser.add_argument("--runs", type=int, default=3, help="tests to run (default: 3)")
+    parser.add_argument("--rate", type=parse_rate, metavar="RATE",
+                        help="shape both directions to RATE bits/s, e.g. 200M")
+    parser.add_argument("--json", metavar="FILE", help="also write the runs and medians to FILE")
+    add_server_arguments(parser)
+    engine.add_option_arguments(parser)
+    return parser
+
+
+def start_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    """Launch the mock server and return the process and its base URL."""
+    command = [sys.executable, SERVER_SCRIPT, "--port", "0", "--latency", str(args.latency),
+               "--server-count", str(max(args.server_count, args.servers))]
+    if args.download_rate:
+        command += ["--download-rate", str(args.download_rate)]
+    if args.upload_rate:
+        command += ["--upload-rate", str(args.upload_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError(f"mock server exited with status {process.returncode}")
+    return process, line.rsplit(" ", 1)[-1].strip()
+
+
+class PhaseClock:
+    """Track this process's CPU time through each throughput phase from test events."""
+
+    def __init__(self):
+        self.started: Dict[str, float] = {}
+        self.cpu: Dict[str, float] = {}
+
+    def __call__(self, kind: str, value: object) -> None:
+        if kind == "status" and str(value).startswith("Testing "):
+            self.started[str(value).split()[1]] = time.process_time()
+        elif kind in ("download", "upload") and kind in self.started:
+            self.cpu[kind] = time.process_time() - self.started[kind]
+
+
+def run_pipeline(options: engine.TestOptions, emit: engine.EventCallback, selector) -> Dict:
+    if options.backend == "speedtest-cli":
+        return engine.run_speed_test(emit, options)
+    return asyncio.run(async_engine.run_speed_test(emit, options, selector))
+
+
+def measure_run(options: engine.TestOptions, selector, rates: Dict[str, Optional[float]]) -> Dict:
+    """Run one test and return its benchmark row."""
+    clock = PhaseClock()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = run_pipeline(options, clock, selector)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    phase_bytes = {row["name"]: row.get("bytes") for row in result.get("trace", [])}
+    row = {"ping": result["ping"], "wall": wall, "cpu": cpu}
+    for direction in ("download", "upload"):
+        bps = result[direction]
+        row[f"{direction}_mbps"] = bps / 1e6
+        row[f"{direction}_accuracy"] = bps / rates[direction] * 100 if rates[direction] else None
+        moved = phase_bytes.get(direction)
+        row[f"{direction}_cpu_per_gbit"] = (clock.cpu[direction] / (moved * 8 / 1e9)
+                                            if moved and direction in clock.cpu else None)
+    return row
+
+
+def medians(runs: List[Dict]) -> Dict:
+    summary = {}
+    for key, _ in COLUMNS:
+        values = [run[key] for run in runs if run.get(key) is not None]
+        summary[key] = statistics.median(values) if values else None
+    return summary
+
+
+def format_row(label: str, row: Dict) -> str:
+    cells = [f"{label:>7}"]
+    for key, title in COLUMNS:
+        value = row.get(key)
+        cells.append(f"{'-' if value is None else f'{value:.2f}':>{len(title)}}")
+    return "  ".join(cells)
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    args.download_rate = args.download_rate or args.rate
+    args.upload_rate = args.upload_rate or args.rate
+    options = engine.options_from_args(args)
+    rates = {"download": args.download_rate, "upload": args.upload_rate}
+
+    process, url = start_server(args)
+    runs: List[Dict] = []
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            from servers import ServerSelector
+
+            # The async core takes its URLs from module constants; speedtest-cli's
+            # fixed speedtest.net URLs are sent to the mock as an HTTP proxy
+            async_engine.CONFIG_URL = f"{url}/speedtest-config.php"
+            async_engine.SERVER_LIST_URLS = [f"{url}/speedtest-servers-static.php"]
+            os.environ["http_proxy"] = url
+            selector = ServerSelector(cache_path=os.path.join(cache, "servers.json"))
+
+            print(f"{options.backend} backend, {options.mode}, latency {args.latency:g} ms, "
+                  f"shaped down {args.download_rate or 0:,.0f} / up {args.upload_rate or 0:,.0f} bps")
+            print("  ".join([f"{'run':>7}"] + [title for _, title in COLUMNS]))
+            for i in range(args.runs):
+                try:
+                    runs.append(measure_run(options, selector, rates))
+                except Exception as e:
+                    print(f"Error in run {i + 1}: {e}")
+                    continue
+                print(format_row(str(i + 1), runs[-1]), flush=True)
+    finally:
+        process.terminate()
+        process.wait()
+
+    if not runs:
+        return 1
+    summary = medians(runs)
+    print(format_row("median", summary))
+    if args.json:
+        report = {"backend": options.backend, "settings": options.as_settings(), "latency": args.latency,
+                  "download_rate": args.download_rate, "upload_rate": args.upload_rate,
+                  "runs": runs, "median": summary}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
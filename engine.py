@@ -0,0 +1,346 @@
+"""GUI-free speed test pipeline shared by the Tk, Qt and headless front ends.
+
+The default backend is the asyncio core in ``async_engine``; the original
+speedtest-cli pipeline is kept as the ``speedtest-cli`` backend.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Failure categories, matching the exceptions the GUIs already distinguish
+ERROR_CONFIG = "config"
+ERROR_NO_SERVERS = "no_servers"
+ERROR_GENERIC = "generic"
+
+BACKENDS = ("async", "speedtest-cli")
+PROBE_METHODS = ("http", "tcp")
+BUFFERBLOAT_DURATION = 10.0
+CPU_LIMITED_SHARE = 0.9  # Share of a core above which a phase is reported as CPU-limited
+
+EventCallback = Callable[[str, object], None]
+
+
+class SpeedTestError(Exception):
+    pass
+
+
+class ConfigRetrievalError(SpeedTestError):
+    """The speedtest.net configuration could not be fetched or parsed."""
+
+
+class NoMatchedServers(SpeedTestError):
+    """No usable test server was found."""
+
+
+@dataclass
+class TestOptions:
+    """Measurement settings; recorded with every result under ``settings``.
+
+    With ``duration`` unset each phase transfers a fixed set of files, as
+    speedtest-cli does (optionally with ``threads`` streams). With
+    ``duration`` set, each phase
+    keeps ``threads`` streams busy for ``warmup + duration`` seconds and only
+    the bytes after the warm-up window count.
+
+    ``probes`` latency probes (``probe_method`` "http" or "tcp") are sent
+    before the download phase and probing continues through both phases to
+    record loaded latency; see ``latency.py``. ``bufferbloat`` turns this
+    into a latency-under-load test: phases run for a fixed time (default
+    ``BUFFERBLOAT_DURATION``), probes are sent more often and the result gets
+    a ``bufferbloat`` report with a responsiveness grade.
+
+    ``servers`` above 1 runs each throughput phase against that many of the
+    best servers at once; the result gives the aggregate speed plus
+    ``servers`` and ``per_server`` entries (async backend).
+
+    ``processes`` above 0 runs the throughput streams (or, with the
+    speedtest-cli backend, the whole test) in that many worker processes;
+    see ``workers.py``.
+
+    ``cold`` makes the async core drop its session's pooled connections,
+    cached DNS and config first, so the test includes the setup cost.
+    ``trace`` is a file to write each run's Chrome trace-event JSON to; it
+    is not a measurement setting and is left out of ``as_settings``.
+    """
+    threads: Optional[int] = None
+    duration: Optional[float] = None
+    warmup: float = 2.0
+    backend: str = "async"
+    rediscover: bool = False
+    probes: int = 10
+    probe_method: str = "http"
+    bufferbloat: bool = False
+    servers: int = 1
+    processes: int = 0
+    cold: bool = False
+    trace: Optional[str] = None
+
+    def __post_init__(self):
+        # Bufferbloat mode needs saturating fixed-time phases and latency probes
+        if self.bufferbloat:
+            self.duration = self.duration or BUFFERBLOAT_DURATION
+            self.probes = self.probes if self.probes > 0 else TestOptions.probes
+
+    @property
+    def mode(self) -> str:
+        return "fixed-duration" if self.duration else "fixed-bytes"
+
+    def as_settings(self) -> Dict:
+        settings = asdict(self)
+        del settings["trace"]
+        settings["mode"] = self.mode
+        if not self.duration:
+            settings["warmup"] = 0.0
+        return settings
+
+
+def add_option_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the measurement settings to a command-line parser."""
+    group = parser.add_argument_group("measurement")
+    group.add_argument("--threads", type=int, metavar="N",
+                       help="concurrent connections per phase (default: 4, or speedtest-cli's own)")
+    group.add_argument("--duration", type=float, metavar="SECONDS",
+                       help="measure each phase for a fixed time instead of a fixed byte count")
+    group.add_argument("--warmup", type=float, default=2.0, metavar="SECONDS",
+                       help="seconds excluded at the start of a fixed-duration phase (default: 2)")
+    group.add_argument("--backend", choices=BACKENDS, default="async",
+                       help="measurement backend (default: async)")
+    group.add_argument("--rediscover", action="store_true",
+                       help="ignore cached and remembered servers and run full server discovery")
+    group.add_argument("--probes", type=int, default=10, metavar="N",
+                       help="idle latency probes per test, 0 keeps the server-selection ping "
+                            "and skips loaded latency (default: 10)")
+    group.add_argument("--probe-method", choices=PROBE_METHODS, default="http",
+                       help="time HTTP requests on a kept-alive connection, or TCP connects (default: http)")
+    group.add_argument("--bufferbloat", action="store_true",
+                       help="latency-under-load mode: saturate the link for a fixed time "
+                            f"(--duration, default {BUFFERBLOAT_DURATION:g}s) while probing and "
+                            "grade the added latency (async backend)")
+    group.add_argument("--servers", type=int, default=1, metavar="K",
+                       help="measure against the K best servers at once and report the aggregate "
+                            "and per-server speeds (async backend, default: 1)")
+    group.add_argument("--processes", type=int, default=0, metavar="N",
+                       help="measure in N worker processes so the app process stays responsive "
+                            "(default: 0, measure in the app process)")
+    group.add_argument("--cold", action="store_true",
+                       help="drop pooled connections and cached DNS/config before each test "
+                            "so setup cost is included (async backend)")
+    group.add_argument("--trace", metavar="FILE",
+                       help="write a Chrome trace-event JSON of each test's phases and streams to FILE "
+                            "(overwritten per test; open it in Perfetto or chrome://tracing)")
+
+
+def options_from_args(args: argparse.Namespace) -> TestOptions:
+    return TestOptions(threads=args.threads, duration=args.duration, warmup=args.warmup,
+                       backend=args.backend, rediscover=args.rediscover,
+                       probes=args.probes, probe_method=args.probe_method,
+                       bufferbloat=args.bufferbloat, servers=args.servers, processes=args.processes,
+                       cold=args.cold, trace=args.trace)
+
+
+def options_from_argv(argv: List[str]) -> TestOptions:
+    """Parse measurement settings from a GUI's command line, ignoring other flags."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_option_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    return options_from_args(args)
+
+
+def ignore_event(kind: str, value: object) -> None:
+    pass
+
+
+def phase_progress(emit: EventCallback, start: int, end: int) -> EventCallback:
+    """Forward a phase's events and turn each sample into a progress value between start and end."""
+    def forward(kind: str, value: object) -> None:
+        emit(kind, value)
+        if kind == "sample":
+            emit("progress", int(start + (end - start) * value["fraction"]))
+    return forward
+
+
+def cpu_report(cpu_seconds: float, elapsed: float, nbytes: int) -> Dict:
+    """CPU cost of a throughput phase, stored with the result under ``cpu``.
+
+    ``share`` is CPU seconds per wall second. Near 1.0 the measuring thread
+    was saturated, so the result may be capped by this machine rather than
+    the link (``limited``).
+    """
+    share = cpu_seconds / elapsed if elapsed > 0 else 0.0
+    return {
+        "seconds": round(cpu_seconds, 4),
+        "share": round(share, 3),
+        "ns_per_byte": round(cpu_seconds * 1e9 / nbytes, 3) if nbytes else None,
+        "limited": share >= CPU_LIMITED_SHARE,
+    }
+
+
+def _measure(st, direction: str, options: TestOptions, emit: EventCallback,
+             trace) -> Tuple[float, int, Dict]:
+    """Run one phase; returns its speed, the bytes it moved and its CPU report."""
+    if options.duration:
+        from async_engine import ThroughputPhase
+        phase = ThroughputPhase(st.best, direction, options, emit, trace=trace)
+        return asyncio.run(phase.run()), phase.bytes, phase.cpu_report()
+
+    def callback(i, count, start=False, end=False):
+        # speedtest-cli reports request completion only, so there is no live rate
+        if end:
+            emit("sample", {"phase": direction, "fraction": (i + 1) / count})
+
+    # speedtest-cli measures from its own threads, so count the whole process
+    cpu, started = time.process_time(), time.perf_counter()
+    if direction == "download":
+        speed, moved = st.download(callback=callback, threads=options.threads), st.results.bytes_received
+    else:
+        speed, moved = st.upload(callback=callback, threads=options.threads), st.results.bytes_sent
+    return speed, moved, cpu_report(time.process_time() - cpu, time.perf_counter() - started, moved)
+
+
+def run_speed_test(emit: Optional[EventCallback] = None,
+                   options: Optional[TestOptions] = None) -> Dict:
+    """Run one full speed test and return the result record (blocking).
+
+    Progress is reported through ``emit(kind, value)`` where ``kind`` is one of
+    ``status``, ``server``, ``progress``, ``download``, ``upload``, ``ping``
+    or ``sample`` (a dict with ``phase``, ``elapsed``, ``bps``, ``bytes`` and
+    ``fraction``, sent every 100 ms during throughput phases; the
+    speedtest-cli backend only reports ``phase`` and ``fraction``).
+    Speeds are reported in bits per second. Errors propagate to the caller;
+    use ``describe_error`` to turn them into user-facing text.
+    """
+    options = options or TestOptions()
+    if options.backend == "speedtest-cli" and not options.processes:
+        return run_speedtest_cli(emit, options)
+    return asyncio.run(run_speed_test_async(emit, options))
+
+
+async def run_speed_test_async(emit: Optional[EventCallback] = None,
+                               options: Optional[TestOptions] = None, session=None) -> Dict:
+    """Coroutine form of ``run_speed_test``; cancelling it aborts the test.
+
+    ``session`` (a ``session.Session``) is reused by the async backend.
+    """
+    options = options or TestOptions()
+    if options.backend == "speedtest-cli" and options.processes:
+        import workers
+        return await workers.run_speedtest_cli(emit, options, session)
+    if options.backend == "speedtest-cli":
+        # speedtest-cli blocks, so it runs in the loop's executor and cannot be interrupted
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, run_speedtest_cli, emit, options)
+    import async_engine
+    return await async_engine.run_speed_test(emit, options, session=session)
+
+
+def run_speedtest_cli(emit: Optional[EventCallback] = None,
+                      options: Optional[TestOptions] = None) -> Dict:
+    """Run the test through speedtest-cli, as the app originally did."""
+    import speedtest
+    from tracing import Trace
+
+    emit = emit or ignore_event
+    options = options or TestOptions()
+    trace = Trace()
+    try:
+        return _run_speedtest_cli(emit, options, speedtest, trace)
+    finally:
+        if options.trace:
+            trace.write_chrome(options.trace)
+
+
+def _run_speedtest_cli(emit: EventCallback, options: TestOptions, speedtest, trace) -> Dict:
+
+    emit("status", "Initializing speed test...")
+    emit("progress", 0)
+
+    st = speedtest.Speedtest()
+
+    emit("status", "Finding best server...")
+    emit("progress", 10)
+    with trace.span("server"):
+        st.get_best_server()
+    usage = {}  # CPU report per throughput phase
+
+    server_info = f"Server: {st.best['sponsor']} ({st.best['country']})"
+    emit("server", server_info)
+    emit("progress", 20)
+
+    # Download test
+    emit("status", "Testing download speed...")
+    emit("progress", 30)
+    with trace.span("download") as info:
+        download_speed, info["bytes"], usage["download"] = _measure(
+            st, "download", options, phase_progress(emit, 30, 60), trace)
+    emit("download", download_speed)
+    emit("progress", 60)
+
+    # Upload test
+    emit("status", "Testing upload speed...")
+    emit("progress", 70)
+    with trace.span("upload") as info:
+        upload_speed, info["bytes"], usage["upload"] = _measure(
+            st, "upload", options, phase_progress(emit, 70, 90), trace)
+    emit("upload", upload_speed)
+    emit("progress", 90)
+
+    # Ping
+    ping = st.results.ping
+    emit("ping", ping)
+    emit("progress", 100)
+
+    now = datetime.now()
+    return {
+        "timestamp": now.timestamp(),
+        "date": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "time": now.strftime("%H:%M:%S"),
+        "download": download_speed,
+        "upload": upload_speed,
+        "ping": ping,
+        "server": f"{st.best['sponsor']} ({st.best['country']})",
+        "server_id": str(st.best.get("id", "")),
+        "settings": options.as_settings(),
+        "durations": trace.durations(),
+        "trace": trace.breakdown(),
+        "cpu": usage,
+    }
+
+
+def completion_status(result: Dict) -> str:
+    """Status line for a finished test, noting the bufferbloat grade and CPU-limited phases."""
+    notes = []
+    grade = result.get("bufferbloat", {}).get("grade")
+    if grade:
+        notes.append(f"bufferbloat grade {grade}")
+    limited = [phase for phase, report in (result.get("cpu") or {}).items() if report.get("limited")]
+    if limited:
+        notes.append(f"{' and '.join(limited)} CPU-limited")
+    if notes:
+        return f"✅ Test Completed Successfully ({'; '.join(notes)})"
+    return "✅ Test Completed Successfully"
+
+
+def describe_error(error: BaseException) -> Tuple[str, str, str]:
+    """Return ``(category, message, status)`` for an exception raised by a test."""
+    config_errors = [ConfigRetrievalError]
+    server_errors = [NoMatchedServers]
+    speedtest = sys.modules.get("speedtest")
+    if speedtest is not None:
+        config_errors.append(speedtest.ConfigRetrievalError)
+        server_errors.append(speedtest.NoMatchedServers)
+
+    if isinstance(error, tuple(config_errors)):
+        return (ERROR_CONFIG,
+                "Failed to retrieve speedtest configuration. Please check your internet connection.",
+                "❌ Configuration Error")
+    if isinstance(error, tuple(server_errors)):
+        return (ERROR_NO_SERVERS,
+                "No speedtest servers found. Please check your internet connection.",
+                "❌ No Servers Found")
+    return (ERROR_GENERIC,
+            f"Test failed: {str(error)}\n\nPlease check:\n- Internet connection\n- Firewall settings\n- VPN configuration",
+            "❌ Test Failed")
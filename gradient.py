@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+from PIL import Image, ImageColor
+
+
+class GradientRenderer:
+    """Render vertical background gradients and cache them per theme and size"""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def render(self, theme_name, theme, width, height, wrap=None):
+        """Return the gradient for (theme_name, width, height)
+
+        `wrap` converts the PIL image before it is cached, e.g. into an
+        ImageTk.PhotoImage, so cache hits cost no image work at all.
+        """
+        key = (theme_name, width, height)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        image = self.build(theme["bg1"], theme["bg2"], width, height)
+        value = wrap(image) if wrap else image
+
+        self._cache[key] = value
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return value
+
+    @staticmethod
+    def build(color1, color2, width, height):
+        """Build a single 1xH column and stretch it to the full width"""
+        c1 = ImageColor.getrgb(color1)
+        c2 = ImageColor.getrgb(color2)
+
+        column = []
+        for y in range(height):
+            ratio = y / height
+            column.append(tuple(int(a * (1 - ratio) + b * ratio) for a, b in zip(c1, c2)))
+
+        image = Image.new("RGB", (1, height))
+        image.putdata(column)
+        return image.resize((width, height), Image.Resampling.NEAREST)
+
+    def clear(self):
+        self._cache.clear()
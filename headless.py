@@ -0,0 +1,182 @@
+"""Run speed tests without a GUI, for probes and scheduled jobs.
+
+Usage:
+    python headless.py --count 10 --interval 300 --output results.jsonl
+    python headless.py --count 0 --interval 300 --history speed_test_history.db
+    python internet_speedtest.py --headless --count 1
+    python headless.py --stats day --history speed_test_history.db
+    python headless.py --export history.cols --history speed_test_history.db
+
+Each test is written as one JSON object per line.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List, Optional
+
+import engine
+import metrics
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run internet speed tests without a GUI.")
+    parser.add_argument("--headless", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("-n", "--count", type=int, default=1,
+                        help="number of tests to run, 0 runs forever (default: 1)")
+    parser.add_argument("-i", "--interval", type=float, default=60.0,
+                        help="seconds between the start of consecutive tests (default: 60)")
+    parser.add_argument("--jitter", type=float, default=0.0, metavar="SECONDS",
+                        help="delay each test by a random 0..SECONDS so probes spread out (default: 0)")
+    parser.add_argument("-o", "--output",
+                        help="append results to this file instead of writing to stdout")
+    parser.add_argument("--history", metavar="DB",
+                        help="also append successful results to this history database")
+    parser.add_argument("--stats", nargs="?", const="", metavar="WINDOW",
+                        help="print download/upload/ping statistics from the history database "
+                             "for WINDOW (hour, day, week, all) or every window, and exit")
+    parser.add_argument("--export", metavar="PATH",
+                        help="write the history database to PATH (.csv, .jsonl or .cols) and exit")
+    parser.add_argument("--export-format", choices=("csv", "jsonl", "columnar"),
+                        help="export format when PATH has another extension")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print progress messages to stderr")
+    engine.add_option_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    return parser
+
+
+def write_record(record: dict, output: Optional[str]) -> None:
+    line = json.dumps(record, ensure_ascii=False)
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    else:
+        print(line, flush=True)
+
+
+def run_once(options: engine.TestOptions, verbose: bool = False, runner=None) -> dict:
+    """Run a single test and return either its result or an error record.
+
+    With an ``async_engine.TestRunner`` the test reuses the runner's session
+    (pooled connections, cached DNS and config) from earlier tests.
+    """
+    def emit(kind, value):
+        if verbose and kind in ("status", "server"):
+            print(value, file=sys.stderr, flush=True)
+
+    try:
+        if runner is not None:
+            return runner.run(emit, options)
+        return engine.run_speed_test(emit, options)
+    except Exception as e:
+        category, message, _ = engine.describe_error(e)
+        return {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "error": category,
+            "message": str(e) or message,
+        }
+
+
+def missing_history(path: str) -> bool:
+    """Report a history database that does not exist, rather than creating an empty one."""
+    if os.path.exists(path):
+        return False
+    print(f"Error: no history database at {path}", file=sys.stderr)
+    return True
+
+
+def print_stats(path: str, window: str) -> int:
+    """Write rolling statistics for ``window`` (every window if empty) as one JSON object."""
+    from history_stats import RollingStats
+    from history_store import HistoryStore
+    if missing_history(path):
+        return 2
+    store = HistoryStore(path, legacy_file=None)
+    try:
+        stats = RollingStats.from_store(store)
+        if not window:
+            report = stats.summaries()
+        else:
+            try:
+                report = stats.summary(window)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 2
+    finally:
+        store.close()
+    print(json.dumps(report, ensure_ascii=False), flush=True)
+    return 0
+
+
+def export(path: str, output: str, fmt: Optional[str]) -> int:
+    """Stream the history database at ``path`` into an export file."""
+    from history_export import export_history
+    from history_store import HistoryStore
+    if missing_history(path):
+        return 2
+    store = HistoryStore(path, legacy_file=None)
+    try:
+        rows = export_history(store, output, fmt)
+    except (OSError, ValueError) as e:
+        print(f"Error exporting history: {e}", file=sys.stderr)
+        return 2
+    finally:
+        store.close()
+    print(f"Exported {rows} results to {output}", file=sys.stderr)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.stats is not None or args.export:
+        from history_store import DEFAULT_HISTORY_DB
+        if args.export:
+            return export(args.history or DEFAULT_HISTORY_DB, args.export, args.export_format)
+        return print_stats(args.history or DEFAULT_HISTORY_DB, args.stats)
+    options = engine.options_from_args(args)
+
+    store = None
+    if args.history:
+        from history_store import HistoryStore
+        store = HistoryStore(args.history, legacy_file=None)
+    registry = metrics.start_from_args(args)
+    from async_engine import TestRunner
+    runner = TestRunner()
+
+    failures = 0
+    completed = 0
+    try:
+        while args.count <= 0 or completed < args.count:
+            started = time.monotonic()
+            record = run_once(options, args.verbose, runner)
+            write_record(record, args.output)
+            completed += 1
+            if "error" in record:
+                failures += 1
+                if registry is not None:
+                    registry.observe_failure(record["error"])
+            else:
+                if store is not None:
+                    store.append(record)
+                if registry is not None:
+                    registry.observe_result(record)
+
+            if args.count > 0 and completed >= args.count:
+                break
+            delay = args.interval - (time.monotonic() - started) + random.uniform(0, args.jitter)
+            time.sleep(max(0.0, delay))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.shutdown()
+        if store is not None:
+            store.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Compact column-oriented container for speed test results.
+
+Each field is a typed ``array.array`` column, so a result costs 40 bytes
+instead of a dict with two date strings. Iteration yields ``HistoryRow``
+views that read straight from the columns; they support both attribute and
+``row["download"]`` access so display code written for dicts keeps working.
+
+``servers`` is a display-only list beside the typed columns: the server
+names of a multi-server result, ``None`` otherwise. It is not one of
+``FIELDS``, so it is neither counted in ``nbytes`` nor exported.
+"""
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+FIELDS = ("timestamp", "download", "upload", "ping", "server_id")
+TYPECODES = {"timestamp": "d", "download": "d", "upload": "d", "ping": "d", "server_id": "q"}
+NO_SERVER = -1
+
+
+def parse_server_id(value) -> int:
+    """Return a numeric server id, or NO_SERVER if it is missing or not numeric."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NO_SERVER
+
+
+def server_names(record) -> Optional[Tuple[str, ...]]:
+    """Return the names of every server a multi-server result used, else None."""
+    servers = record.get("servers")
+    if not servers or len(servers) < 2:
+        return None
+    return tuple(server["server"] if isinstance(server, dict) else server for server in servers)
+
+
+class HistoryRow:
+    """Read-only view of one result; valid until its container is modified."""
+    __slots__ = ("_columns", "_index")
+
+    def __init__(self, columns: "HistoryColumns", index: int):
+        self._columns = columns
+        self._index = index
+
+    @property
+    def timestamp(self) -> float:
+        return self._columns.timestamp[self._index]
+
+    @property
+    def download(self) -> float:
+        return self._columns.download[self._index]
+
+    @property
+    def upload(self) -> float:
+        return self._columns.upload[self._index]
+
+    @property
+    def ping(self) -> float:
+        return self._columns.ping[self._index]
+
+    @property
+    def server_id(self) -> int:
+        return self._columns.server_id[self._index]
+
+    @property
+    def servers(self) -> Optional[Tuple[str, ...]]:
+        return self._columns.servers[self._index]
+
+    @property
+    def date(self) -> str:
+        return datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    @property
+    def time(self) -> str:
+        return datetime.fromtimestamp(self.timestamp).strftime("%H:%M:%S")
+
+    def __getitem__(self, key: str):
+        if key in FIELDS or key in ("servers", "date", "time"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def as_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in FIELDS}
+
+    def __repr__(self):
+        return f"HistoryRow({self.as_dict()!r})"
+
+
+class HistoryColumns:
+    """Append-only columns of results, optionally bounded to the newest ``maxlen``."""
+
+    def __init__(self, maxlen: Optional[int] = None):
+        self.maxlen = maxlen
+        for name in FIELDS:
+            setattr(self, name, array(TYPECODES[name]))
+        self.servers: List[Optional[Tuple[str, ...]]] = []
+
+    @classmethod
+    def from_records(cls, records: Iterable, maxlen: Optional[int] = None) -> "HistoryColumns":
+        columns = cls(maxlen)
+        columns.extend(records)
+        return columns
+
+    def append_values(self, timestamp: float, download: float, upload: float,
+                      ping: float, server_id: int = NO_SERVER,
+                      servers: Optional[Tuple[str, ...]] = None) -> None:
+        self.timestamp.append(timestamp)
+        self.download.append(download or 0.0)
+        self.upload.append(upload or 0.0)
+        self.ping.append(ping or 0.0)
+        self.server_id.append(server_id)
+        self.servers.append(servers)
+        if self.maxlen is not None and len(self.timestamp) > self.maxlen:
+            self._trim(len(self.timestamp) - self.maxlen)
+
+    def append(self, record: Union[Dict, HistoryRow]) -> None:
+        """Append a result dict (as produced by the engine) or a row view."""
+        self.append_values(record["timestamp"], record["download"], record["upload"],
+                           record["ping"], parse_server_id(record.get("server_id")), server_names(record))
+
+    def extend(self, records: Iterable) -> None:
+        for record in records:
+            self.append(record)
+
+    def _trim(self, count: int) -> None:
+        for name in FIELDS:
+            del getattr(self, name)[:count]
+        del self.servers[:count]
+
+    def clear(self) -> None:
+        self._trim(len(self))
+
+    def column(self, name: str) -> array:
+        return getattr(self, name)
+
+    def nbytes(self) -> int:
+        return sum(len(col) * col.itemsize for col in map(self.column, FIELDS))
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sliced = HistoryColumns()
+            for name in FIELDS:
+                setattr(sliced, name, getattr(self, name)[index])
+            sliced.servers = self.servers[index]
+            return sliced
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return HistoryRow(self, index)
+
+    def __iter__(self) -> Iterator[HistoryRow]:
+        for i in range(len(self)):
+            yield HistoryRow(self, i)
+
+    def __reversed__(self) -> Iterator[HistoryRow]:
+        for i in range(len(self) - 1, -1, -1):
+            yield HistoryRow(self, i)
@@ -0,0 +1,226 @@
+"""Streaming export of the result history, and readers for the exported files.
+
+Three formats, picked by ``fmt`` or the file extension:
+
+* ``csv``: one row per result with the core fields and server name;
+* ``jsonl``: one full result object per line, including latency, samples
+  and settings;
+* ``columnar`` (``.cols``): the core numeric fields as raw little-endian
+  columns in row groups, like a minimal Parquet file. The file is
+  ``MAGIC`` followed by groups, each an 8-byte header (row count, reserved)
+  and then one packed column per ``history_columns.FIELDS`` entry.
+  ``ColumnarReader`` memory-maps it and hands out zero-copy column views.
+
+Exports read the store in chunks and write through a temporary file, so
+memory use stays flat and a failed export never leaves a partial file.
+"""
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from assets import write_atomic
+from history_columns import FIELDS, TYPECODES, NO_SERVER, HistoryColumns
+
+FORMATS = ("csv", "jsonl", "columnar")
+EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".cols": "columnar"}
+CSV_FIELDS = ("timestamp", "date", "download", "upload", "ping", "server_id", "server")
+CHUNK_SIZE = 65536
+MAGIC = b"SPDHCOL1"
+GROUP_HEADER = struct.Struct("<II")
+ITEM_SIZE = 8  # Every column is float64 or int64
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown export format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"cannot tell the export format from {path!r}; "
+                         f"use one of {', '.join(EXTENSIONS)} or pass a format")
+    return EXTENSIONS[extension]
+
+
+def export_history(store, path: str, fmt: Optional[str] = None, start: Optional[float] = None,
+                   end: Optional[float] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Write results with ``start <= ts < end`` to ``path``; returns the row count."""
+    fmt = detect_format(path, fmt)
+    written = 0
+
+    def save(tmp_path):
+        nonlocal written
+        if fmt == "columnar":
+            with open(tmp_path, "wb") as f:
+                written = write_columnar(store.column_chunks(start, end, chunk_size), f)
+        else:
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                records = store.range(start, end, chunk_size=min(chunk_size, 1000))
+                written = (write_csv if fmt == "csv" else write_jsonl)(records, f)
+
+    write_atomic(path, save)
+    return written
+
+
+def write_csv(records: Iterable[Dict], f) -> int:
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+def write_jsonl(records: Iterable[Dict], f) -> int:
+    count = 0
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False))
+        f.write("\n")
+        count += 1
+    return count
+
+
+def write_columnar(chunks: Iterable[HistoryColumns], f) -> int:
+    """Write each chunk of columns as one row group; returns the row count."""
+    f.write(MAGIC)
+    count = 0
+    for columns in chunks:
+        rows = len(columns)
+        if not rows:
+            continue
+        f.write(GROUP_HEADER.pack(rows, 0))
+        for name in FIELDS:
+            column = columns.column(name)
+            if sys.byteorder != "little":
+                column = array(column.typecode, column)
+                column.byteswap()
+            f.write(column.tobytes())
+        count += rows
+    return count
+
+
+def iter_csv(path: str) -> Iterator[Dict]:
+    """Yield results from a CSV export one at a time."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            record: Dict = dict(row)
+            for key in ("timestamp", "download", "upload", "ping"):
+                record[key] = float(row[key]) if row.get(key) else None
+            yield record
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """Yield results from a JSONL export one at a time."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ColumnarReader:
+    """Memory-mapped access to a columnar export.
+
+    ``row_groups()`` yields a dict of column views per group without copying;
+    views must be released (or dropped) before ``close()``. Iterating yields
+    ``(timestamp, download, upload, ping, server_id)`` tuples.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a columnar history export")
+        self.groups = self._index()
+
+    def _index(self) -> List[Tuple[int, int]]:
+        """Return ``(offset of first column, rows)`` for each row group."""
+        groups = []
+        offset, size = len(MAGIC), len(self.map)
+        while offset < size:
+            rows, _ = GROUP_HEADER.unpack_from(self.map, offset)
+            offset += GROUP_HEADER.size
+            end = offset + rows * ITEM_SIZE * len(FIELDS)
+            if end > size:
+                raise ValueError(f"{self.path} is truncated")
+            groups.append((offset, rows))
+            offset = end
+        return groups
+
+    def __len__(self) -> int:
+        return sum(rows for _, rows in self.groups)
+
+    def _column(self, offset: int, rows: int, name: str):
+        start = offset + FIELDS.index(name) * rows * ITEM_SIZE
+        raw = memoryview(self.map)[start:start + rows * ITEM_SIZE]
+        if sys.byteorder == "little":
+            return raw.cast(TYPECODES[name])
+        column = array(TYPECODES[name], raw.tobytes())
+        raw.release()
+        column.byteswap()
+        return column
+
+    def row_groups(self, fields: Iterable[str] = FIELDS) -> Iterator[Dict[str, memoryview]]:
+        for offset, rows in self.groups:
+            yield {name: self._column(offset, rows, name) for name in fields}
+
+    def column(self, name: str) -> array:
+        """Copy one whole column into an array (8 bytes per row)."""
+        values = array(TYPECODES[name])
+        for group in self.row_groups((name,)):
+            values.extend(group[name])
+            if isinstance(group[name], memoryview):
+                group[name].release()
+        return values
+
+    def __iter__(self) -> Iterator[Tuple[float, float, float, float, int]]:
+        for group in self.row_groups():
+            views = [group[name] for name in FIELDS]
+            try:
+                yield from zip(*views)
+            finally:
+                for view in views:
+                    if isinstance(view, memoryview):
+                        view.release()
+
+    def records(self) -> Iterator[Dict]:
+        """Yield results as dicts, in the shape ``HistoryStore`` returns minus ``extra``."""
+        for ts, download, upload, ping, server_id in self:
+            moment = datetime.fromtimestamp(ts)
+            record = {"timestamp": ts, "date": moment.strftime("%Y-%m-%d %H:%M:%S"),
+                      "download": download, "upload": upload, "ping": ping}
+            if server_id != NO_SERVER:
+                record["server_id"] = str(server_id)
+            yield record
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self) -> "ColumnarReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_export(path: str, fmt: Optional[str] = None) -> Iterator[Dict]:
+    """Yield results from an export of any format without loading it all."""
+    fmt = detect_format(path, fmt)
+    if fmt == "csv":
+        yield from iter_csv(path)
+    elif fmt == "jsonl":
+        yield from iter_jsonl(path)
+    else:
+        with ColumnarReader(path) as reader:
+            yield from reader.records()
@@ -0,0 +1,335 @@
+"""Rolling statistics over the result history, updated one result at a time.
+
+For each of download, upload and ping, ``RollingStats`` keeps:
+
+* sliding time windows (last hour, day, week by default). Each holds its
+  values in arrival order plus a sorted copy, so min/max, p5/median/p95 are
+  exact and adding or expiring a value is a bisect instead of a rescan;
+* an all-time summary of constant size: Welford mean/variance, min/max and
+  P² streaming quantile estimators (Jain & Chlamtac, 1985);
+* an exponentially weighted moving average of every result.
+
+The all-time part and the EWMA are saved in the history database's meta
+table together with the id of the last row they include. ``from_store`` only
+has to read rows newer than that, plus the rows inside the longest window.
+"""
+import bisect
+import json
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from history_store import record_timestamp
+
+METRICS = ("download", "upload", "ping")
+WINDOWS = {"hour": 3600.0, "day": 86400.0, "week": 7 * 86400.0}
+ALL_TIME = "all"
+QUANTILES = (("p5", 0.05), ("median", 0.5), ("p95", 0.95))
+EWMA_ALPHA = 0.2
+SNAPSHOT_KEY = "stats_snapshot"
+
+
+def _finite(value) -> bool:
+    return value is not None and math.isfinite(value)
+
+
+def quantile(ordered: List[float], q: float) -> float:
+    """Return the ``q`` quantile of a sorted list, interpolating between ranks."""
+    position = q * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class P2Quantile:
+    """Estimate one quantile of a stream in constant space with the P² algorithm."""
+
+    def __init__(self, q: float):
+        self.q = q
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.desired = [1.0, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5.0]
+        self.increments = [0.0, q / 2, q, (1 + q) / 2, 1.0]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            bisect.insort(heights, x)
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(heights, x, 1, 4) - 1
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        n = self.positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (n[i + step] - n[i])
+                heights[i] = height
+                n[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            return quantile(self.heights, self.q)
+        return self.heights[2]
+
+    def to_state(self) -> Dict:
+        return {"count": self.count, "heights": self.heights,
+                "positions": self.positions, "desired": self.desired}
+
+    @classmethod
+    def from_state(cls, q: float, state: Dict) -> "P2Quantile":
+        estimator = cls(q)
+        estimator.count = state["count"]
+        estimator.heights = list(state["heights"])
+        estimator.positions = list(state["positions"])
+        estimator.desired = list(state["desired"])
+        return estimator
+
+
+class SlidingWindow:
+    """Exact statistics over the values of the last ``span`` seconds."""
+
+    def __init__(self, span: float):
+        self.span = span
+        self.entries: deque = deque()  # (timestamp, value) in arrival order
+        self.ordered: List[float] = []
+        # Sums are kept relative to a shift so the variance does not cancel out
+        self.shift = 0.0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, timestamp: float, value: float) -> None:
+        if not self.entries:
+            self.shift, self.total, self.total_sq = value, 0.0, 0.0
+        self.entries.append((timestamp, value))
+        bisect.insort(self.ordered, value)
+        delta = value - self.shift
+        self.total += delta
+        self.total_sq += delta * delta
+
+    def expire(self, now: float) -> None:
+        cutoff = now - self.span
+        while self.entries and self.entries[0][0] < cutoff:
+            _, value = self.entries.popleft()
+            del self.ordered[bisect.bisect_left(self.ordered, value)]
+            delta = value - self.shift
+            self.total -= delta
+            self.total_sq -= delta * delta
+
+    def summary(self) -> Dict:
+        count = len(self.ordered)
+        if not count:
+            return {"count": 0}
+        mean = self.total / count
+        variance = max(self.total_sq / count - mean * mean, 0.0)
+        summary = {"count": count, "min": self.ordered[0], "max": self.ordered[-1],
+                   "mean": self.shift + mean, "std": math.sqrt(variance)}
+        for name, q in QUANTILES:
+            summary[name] = quantile(self.ordered, q)
+        return summary
+
+
+class StreamSummary:
+    """Constant-size all-time statistics: Welford moments, extremes and P² quantiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.quantiles = {name: P2Quantile(q) for name, q in QUANTILES}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        for estimator in self.quantiles.values():
+            estimator.add(value)
+
+    def summary(self) -> Dict:
+        if not self.count:
+            return {"count": 0}
+        summary = {"count": self.count, "min": self.minimum, "max": self.maximum,
+                   "mean": self.mean, "std": math.sqrt(self.m2 / self.count)}
+        for name, estimator in self.quantiles.items():
+            summary[name] = estimator.value()
+        return summary
+
+    def to_state(self) -> Dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.minimum, "max": self.maximum,
+                "quantiles": {name: e.to_state() for name, e in self.quantiles.items()}}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "StreamSummary":
+        stream = cls()
+        stream.count = state["count"]
+        stream.mean = state["mean"]
+        stream.m2 = state["m2"]
+        stream.minimum = state["min"]
+        stream.maximum = state["max"]
+        stream.quantiles = {name: P2Quantile.from_state(q, state["quantiles"][name])
+                            for name, q in QUANTILES}
+        return stream
+
+
+class RollingStats:
+    """Incremental download/upload/ping statistics over time windows."""
+
+    def __init__(self, windows: Optional[Dict[str, float]] = None, alpha: float = EWMA_ALPHA):
+        self.windows = dict(WINDOWS if windows is None else windows)
+        self.alpha = alpha
+        self.sliding = {m: {name: SlidingWindow(span) for name, span in self.windows.items()}
+                        for m in METRICS}
+        self.streams = {m: StreamSummary() for m in METRICS}
+        self.ewma: Dict[str, Optional[float]] = {m: None for m in METRICS}
+        self.last_id = 0
+        self.rows = 0
+        self.latest = 0.0
+
+    def add(self, record: Dict) -> None:
+        """Fold one result into every window, the all-time summary and the EWMA."""
+        timestamp = record_timestamp(record)
+        self._add_to_windows(timestamp, record)
+        self._add_to_stream(record)
+
+    def _add_to_windows(self, timestamp: float, values: Dict) -> None:
+        self.latest = max(self.latest, timestamp)
+        for metric in METRICS:
+            value = values.get(metric)
+            if not _finite(value):
+                continue
+            for window in self.sliding[metric].values():
+                window.add(timestamp, value)
+                window.expire(self.latest)
+
+    def _add_to_stream(self, values: Dict) -> None:
+        self.rows += 1
+        for metric in METRICS:
+            value = values.get(metric)
+            if not _finite(value):
+                continue
+            self.streams[metric].add(value)
+            previous = self.ewma[metric]
+            self.ewma[metric] = value if previous is None else previous + self.alpha * (value - previous)
+
+    def summary(self, window: str = "day", now: Optional[float] = None) -> Dict:
+        """Return per-metric statistics for a window name or ``"all"``."""
+        if window != ALL_TIME and window not in self.windows:
+            raise ValueError(f"unknown window {window!r}; expected one of "
+                             f"{', '.join([*self.windows, ALL_TIME])}")
+        now = time.time() if now is None else now
+        summary: Dict = {"window": window}
+        for metric in METRICS:
+            if window == ALL_TIME:
+                stats = self.streams[metric].summary()
+            else:
+                sliding = self.sliding[metric][window]
+                sliding.expire(now)
+                stats = sliding.summary()
+            stats["ewma"] = self.ewma[metric]
+            summary[metric] = stats
+        summary["count"] = max(summary[m]["count"] for m in METRICS)
+        return summary
+
+    def summaries(self, now: Optional[float] = None) -> Dict[str, Dict]:
+        return {name: self.summary(name, now) for name in [*self.windows, ALL_TIME]}
+
+    # Persistence alongside a HistoryStore
+
+    def snapshot(self) -> Dict:
+        return {"last_id": self.last_id, "rows": self.rows, "alpha": self.alpha, "ewma": self.ewma,
+                "streams": {m: self.streams[m].to_state() for m in METRICS}}
+
+    def _restore(self, snapshot: Dict) -> None:
+        self.last_id = snapshot["last_id"]
+        self.rows = snapshot["rows"]
+        self.ewma = dict(snapshot["ewma"])
+        self.streams = {m: StreamSummary.from_state(snapshot["streams"][m]) for m in METRICS}
+
+    @classmethod
+    def from_store(cls, store, windows: Optional[Dict[str, float]] = None,
+                   alpha: float = EWMA_ALPHA, now: Optional[float] = None) -> "RollingStats":
+        """Build statistics from a HistoryStore without rescanning its full history."""
+        stats = cls(windows, alpha)
+        now = time.time() if now is None else now
+
+        raw = store.get_meta(SNAPSHOT_KEY)
+        if raw:
+            try:
+                snapshot = json.loads(raw)
+                # Rows removed since the snapshot was taken invalidate it
+                if snapshot["alpha"] == alpha and store.count_through(snapshot["last_id"]) == snapshot["rows"]:
+                    stats._restore(snapshot)
+            except (ValueError, KeyError, TypeError):
+                pass
+
+        folded = False
+        for row_id, values in store.rows_after(stats.last_id):
+            stats._add_to_stream(values)
+            stats.last_id = row_id
+            folded = True
+
+        if stats.windows:
+            longest = max(stats.windows.values())
+            for row in store.columns(start=now - longest):
+                stats._add_to_windows(row.timestamp, row)
+        if folded:
+            stats.save(store)
+        return stats
+
+    def append(self, store, record: Dict) -> None:
+        """Fold a result that was just appended to ``store`` and save the snapshot."""
+        self.add(record)
+        self.last_id = store.last_id or self.last_id
+        self.save(store)
+
+    def save(self, store) -> None:
+        store.set_meta(SNAPSHOT_KEY, json.dumps(self.snapshot()))
+
+
+def format_brief(summary: Dict) -> str:
+    """One-line median and p5–p95 summary for the GUI history panels."""
+    if not summary["count"]:
+        return ""
+    title = "All time" if summary["window"] == ALL_TIME else f"Last {summary['window']}"
+    parts = []
+    for metric, arrow in (("download", "↓"), ("upload", "↑")):
+        stats = summary[metric]
+        if stats["count"]:
+            parts.append(f"{arrow}{stats['median'] / 1_000_000:.1f} "
+                         f"({stats['p5'] / 1_000_000:.1f}–{stats['p95'] / 1_000_000:.1f})")
+    text = f"{title}, {summary['count']} tests: {' '.join(parts)} Mbps"
+    ping = summary["ping"]
+    if ping["count"]:
+        text += f", Ping {ping['median']:.0f}ms (p95 {ping['p95']:.0f})"
+    return text
@@ -0,0 +1,259 @@
+"""Append-only SQLite history of speed test results.
+
+Every result is one INSERT; past rows are never rewritten. Rows carry an
+epoch ``ts`` column with an index, so time-range queries stay cheap as the
+history grows. Fields beyond the core numbers (server, settings, samples...)
+are kept in a JSON ``extra`` column so new result fields need no migration.
+
+Speeds are stored in bits per second, matching ``engine.run_speed_test``.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from history_columns import HistoryColumns, NO_SERVER, parse_server_id, server_names
+
+DEFAULT_HISTORY_DB = "speed_test_history.db"
+LEGACY_HISTORY_FILE = "speed_test_history.json"
+
+CORE_FIELDS = ("timestamp", "date", "time", "download", "upload", "ping", "server_id")
+COLUMNS = "ts, download, upload, ping, server_id, extra"
+
+# Older Tk builds stored Mbps, the Qt build stored bps. No real link reports
+# below this many bps, so smaller legacy values are taken to be Mbps.
+LEGACY_MBPS_THRESHOLD = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    download REAL,
+    upload REAL,
+    ping REAL,
+    server_id INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def record_timestamp(record: Dict) -> float:
+    """Return the epoch timestamp of a result, falling back to its date string."""
+    if record.get("timestamp") is not None:
+        return float(record["timestamp"])
+    try:
+        return datetime.strptime(record["date"], "%Y-%m-%d %H:%M:%S").timestamp()
+    except (KeyError, TypeError, ValueError):
+        return datetime.now().timestamp()
+
+
+def _row_to_record(row) -> Dict:
+    ts, download, upload, ping, server_id, extra = row
+    moment = datetime.fromtimestamp(ts)
+    record = {
+        "timestamp": ts,
+        "date": moment.strftime("%Y-%m-%d %H:%M:%S"),
+        "time": moment.strftime("%H:%M:%S"),
+        "download": download,
+        "upload": upload,
+        "ping": ping,
+    }
+    if server_id is not None and server_id != NO_SERVER:
+        record["server_id"] = str(server_id)
+    if extra:
+        record.update(json.loads(extra))
+    return record
+
+
+class HistoryStore:
+    """SQLite-backed result history with a small in-memory tail for the GUI."""
+
+    def __init__(self, path: str = DEFAULT_HISTORY_DB,
+                 legacy_file: Optional[str] = LEGACY_HISTORY_FILE, tail_size: int = 5):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+        if legacy_file:
+            self.import_legacy(legacy_file)
+
+        self.tail = self.latest_columns(tail_size)
+        self.tail.maxlen = tail_size
+        self.last_id: Optional[int] = None  # Row id of the last append
+
+    def _migrate(self) -> None:
+        """Add columns introduced after a database was first created."""
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(results)")}
+        if "server_id" not in existing:
+            with self.conn:
+                self.conn.execute("ALTER TABLE results ADD COLUMN server_id INTEGER")
+
+    def import_legacy(self, legacy_file: str) -> int:
+        """Import the old JSON history once; returns the number of rows imported."""
+        with self.lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'legacy_imported'").fetchone()
+            if done or not os.path.exists(legacy_file):
+                return 0
+            try:
+                with open(legacy_file, "r") as f:
+                    records = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error importing history: {e}")
+                return 0
+
+            rows = []
+            for record in records:
+                record = dict(record)
+                for key in ("download", "upload"):
+                    value = record.get(key) or 0.0
+                    if value < LEGACY_MBPS_THRESHOLD:
+                        record[key] = value * 1_000_000
+                rows.append(self._to_row(record))
+
+            with self.conn:
+                self.conn.executemany(
+                    f"INSERT INTO results ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', ?)", (legacy_file,))
+            return len(rows)
+
+    @staticmethod
+    def _to_row(record: Dict):
+        extra = {k: v for k, v in record.items() if k not in CORE_FIELDS}
+        return (record_timestamp(record), record.get("download"), record.get("upload"),
+                record.get("ping"), parse_server_id(record.get("server_id")),
+                json.dumps(extra) if extra else None)
+
+    def append(self, record: Dict) -> Dict:
+        """Append one result, add it to the in-memory tail and return it as read back."""
+        row = self._to_row(record)
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                f"INSERT INTO results ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", row)
+            self.last_id = cursor.lastrowid
+        stored = _row_to_record(row)
+        self.tail.append_values(*self._column_values(row[:5]), servers=server_names(record))
+        return stored
+
+    def latest(self, count: int) -> List[Dict]:
+        """Return the newest ``count`` results, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {COLUMNS} FROM results ORDER BY ts DESC, id DESC LIMIT ?",
+                (count,)).fetchall()
+        return [_row_to_record(row) for row in reversed(rows)]
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None,
+              chunk_size: int = 1000) -> Iterator[Dict]:
+        """Yield results with ``start <= ts < end`` in time order, fetched in chunks."""
+        query = f"SELECT {COLUMNS} FROM results WHERE ts >= ? AND ts < ? ORDER BY ts, id"
+        params = self._bounds(start, end)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(chunk_size)
+        while rows:
+            for row in rows:
+                yield _row_to_record(row)
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+
+    @staticmethod
+    def _bounds(start: Optional[float], end: Optional[float]):
+        return (start if start is not None else float("-inf"), end if end is not None else float("inf"))
+
+    def latest_columns(self, count: int) -> HistoryColumns:
+        """Return the newest ``count`` results as columns, oldest first, with their server names."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {COLUMNS} FROM results ORDER BY ts DESC, id DESC LIMIT ?",
+                (count,)).fetchall()
+        columns = HistoryColumns()
+        for row in reversed(rows):
+            extra = json.loads(row[5]) if row[5] else {}
+            columns.append_values(*self._column_values(row[:5]), servers=server_names(extra))
+        return columns
+
+    def columns(self, start: Optional[float] = None, end: Optional[float] = None) -> HistoryColumns:
+        """Load results with ``start <= ts < end`` straight into columns, without per-row dicts."""
+        columns = HistoryColumns()
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT ts, download, upload, ping, server_id FROM results WHERE ts >= ? AND ts < ? ORDER BY ts, id",
+                self._bounds(start, end))
+            for row in cursor:
+                columns.append_values(*self._column_values(row))
+        return columns
+
+    def column_chunks(self, start: Optional[float] = None, end: Optional[float] = None,
+                      chunk_size: int = 65536) -> Iterator[HistoryColumns]:
+        """Yield results with ``start <= ts < end`` as columns of up to ``chunk_size`` rows."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT ts, download, upload, ping, server_id FROM results WHERE ts >= ? AND ts < ? ORDER BY ts, id",
+                self._bounds(start, end))
+            rows = cursor.fetchmany(chunk_size)
+        while rows:
+            columns = HistoryColumns()
+            for row in rows:
+                columns.append_values(*self._column_values(row))
+            yield columns
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+
+    @staticmethod
+    def _column_values(row):
+        ts, download, upload, ping, server_id = row
+        return ts, download, upload, ping, NO_SERVER if server_id is None else server_id
+
+    def rows_after(self, row_id: int, chunk_size: int = 1000) -> Iterator[Tuple[int, Dict]]:
+        """Yield ``(id, {"timestamp", "download", "upload", "ping"})`` for rows after ``row_id``."""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, ts, download, upload, ping FROM results WHERE id > ? ORDER BY id LIMIT ?",
+                    (row_id, chunk_size)).fetchall()
+            for row_id, ts, download, upload, ping in rows:
+                yield row_id, {"timestamp": ts, "download": download, "upload": upload, "ping": ping}
+            if len(rows) < chunk_size:
+                return
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def count_through(self, row_id: int) -> int:
+        """Return the number of rows with ``id <= row_id``."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results WHERE id <= ?", (row_id,)).fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def clear(self) -> None:
+        """Delete every stored result and anything derived from them."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("DELETE FROM meta WHERE key != 'legacy_imported'")
+        self.tail.clear()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
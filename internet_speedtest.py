@@ -1,16 +1,41 @@
+import time
+_STARTED = time.perf_counter()  # Taken before the imports below for --profile-startup
+
+import sys
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # Dispatch before any Tk import so headless runs need no GUI toolkit
+    from headless import main as headless_main
+    sys.exit(headless_main(sys.argv[1:]))
+
 import tkinter as tk
 from tkinter import ttk, messagebox
+import asyncio
 import threading
-import speedtest
-from PIL import Image, ImageTk, ImageOps
 import os
 from datetime import datetime
-import queue
-import json
+import engine
+from history_columns import HistoryColumns
+from history_stats import RollingStats, format_brief
+from history_store import HistoryStore, DEFAULT_HISTORY_DB, LEGACY_HISTORY_FILE
+from metrics import start_from_argv as start_metrics
+from profiling import StartupProfiler
+from scheduler import TestScheduler, settings_from_argv
+from timers import SecondTicker, WakeupCounter
+from update_bus import UpdateBus
+
+# PIL, the gradient renderer and speedtest are imported on first use so the
+# window can appear before any image or network code is loaded.
+
+CLOSE_TIMEOUT = 10  # Seconds to wait for a cancelled test before closing anyway
 
 class SpeedTestApp:
-    def __init__(self, root):
+    def __init__(self, root, profiler=None, test_options=None, wakeups=None, schedule=None,
+                 metrics=None):
         self.root = root
+        self.metrics = metrics  # Optional metrics.MetricsRegistry fed with every result
+        self.wakeups = wakeups or WakeupCounter()
+        self.profiler = profiler or StartupProfiler()
+        self.test_options = test_options or engine.TestOptions()
         self.root.title("🌐 Internet Speed Test")
         self.root.geometry("500x600")
         self.root.minsize(450, 550)
@@ -22,117 +47,137 @@ class SpeedTestApp:
         }
         self.current_theme = "Dark"
         
-        # Queue for thread-safe communication
-        self.update_queue = queue.Queue()
-        
-        # Test history
-        self.test_history = []
-        self.history_file = "speed_test_history.json"
+        # Gradient background cache (created on first render) and pending resize render
+        self.gradient_renderer = None
+        self.gradient_job = None
+        
+        # Measurement loop, created on the first test
+        self.test_runner = None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Thread-safe, coalescing updates from worker threads (see update_bus.py)
+        self.update_bus = UpdateBus(self.root, {
+            "status": lambda u: self.label_status.config(text=u["text"]),
+            "server": lambda u: self.server_label.config(text=u["text"]),
+            "download": lambda u: self.label_download_val.config(text=f"{u['value']:.2f} Mbps"),
+            "upload": lambda u: self.label_upload_val.config(text=f"{u['value']:.2f} Mbps"),
+            "sample": self.show_sample,
+            "ping": lambda u: self.label_ping_val.config(text=f"{u['value']:.2f} ms"),
+            "progress": lambda u: self.progress.config(value=u["value"]),
+            "button": lambda u: self.btn_test.config(state=u["state"]),
+            "error": lambda u: messagebox.showerror("Error", u["message"]),
+            "history": lambda u: self.add_to_history(u["data"]),
+            "assets": lambda u: self.apply_logo_assets(u["data"]),
+        }, self.wakeups)
+        
+        # Test history (full record in SQLite, last few tests in memory)
+        self.test_history = HistoryColumns(maxlen=5)
+        self.history_store = None
+        self.history_db = DEFAULT_HISTORY_DB
+        self.history_file = LEGACY_HISTORY_FILE
         
         # Load previous test history
-        self.load_history()
-        
-        # Load logo and set taskbar icon first
-        self.load_logo()
+        with self.profiler.phase("load_history"):
+            self.load_history()
         
         # Setup UI
-        self.setup_ui()
-        self.apply_theme()
-        self.update_logo()
-        self.display_history()  # Display loaded history
-        
-        # Start clock and queue processor
-        self.update_clock()
-        self.process_queue()
+        with self.profiler.phase("setup_ui"):
+            self.setup_ui()
+        with self.profiler.phase("apply_theme"):
+            self.apply_theme()
+        with self.profiler.phase("display_history"):
+            self.display_history()  # Display loaded history
+        
+        # Clock ticks on second boundaries and pauses while minimized or hidden
+        self.clock = SecondTicker(self.update_clock, self.root.after, self.root.after_cancel,
+                                  self.wakeups)
+        self.root.bind("<Map>", self.on_visibility_change, add="+")
+        self.root.bind("<Unmap>", self.on_visibility_change, add="+")
+        self.clock.resume()
         
         # Create gradient after UI is set up
-        self.root.after(100, self.create_gradient_image)
+        self.schedule_gradient()
+        
+        # Build logo and taskbar icons in the background once the window is up
+        self.startup_pending = {"first frame", "logo"}
+        self.root.after_idle(self.on_first_frame)
+        self.load_logo()
+        
+        # Background tests, if a schedule was given or saved by an earlier run
+        self.scheduler = TestScheduler(self.start_scheduled_test)
+        self.scheduler.configure(schedule or {})
+        if self.scheduler.enabled:
+            self.scheduler.start(self.get_test_runner())
         
     def load_history(self):
-        """Load test history from file"""
+        """Open the history store and load the most recent tests"""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.test_history = json.load(f)
-                # Keep only last 5 tests
-                if len(self.test_history) > 5:
-                    self.test_history = self.test_history[-5:]
-                
+            self.history_store = HistoryStore(self.history_db, legacy_file=self.history_file)
+            self.test_history = self.history_store.tail
+            self.history_stats = RollingStats.from_store(self.history_store)
         except Exception as e:
+            print(f"Error loading history: {e}")
+            self.history_store = None
+            self.history_stats = RollingStats()
             
-            self.test_history = []
-    
-    def save_history(self):
-        """Save test history to file"""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.test_history, f, indent=2)
-            
-        except Exception as e:
-            print(f"Error saving history: {e}")
-    
     def load_logo(self):
-        """Load logo and set taskbar icon"""
+        """Start loading the logo and taskbar icons in the background"""
         self.logo_path = "logo.png"
-        self.logo_original = None
+        self.logo_paths = {}
+        self.logo_photos = {}  # PhotoImage per theme, also keeps references alive
         self.icon_photos = []  # Keep references to prevent garbage collection
         
         if os.path.exists(self.logo_path):
-            try:
-                self.logo_original = Image.open(self.logo_path).convert("RGBA")
-                
-                # Create ICO file for Windows taskbar (more reliable)
-                ico_path = "app_icon.ico"
-                try:
-                    # Save as ICO with multiple sizes
-                    self.logo_original.save(ico_path, format='ICO', 
-                                           sizes=[(16,16), (32,32), (48,48), (64,64), (128,128)])
-                    # Set icon from ICO file
-                    self.root.iconbitmap(ico_path)
-                    
-                except Exception as ico_error:
-                    print(f"ICO creation failed: {ico_error}, trying PhotoImage method")
-                
-                # Also try PhotoImage method as backup
-                icon_sizes = [(16, 16), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
-                for size in icon_sizes:
-                    icon_img = self.logo_original.resize(size, Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(icon_img)
-                    self.icon_photos.append(photo)
-                
-                # Set all icon sizes for best compatibility
-                if self.icon_photos:
-                    self.root.iconphoto(True, *self.icon_photos)
-                
-                
-            except Exception as e:
-                
-                self.logo_original = None
-                
-        """Load logo and set taskbar icon"""
-        self.logo_path = "C:/Users/smm66/Downloads/Internetspeed/logo.png"
-        self.logo_original = None
-        self.icon_photos = []  # Keep references to prevent garbage collection
+            threading.Thread(target=self.prepare_logo, daemon=True).start()
+        else:
+            self.finish_startup_step("logo")
+            
+    def prepare_logo(self):
+        """Fetch (or build once) the cached ICO, icon sizes and themed logos"""
+        started = time.perf_counter()
+        assets = {"started": started}
+        try:
+            from assets import AssetCache
+            assets.update(AssetCache(self.logo_path).get())
+        except Exception as e:
+            print(f"Error loading logo: {e}")
+            
+        self.update_bus.put({"type": "assets", "data": assets})
         
-        if os.path.exists(self.logo_path):
+    def apply_logo_assets(self, assets):
+        """Install the cached logo and icons on the UI thread"""
+        if "logos" in assets:
+            self.logo_paths = assets["logos"]
+            
+            try:
+                # Set icon from ICO file
+                self.root.iconbitmap(assets["ico"])
+            except tk.TclError as ico_error:
+                print(f"ICO icon failed: {ico_error}, using PhotoImage method")
+            
+            # Set all icon sizes for best compatibility
             try:
-                self.logo_original = Image.open(self.logo_path).convert("RGBA")
-                
-                # Create multiple icon sizes for Windows taskbar
-                icon_sizes = [(16, 16), (32, 32), (48, 48), (64, 64), (128, 128)]
-                for size in icon_sizes:
-                    icon_img = self.logo_original.resize(size, Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(icon_img)
-                    self.icon_photos.append(photo)
-                
-                # Set all icon sizes for best compatibility
+                self.icon_photos = [tk.PhotoImage(file=path) for path in assets["icons"]]
                 self.root.iconphoto(True, *self.icon_photos)
-                
-            except Exception as e:
-                
-                self.logo_original = None
-    
+            except tk.TclError as e:
+                print(f"Error setting icons: {e}")
             
+            self.logo_label.config(text="", bd=0)
+            self.update_logo()
+            
+        self.profiler.mark("logo and icons", since=assets["started"])
+        self.finish_startup_step("logo")
+        
+    def on_first_frame(self):
+        """Called from the first idle pass after the window is drawn"""
+        self.profiler.mark("first frame")
+        self.finish_startup_step("first frame")
+        
+    def finish_startup_step(self, step):
+        """Report the startup profile once every deferred step is done"""
+        self.startup_pending.discard(step)
+        if not self.startup_pending:
+            self.profiler.report()
         
     def setup_ui(self):
         # Get initial theme background color
@@ -147,11 +192,8 @@ class SpeedTestApp:
         self.frame_main = tk.Frame(self.canvas, bg=initial_bg)
         self.canvas_frame = self.canvas.create_window(250, 300, window=self.frame_main, anchor="center")
         
-        # Logo display
-        if self.logo_original:
-            self.logo_label = tk.Label(self.frame_main, bg=initial_bg, bd=0)
-        else:
-            self.logo_label = tk.Label(self.frame_main, text="🌐", font=("Segoe UI Emoji", 40), bg=initial_bg)
+        # Logo display (placeholder until the logo is loaded in the background)
+        self.logo_label = tk.Label(self.frame_main, text="🌐", font=("Segoe UI Emoji", 40), bg=initial_bg)
         self.logo_label.pack(pady=10)
         
         # Title
@@ -237,40 +279,35 @@ class SpeedTestApp:
         
     def create_gradient_image(self):
         """Create gradient as an image for better performance"""
+        self.gradient_job = None
         width = self.canvas.winfo_width()
         height = self.canvas.winfo_height()
         
         if width <= 1 or height <= 1:
-            self.root.after(100, self.create_gradient_image)
+            self.schedule_gradient()
             return
         
-        theme = self.themes[self.current_theme]
-        
-        # Convert colors
-        c1 = self.root.winfo_rgb(theme["bg1"])
-        c2 = self.root.winfo_rgb(theme["bg2"])
-        
-        # Create gradient image
-        gradient = Image.new("RGB", (width, height))
-        pixels = gradient.load()
-        
-        for y in range(height):
-            ratio = y / height
-            r = int(c1[0] * (1 - ratio) + c2[0] * ratio) >> 8
-            g = int(c1[1] * (1 - ratio) + c2[1] * ratio) >> 8
-            b = int(c1[2] * (1 - ratio) + c2[2] * ratio) >> 8
-            
-            for x in range(width):
-                pixels[x, y] = (r, g, b)
+        from PIL import ImageTk
+        if self.gradient_renderer is None:
+            from gradient import GradientRenderer
+            self.gradient_renderer = GradientRenderer()
         
-        self.gradient_photo = ImageTk.PhotoImage(gradient)
+        theme = self.themes[self.current_theme]
+        self.gradient_photo = self.gradient_renderer.render(self.current_theme, theme, width, height,
+                                                            wrap=ImageTk.PhotoImage)
         self.canvas.delete("gradient")
         self.canvas.create_image(0, 0, image=self.gradient_photo, anchor="nw", tags="gradient")
         self.canvas.tag_lower("gradient")
         
+    def schedule_gradient(self, delay=100):
+        """Collapse a burst of resize events into a single gradient render"""
+        if self.gradient_job is not None:
+            self.root.after_cancel(self.gradient_job)
+        self.gradient_job = self.root.after(delay, self.create_gradient_image)
+        
     def on_resize(self, event=None):
         """Handle window resize"""
-        self.root.after(100, self.create_gradient_image)
+        self.schedule_gradient()
         # Center the frame
         width = self.canvas.winfo_width()
         height = self.canvas.winfo_height()
@@ -278,20 +315,16 @@ class SpeedTestApp:
         
     def update_logo(self):
         """Update logo based on theme"""
-        if self.logo_original:
-            logo_resized = self.logo_original.resize((100, 100), Image.Resampling.LANCZOS)
-            if self.current_theme == "Light":
-                r, g, b, a = logo_resized.split()
-                rgb_image = Image.merge("RGB", (r, g, b))
-                inverted_image = ImageOps.invert(rgb_image)
-                inverted_image.putalpha(a)
-                logo_img = inverted_image
-            else:
-                logo_img = logo_resized
-            
-            # Keep strong reference to prevent garbage collection
-            self.logo_photo = ImageTk.PhotoImage(logo_img)
-            self.logo_label.config(image=self.logo_photo)
+        path = self.logo_paths.get(self.current_theme)
+        if path:
+            photo = self.logo_photos.get(self.current_theme)
+            if photo is None:
+                try:
+                    photo = self.logo_photos[self.current_theme] = tk.PhotoImage(file=path)
+                except tk.TclError as e:
+                    print(f"Error loading logo: {e}")
+            if photo is not None:
+                self.logo_label.config(image=photo)
         
         # Update frame background to match theme
         theme_bg = self.themes[self.current_theme]["bg1"]
@@ -337,48 +370,32 @@ class SpeedTestApp:
         """Update the clock display"""
         now = datetime.now().strftime("%H:%M:%S")
         self.clock_label.config(text=now)
-        self.root.after(1000, self.update_clock)
         
-    def process_queue(self):
-        """Process updates from the test thread"""
-        try:
-            while True:
-                update = self.update_queue.get_nowait()
-                update_type = update.get("type")
-                
-                if update_type == "status":
-                    self.label_status.config(text=update["text"])
-                elif update_type == "server":
-                    self.server_label.config(text=update["text"])
-                elif update_type == "download":
-                    self.label_download_val.config(text=f"{update['value']:.2f} Mbps")
-                elif update_type == "upload":
-                    self.label_upload_val.config(text=f"{update['value']:.2f} Mbps")
-                elif update_type == "ping":
-                    self.label_ping_val.config(text=f"{update['value']:.2f} ms")
-                elif update_type == "progress":
-                    self.progress["value"] = update["value"]
-                elif update_type == "button":
-                    self.btn_test.config(state=update["state"])
-                elif update_type == "error":
-                    messagebox.showerror("Error", update["message"])
-                elif update_type == "history":
-                    self.add_to_history(update["data"])
-                    
-        except queue.Empty:
-            pass
-        finally:
-            self.root.after(100, self.process_queue)
+    def on_visibility_change(self, event):
+        """Pause the clock while the window is minimized or withdrawn"""
+        if event.widget is not self.root:
+            return
+        self.clock.set_active(self.root.state() in ("normal", "zoomed"))
+        
+    def show_sample(self, update):
+        """Show the live rate while a phase is running; replaced by the final value"""
+        label = self.label_download_val if update["phase"] == "download" else self.label_upload_val
+        label.config(text=f"{update['value']:.2f} Mbps")
             
     def add_to_history(self, data):
         """Add test result to history"""
-        self.test_history.append(data)
-        # Keep only last 5 tests
-        if len(self.test_history) > 5:
-            self.test_history.pop(0)
-        
-        # Save to file
-        self.save_history()
+        if self.history_store is not None:
+            try:
+                # Appends to the store and its in-memory tail (self.test_history)
+                stored = self.history_store.append(data)
+                self.history_stats.append(self.history_store, stored)
+            except Exception as e:
+                print(f"Error saving history: {e}")
+        else:
+            self.test_history.append(data)
+            self.history_stats.add(data)
+        if self.metrics is not None:
+            self.metrics.observe_result(data)
         
         # Display updated history
         self.display_history()
@@ -392,82 +409,105 @@ class SpeedTestApp:
         history_text = ""
         for i, test in enumerate(reversed(self.test_history), 1):
             date_str = test.get('date', test.get('time', ''))
-            history_text += f"{i}. {date_str} - ↓{test['download']:.1f} ↑{test['upload']:.1f} Mbps, Ping: {test['ping']:.0f}ms\n"
+            history_text += f"{i}. {date_str} - ↓{test['download'] / 1_000_000:.1f} ↑{test['upload'] / 1_000_000:.1f} Mbps, Ping: {test['ping']:.0f}ms"
+            if test.servers:
+                history_text += f" ({len(test.servers)} servers: {', '.join(test.servers)})"
+            history_text += "\n"
+        
+        # Median and p5-p95 over the last day, from the incremental statistics
+        summary = format_brief(self.history_stats.summary("day"))
+        if summary:
+            history_text += f"\n{summary}"
         
         self.history_text.config(text=history_text.strip())
         
-    def test_speed(self):
-        """Run the speed test in a separate thread"""
+    def on_test_done(self, result, error):
+        """Queue the outcome of a test; called on the measurement loop thread"""
         try:
-            self.update_queue.put({"type": "button", "state": tk.DISABLED})
-            self.update_queue.put({"type": "status", "text": "Initializing speed test..."})
-            self.update_queue.put({"type": "progress", "value": 0})
-            
-            st = speedtest.Speedtest()
-            
-            self.update_queue.put({"type": "status", "text": "Finding best server..."})
-            self.update_queue.put({"type": "progress", "value": 10})
-            st.get_best_server()
-            
-            server_info = f"Server: {st.best['sponsor']} ({st.best['country']})"
-            self.update_queue.put({"type": "server", "text": server_info})
-            self.update_queue.put({"type": "progress", "value": 20})
-            
-            # Download test
-            self.update_queue.put({"type": "status", "text": "Testing download speed..."})
-            self.update_queue.put({"type": "progress", "value": 30})
-            download_speed = st.download() / 1_000_000
-            self.update_queue.put({"type": "download", "value": download_speed})
-            self.update_queue.put({"type": "progress", "value": 60})
-            
-            # Upload test
-            self.update_queue.put({"type": "status", "text": "Testing upload speed..."})
-            self.update_queue.put({"type": "progress", "value": 70})
-            upload_speed = st.upload() / 1_000_000
-            self.update_queue.put({"type": "upload", "value": upload_speed})
-            self.update_queue.put({"type": "progress", "value": 90})
-            
-            # Ping
-            ping = st.results.ping
-            self.update_queue.put({"type": "ping", "value": ping})
-            self.update_queue.put({"type": "progress", "value": 100})
+            if error is None:
+                # Add to history
+                self.update_bus.put({"type": "history", "data": result})
+                self.update_bus.put({"type": "status", "text": engine.completion_status(result)})
+            elif isinstance(error, asyncio.CancelledError):
+                self.update_bus.put({"type": "status", "text": "Test cancelled"})
+            else:
+                category, error_msg, status = engine.describe_error(error)
+                if self.metrics is not None:
+                    self.metrics.observe_failure(category)
+                self.update_bus.put({"type": "error", "message": error_msg})
+                self.update_bus.put({"type": "status", "text": status})
+        finally:
+            self.update_bus.put({"type": "button", "state": tk.NORMAL})
+            self.update_bus.put({"type": "progress", "value": 0})
             
-            # Add to history
-            test_data = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "download": download_speed,
-                "upload": upload_speed,
-                "ping": ping
-            }
-            self.update_queue.put({"type": "history", "data": test_data})
+    def on_engine_event(self, kind, value):
+        """Forward engine progress to the UI update bus"""
+        if kind in ("status", "server"):
+            self.update_bus.put({"type": kind, "text": value})
+        elif kind in ("download", "upload"):
+            self.update_bus.put({"type": kind, "value": value / 1_000_000})
+        elif kind == "sample":
+            if "bps" in value:
+                self.update_bus.put({"type": "sample", "phase": value["phase"],
+                                     "value": value["bps"] / 1_000_000})
+        else:
+            self.update_bus.put({"type": kind, "value": value})
             
-            self.update_queue.put({"type": "status", "text": "✅ Test Completed Successfully"})
+    def get_test_runner(self):
+        """Return the shared measurement loop, creating it on first use"""
+        if self.test_runner is None:
+            from async_engine import TestRunner
+            self.test_runner = TestRunner()
+        return self.test_runner
+        
+    def run_test_thread(self):
+        """Start the speed test on the shared measurement loop"""
+        if self.get_test_runner().start(self.on_engine_event, self.test_options, self.on_test_done):
+            self.btn_test.config(state=tk.DISABLED)
             
-        except speedtest.ConfigRetrievalError:
-            error_msg = "Failed to retrieve speedtest configuration. Please check your internet connection."
-            self.update_queue.put({"type": "error", "message": error_msg})
-            self.update_queue.put({"type": "status", "text": "❌ Configuration Error"})
-        except speedtest.NoMatchedServers:
-            error_msg = "No speedtest servers found. Please check your internet connection."
-            self.update_queue.put({"type": "error", "message": error_msg})
-            self.update_queue.put({"type": "status", "text": "❌ No Servers Found"})
-        except Exception as e:
-            error_msg = f"Test failed: {str(e)}\n\nPlease check:\n- Internet connection\n- Firewall settings\n- VPN configuration"
-            self.update_queue.put({"type": "error", "message": error_msg})
-            self.update_queue.put({"type": "status", "text": "❌ Test Failed"})
-        finally:
-            self.update_queue.put({"type": "button", "state": tk.NORMAL})
-            self.update_queue.put({"type": "progress", "value": 0})
+    def start_scheduled_test(self):
+        """Start a scheduled test; called on the measurement loop thread"""
+        if not self.test_runner.start(self.on_engine_event, self.test_options, self.on_test_done):
+            return False
+        self.update_bus.put({"type": "button", "state": tk.DISABLED})
+        return True
             
-    def run_test_thread(self):
-        """Start the speed test in a new thread"""
-        threading.Thread(target=self.test_speed, daemon=True).start()
+    def on_close(self):
+        """Cancel any running test, then exit once the measurement loop is idle"""
+        self.scheduler.stop()
+        self.root.withdraw()
+        if self.test_runner is not None:
+            self.test_runner.cancel()
+        self.finish_close(time.monotonic() + CLOSE_TIMEOUT)
+        
+    def finish_close(self, deadline):
+        """Poll until the cancelled test has finished, without blocking the Tk loop"""
+        runner = self.test_runner
+        if runner is not None and runner.is_running() and time.monotonic() < deadline:
+            self.root.after(50, self.finish_close, deadline)
+            return
+        if runner is not None and not runner.is_running():
+            runner.shutdown()
+        self.update_bus.close()
+        self.root.destroy()
 
 def main():
-    root = tk.Tk()
-    app = SpeedTestApp(root)
+    if getattr(sys, "frozen", False):
+        # --processes workers start by re-running the frozen executable
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    profiler = StartupProfiler.from_argv(sys.argv[1:], _STARTED)
+    profiler.mark("imports")
+    
+    with profiler.phase("tk init"):
+        root = tk.Tk()
+    wakeups = WakeupCounter()
+    app = SpeedTestApp(root, profiler, engine.options_from_argv(sys.argv[1:]), wakeups,
+                       settings_from_argv(sys.argv[1:]), start_metrics(sys.argv[1:]))
     root.mainloop()
+    if WakeupCounter.wanted(sys.argv[1:]):
+        wakeups.print_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,15 @@
+import time
+_STARTED = time.perf_counter()  # Taken before the imports below for --profile-startup
+
 import sys
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # Dispatch before any Qt import so headless runs need no GUI toolkit
+    from headless import main as headless_main
+    sys.exit(headless_main(sys.argv[1:]))
+
 import os
-import json
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 
 # ADD THESE LINES FOR TASKBAR ICON FIX
 import ctypes
@@ -19,9 +26,16 @@ from PyQt6.QtWidgets import (
     QPushButton, QProgressBar, QFrame, QMessageBox, QScrollArea
 )
 
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
+from PyQt6.QtCore import Qt, QObject, QEvent, pyqtSignal, QTimer
 from PyQt6.QtGui import QPixmap, QPainter, QLinearGradient, QColor, QIcon, QImage
-import speedtest
+import engine
+from history_columns import HistoryColumns
+from history_stats import RollingStats, format_brief
+from history_store import HistoryStore, DEFAULT_HISTORY_DB
+from metrics import MetricsRegistry, start_from_argv as start_metrics
+from profiling import StartupProfiler
+from scheduler import TestScheduler, settings_from_argv
+from timers import SecondTicker, WakeupCounter
 
 # Constants
 DEFAULT_HISTORY_FILE = "speed_test_history.json"
@@ -54,98 +68,139 @@ def get_resource_path(relative_path: str) -> str:
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-class SpeedTestThread(QThread):
-    """Thread for running speed tests without blocking UI."""
+class SpeedTestWorker(QObject):
+    """Runs speed tests on the shared asyncio runner and re-emits progress as Qt signals.
+
+    Signals are emitted from the runner's loop thread, so Qt queues them to
+    the GUI thread. The runner (and asyncio) is only loaded on the first test.
+    """
     status_update = pyqtSignal(str)
     server_update = pyqtSignal(str)
     download_update = pyqtSignal(float)
     upload_update = pyqtSignal(float)
     ping_update = pyqtSignal(float)
     progress_update = pyqtSignal(int)
+    sample_update = pyqtSignal(str, float)
     test_complete = pyqtSignal(dict)
     test_error = pyqtSignal(str)
+    started = pyqtSignal()
+    finished = pyqtSignal()
 
-    def run(self):
+    def __init__(self, options: Optional[engine.TestOptions] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        super().__init__()
+        self.runner = None
+        self.options = options or engine.TestOptions()
+        self.metrics = metrics
+
+    def get_runner(self):
+        if self.runner is None:
+            from async_engine import TestRunner
+            self.runner = TestRunner()
+        return self.runner
+
+    def start(self) -> bool:
+        """Start a test unless one is in flight; safe to call from the loop thread."""
+        if not self.get_runner().start(self.forward_event, self.options, self.on_done):
+            return False
+        self.started.emit()
+        return True
+
+    def is_running(self) -> bool:
+        return self.runner is not None and self.runner.is_running()
+
+    def cancel(self) -> bool:
+        return self.runner is not None and self.runner.cancel()
+
+    def shutdown(self):
+        if self.runner is not None:
+            self.runner.shutdown()
+
+    def on_done(self, test_data: Optional[Dict], error: Optional[BaseException]):
+        import asyncio
         try:
-            self.status_update.emit("Initializing speed test...")
-            self.progress_update.emit(0)
-
-            st = speedtest.Speedtest()
-
-            self.status_update.emit("Finding best server...")
-            self.progress_update.emit(10)
-            st.get_best_server()
-
-            server_info = f"Server: {st.best['sponsor']} ({st.best['country']})"
-            self.server_update.emit(server_info)
-            self.progress_update.emit(20)
-
-            # Download test
-            self.status_update.emit("Testing download speed...")
-            self.progress_update.emit(30)
-            download_speed = st.download()
-            self.download_update.emit(download_speed)
-            self.progress_update.emit(60)
-
-            # Upload test
-            self.status_update.emit("Testing upload speed...")
-            self.progress_update.emit(70)
-            upload_speed = st.upload()
-            self.upload_update.emit(upload_speed)
-            self.progress_update.emit(90)
-
-            # Ping
-            ping = st.results.ping
-            self.ping_update.emit(ping)
-            self.progress_update.emit(100)
-
-            # Complete
-            test_data = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "download": download_speed,
-                "upload": upload_speed,
-                "ping": ping
-            }
-            self.test_complete.emit(test_data)
-            self.status_update.emit("✅ Test Completed Successfully")
-
-        except speedtest.ConfigRetrievalError:
-            self.test_error.emit("Failed to retrieve speedtest configuration. Please check your internet connection.")
-            self.status_update.emit("❌ Configuration Error")
-        except speedtest.NoMatchedServers:
-            self.test_error.emit("No speedtest servers found. Please check your internet connection.")
-            self.status_update.emit("❌ No Servers Found")
-        except Exception as e:
-            self.test_error.emit(f"Test failed: {str(e)}\n\nPlease check:\n- Internet connection\n- Firewall settings\n- VPN configuration")
-            self.status_update.emit("❌ Test Failed")
+            if error is None:
+                self.test_complete.emit(test_data)
+                self.status_update.emit(engine.completion_status(test_data))
+            elif isinstance(error, asyncio.CancelledError):
+                self.status_update.emit("Test cancelled")
+            else:
+                category, error_msg, status = engine.describe_error(error)
+                if self.metrics is not None:
+                    self.metrics.observe_failure(category)
+                self.test_error.emit(error_msg)
+                self.status_update.emit(status)
         finally:
             self.progress_update.emit(0)
+            self.finished.emit()
+
+    def forward_event(self, kind: str, value):
+        """Re-emit engine progress as Qt signals."""
+        if kind == "sample":
+            if "bps" in value:
+                self.sample_update.emit(value["phase"], value["bps"])
+            return
+        signal = {
+            "status": self.status_update,
+            "server": self.server_update,
+            "download": self.download_update,
+            "upload": self.upload_update,
+            "ping": self.ping_update,
+            "progress": self.progress_update,
+        }.get(kind)
+        if signal is not None:
+            signal.emit(value)
 
 class SpeedTestApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, profiler: Optional[StartupProfiler] = None,
+                 test_options: Optional[engine.TestOptions] = None,
+                 wakeups: Optional[WakeupCounter] = None,
+                 schedule: Optional[Dict] = None,
+                 metrics: Optional[MetricsRegistry] = None):
         super().__init__()
+        self.profiler = profiler or StartupProfiler()
+        self.wakeups = wakeups or WakeupCounter()
+        self.test_options = test_options or engine.TestOptions()
         self.setWindowTitle("Internet Speed Test")
         self.setMinimumSize(500, 650)
         self.resize(500, 650)
 
         # State
         self.current_theme = "Dark"
-        self.test_history: List[Dict] = []
+        self.test_history = HistoryColumns(maxlen=5)
+        self.history_store: Optional[HistoryStore] = None
+        self.history_db = DEFAULT_HISTORY_DB
         self.history_file = DEFAULT_HISTORY_FILE
-        self.speed_test_thread: Optional[SpeedTestThread] = None
+        self.metrics = metrics  # Fed with every result added to history
+        self.speed_test_worker = SpeedTestWorker(self.test_options, metrics)
         self.original_pixmap: Optional[QPixmap] = None
+        self.logo_pixmaps: Dict[str, QPixmap] = {}  # Scaled logo per theme
 
         # Setup
-        self.load_history()
-        self.load_icon()
-        self.setup_ui()
-        self.apply_theme()
-
-        # Timer
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_clock)
-        self.timer.start(1000)
+        with self.profiler.phase("load_history"):
+            self.load_history()
+        with self.profiler.phase("setup_ui"):
+            self.setup_ui()
+            self.connect_worker()
+        with self.profiler.phase("apply_theme"):
+            self.apply_theme()
+
+        # Icon and logo are loaded after the first frame is shown
+        QTimer.singleShot(0, self.load_deferred_assets)
+
+        # Background tests, if a schedule was given or saved by an earlier run
+        self.scheduler = TestScheduler(self.speed_test_worker.start)
+        self.scheduler.configure(schedule or {})
+        if self.scheduler.enabled:
+            self.scheduler.start(self.speed_test_worker.get_runner())
+
+        # Clock ticks on second boundaries; started by showEvent, paused while minimized or hidden
+        self.clock_timer = QTimer(self)
+        self.clock_timer.setSingleShot(True)
+        self.clock_timer.timeout.connect(lambda: self.clock_callback())
+        self.clock_callback = None
+        self.clock = SecondTicker(self.update_clock, self.schedule_clock,
+                                  lambda timer: timer.stop(), self.wakeups)
 
     def invert_logo_colors(self, pixmap: QPixmap) -> QPixmap:
         """Invert the colors of the logo pixmap."""
@@ -156,16 +211,19 @@ class SpeedTestApp(QMainWindow):
     def update_logo_pixmap(self):
         """Update the logo pixmap based on the current theme."""
         if hasattr(self, 'original_pixmap') and self.original_pixmap:
-            if self.current_theme == "Dark":
-                pixmap = self.original_pixmap
-            else:
-                pixmap = self.invert_logo_colors(self.original_pixmap)
-
-            scaled_pixmap = pixmap.scaled(
-                100, 100,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
+            scaled_pixmap = self.logo_pixmaps.get(self.current_theme)
+            if scaled_pixmap is None:
+                if self.current_theme == "Dark":
+                    pixmap = self.original_pixmap
+                else:
+                    pixmap = self.invert_logo_colors(self.original_pixmap)
+
+                scaled_pixmap = pixmap.scaled(
+                    100, 100,
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                )
+                self.logo_pixmaps[self.current_theme] = scaled_pixmap
             self.logo_label.setPixmap(scaled_pixmap)
             self.logo_label.setStyleSheet("")
 
@@ -177,10 +235,20 @@ class SpeedTestApp(QMainWindow):
                 pixmap = QPixmap(logo_path)
                 if not pixmap.isNull():
                     self.original_pixmap = pixmap
+                    self.logo_pixmaps.clear()
                     self.update_logo_pixmap()
             except Exception as e:
                 print(f"Error loading logo image: {e}")
 
+    def load_deferred_assets(self):
+        """Load the window icon and logo once the event loop is running."""
+        self.profiler.mark("first frame")
+        with self.profiler.phase("logo and icons"):
+            self.load_icon()
+            self.load_logo_image()
+            self.apply_theme()
+        self.profiler.report()
+
     def load_icon(self):
         """Load application icon."""
         logo_path = get_resource_path(DEFAULT_LOGO_PATH)
@@ -328,7 +396,6 @@ class SpeedTestApp(QMainWindow):
         main_layout.addWidget(self.footer_label)
 
         main_layout.addStretch()
-        self.load_logo_image()
         self.display_history()
 
     def paintEvent(self, event):
@@ -395,44 +462,81 @@ class SpeedTestApp(QMainWindow):
         now = datetime.now().strftime("%H:%M:%S")
         self.clock_label.setText(now)
 
+    def schedule_clock(self, delay_ms: int, callback) -> QTimer:
+        """Run ``callback`` once after ``delay_ms`` on the clock timer."""
+        self.clock_callback = callback
+        self.clock_timer.start(delay_ms)
+        return self.clock_timer
+
+    def update_clock_state(self):
+        """Run the clock only while the window is visible and not minimized."""
+        self.clock.set_active(self.isVisible() and not self.isMinimized())
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_clock_state()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.update_clock_state()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.update_clock_state()
+
     def start_test(self):
-        """Start speed test in background thread."""
-        if self.speed_test_thread and self.speed_test_thread.isRunning():
+        """Start speed test on the shared measurement loop."""
+        if self.speed_test_worker.is_running():
             return
 
+        self.speed_test_worker.start()
+
+    def on_test_started(self):
+        """Lock the controls while a manual or scheduled test runs."""
         self.test_button.setEnabled(False)
         self.cancel_button.setEnabled(True)
 
-        self.speed_test_thread = SpeedTestThread()
-        self.speed_test_thread.status_update.connect(self.status_label.setText)
-        self.speed_test_thread.server_update.connect(self.server_label.setText)
-        self.speed_test_thread.download_update.connect(
+    def connect_worker(self):
+        """Route worker signals to the widgets."""
+        worker = self.speed_test_worker
+        worker.status_update.connect(self.status_label.setText)
+        worker.server_update.connect(self.server_label.setText)
+        worker.download_update.connect(
             lambda v: self.download_value.setText(format_speed(v))
         )
-        self.speed_test_thread.upload_update.connect(
+        worker.upload_update.connect(
             lambda v: self.upload_value.setText(format_speed(v))
         )
-        self.speed_test_thread.ping_update.connect(
+        worker.ping_update.connect(
             lambda v: self.ping_value.setText(f"{v:.2f} ms")
         )
-        self.speed_test_thread.progress_update.connect(self.progress_bar.setValue)
-        self.speed_test_thread.test_complete.connect(self.on_test_complete)
-        self.speed_test_thread.test_error.connect(self.on_test_error)
-        self.speed_test_thread.finished.connect(self.on_test_finished)
-
-        self.speed_test_thread.start()
+        worker.progress_update.connect(self.progress_bar.setValue)
+        worker.sample_update.connect(self.on_sample)
+        worker.test_complete.connect(self.on_test_complete)
+        worker.test_error.connect(self.on_test_error)
+        worker.started.connect(self.on_test_started)
+        worker.finished.connect(self.on_test_finished)
 
     def cancel_test(self):
-        """Cancel the ongoing speed test."""
-        if self.speed_test_thread and self.speed_test_thread.isRunning():
-            self.speed_test_thread.terminate()
-            self.status_label.setText("Test cancelled")
-            self.progress_bar.setValue(0)
+        """Cancel the ongoing speed test; its connections are closed before it finishes."""
+        if self.speed_test_worker.cancel():
+            self.status_label.setText("Cancelling test...")
             self.cancel_button.setEnabled(False)
-            self.test_button.setEnabled(True)
+
+    def closeEvent(self, event):
+        """Stop any running test and the measurement loop on exit."""
+        self.scheduler.stop()
+        self.speed_test_worker.shutdown()
+        super().closeEvent(event)
+
+    def on_sample(self, phase: str, bps: float):
+        """Show the live rate while a phase is running."""
+        label = self.download_value if phase == "download" else self.upload_value
+        label.setText(format_speed(bps))
 
     def on_test_finished(self):
-        """Handle thread completion."""
+        """Handle worker completion."""
         self.cancel_button.setEnabled(False)
         self.test_button.setEnabled(True)
 
@@ -446,10 +550,18 @@ class SpeedTestApp(QMainWindow):
 
     def add_to_history(self, data: Dict):
         """Add test result to history."""
-        self.test_history.append(data)
-        if len(self.test_history) > 5:
-            self.test_history.pop(0)
-        self.save_history()
+        if self.history_store is not None:
+            try:
+                # Appends to the store and its in-memory tail (self.test_history)
+                stored = self.history_store.append(data)
+                self.history_stats.append(self.history_store, stored)
+            except Exception as e:
+                print(f"Error saving history: {e}")
+        else:
+            self.test_history.append(data)
+            self.history_stats.add(data)
+        if self.metrics is not None:
+            self.metrics.observe_result(data)
         self.display_history()
 
     def display_history(self):
@@ -467,41 +579,59 @@ class SpeedTestApp(QMainWindow):
             download_str = format_speed(download_mbps)
             upload_str = format_speed(upload_mbps)
 
-            history_text += f"{i}. {date_str} - ↓{download_str} ↑{upload_str}, Ping: {test['ping']:.0f}ms\n"
+            history_text += f"{i}. {date_str} - ↓{download_str} ↑{upload_str}, Ping: {test['ping']:.0f}ms"
+            if test.servers:
+                history_text += f" ({len(test.servers)} servers: {', '.join(test.servers)})"
+            history_text += "\n"
+
+        # Median and p5-p95 over the last day, from the incremental statistics
+        summary = format_brief(self.history_stats.summary("day"))
+        if summary:
+            history_text += f"\n{summary}"
 
         self.history_text.setText(history_text.strip())
 
     def clear_history(self):
         """Clear test history."""
-        self.test_history = []
-        self.save_history()
+        if self.history_store is not None:
+            try:
+                self.history_store.clear()
+            except Exception as e:
+                print(f"Error clearing history: {e}")
+        self.test_history.clear()
+        self.history_stats = RollingStats()
         self.display_history()
 
     def load_history(self):
-        """Load test history from file."""
+        """Open the history store and load the most recent tests."""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.test_history = json.load(f)
-                if len(self.test_history) > 5:
-                    self.test_history = self.test_history[-5:]
+            self.history_store = HistoryStore(self.history_db, legacy_file=self.history_file)
+            self.test_history = self.history_store.tail
+            self.history_stats = RollingStats.from_store(self.history_store)
         except Exception as e:
             print(f"Error loading history: {e}")
-            self.test_history = []
-
-    def save_history(self):
-        """Save test history to file."""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.test_history, f, indent=2)
-        except Exception as e:
-            print(f"Error saving history: {e}")
+            self.history_store = None
+            self.history_stats = RollingStats()
 
 def main():
-    app = QApplication(sys.argv)
-    window = SpeedTestApp()
+    if getattr(sys, "frozen", False):
+        # --processes workers start by re-running the frozen executable
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    profiler = StartupProfiler.from_argv(sys.argv[1:], _STARTED)
+    profiler.mark("imports")
+
+    with profiler.phase("qt init"):
+        app = QApplication(sys.argv)
+    wakeups = WakeupCounter()
+    window = SpeedTestApp(profiler, engine.options_from_argv(sys.argv[1:]), wakeups,
+                          settings_from_argv(sys.argv[1:]), start_metrics(sys.argv[1:]))
     window.show()
-    sys.exit(app.exec())
+    status = app.exec()
+    if WakeupCounter.wanted(sys.argv[1:]):
+        wakeups.print_report()
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,237 @@
+"""Latency, jitter and loss measurement against the selected test server.
+
+A ``LatencyProbe`` times small round trips to the server, either as HTTP
+requests for ``latency.txt`` on one kept-alive connection (``"http"``, so
+only the request/response round trip is timed) or as bare TCP connects
+(``"tcp"``, one SYN/SYN-ACK round trip). A probe that fails or takes longer
+than ``timeout`` counts as lost.
+
+``measure_idle`` sends a burst before the throughput phases and
+``measure_during`` keeps probing while a phase saturates the link, so the
+two can be compared for bufferbloat (``bufferbloat_report``). ``summarize``
+turns the RTTs into the dict stored with each result: the samples, their
+distribution, RFC 3550 interarrival jitter and loss percentage.
+
+Given a ``session.Session``, HTTP probes borrow its pooled connections and
+TCP probes resolve through its DNS cache before the timer starts.
+"""
+import asyncio
+import math
+import time
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+import engine
+from async_engine import HTTPError, close_stream, open_stream, read_body, read_head, request_head, split_url
+from history_stats import quantile
+
+PROBE_TIMEOUT = 2.0
+BURST_INTERVAL = 0.05
+LOADED_INTERVAL = 0.2
+BUFFERBLOAT_INTERVAL = 0.1
+PERCENTILES = (("p5", 0.05), ("p25", 0.25), ("median", 0.5), ("p75", 0.75),
+               ("p90", 0.9), ("p95", 0.95), ("p99", 0.99))
+# (added ms below which the grade applies, grade)
+GRADES = ((5, "A+"), (30, "A"), (60, "B"), (200, "C"), (400, "D"))
+
+
+def rfc3550_jitter(rtts: List[float]) -> float:
+    """Smoothed mean deviation of consecutive RTTs, as in RFC 3550 section 6.4.1."""
+    jitter = 0.0
+    for previous, current in zip(rtts, rtts[1:]):
+        jitter += (abs(current - previous) - jitter) / 16
+    return jitter
+
+
+def summarize(samples: List[Optional[float]], method: str) -> Dict:
+    """Describe a list of RTTs in ms, with ``None`` for lost probes."""
+    received = [rtt for rtt in samples if rtt is not None]
+    sent = len(samples)
+    summary = {
+        "method": method,
+        "sent": sent,
+        "received": len(received),
+        "loss": round((sent - len(received)) / sent * 100, 2) if sent else 0.0,
+        "samples": [None if rtt is None else round(rtt, 3) for rtt in samples],
+    }
+    if not received:
+        return summary
+
+    ordered = sorted(received)
+    mean = sum(received) / len(received)
+    summary.update({
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": mean,
+        "std": math.sqrt(sum((rtt - mean) ** 2 for rtt in received) / len(received)),
+        "jitter": rfc3550_jitter(received),
+    })
+    for name, q in PERCENTILES:
+        summary[name] = quantile(ordered, q)
+    return summary
+
+
+class LatencyProbe:
+    """Time HTTP or TCP-connect round trips to one server."""
+
+    def __init__(self, server: Dict, method: str = "http", timeout: float = PROBE_TIMEOUT, session=None):
+        base = server["url"].rsplit("/", 1)[0]
+        self.scheme, self.host, self.port, self.path = split_url(f"{base}/latency.txt")
+        self.method = method
+        self.timeout = timeout
+        self.session = session  # Optional session.Session for pooled connections and cached DNS
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reused = False
+        self.busy = False
+        self.sequence = 0
+
+    async def probe(self) -> Optional[float]:
+        """Return one RTT in ms, or ``None`` if the probe was lost."""
+        try:
+            if self.method == "tcp":
+                return await asyncio.wait_for(self._tcp(), self.timeout)
+            if self.writer is None:
+                # Connection setup is not part of the timed round trip
+                await asyncio.wait_for(self._connect(), self.timeout)
+            try:
+                return await asyncio.wait_for(self._http(), self.timeout)
+            except (OSError, EOFError, HTTPError) as e:
+                if not self.reused or isinstance(e, asyncio.TimeoutError):
+                    raise
+                # The server dropped the pooled connection while it sat idle
+                await self._drop()
+                await asyncio.wait_for(self._connect(fresh=True), self.timeout)
+                return await asyncio.wait_for(self._http(), self.timeout)
+        except (OSError, EOFError, asyncio.TimeoutError, HTTPError, ValueError):
+            await self._drop()
+            return None
+
+    async def _connect(self, fresh: bool = False) -> None:
+        if self.session is None:
+            self.reader, self.writer = await open_stream(self.scheme, self.host, self.port)
+        else:
+            self.reader, self.writer, self.reused = await self.session.open_stream(
+                self.scheme, self.host, self.port, fresh)
+
+    async def _tcp(self) -> float:
+        # Resolve before timing, so only the SYN/SYN-ACK round trip is measured
+        address = await self.session.resolve(self.host, self.port) if self.session else self.host
+        started = time.perf_counter()
+        _, writer = await asyncio.open_connection(address, self.port)
+        rtt = (time.perf_counter() - started) * 1000
+        await close_stream(writer)
+        return rtt
+
+    async def _http(self) -> float:
+        self.sequence += 1
+        self.busy = True
+        started = time.perf_counter()
+        self.writer.write(request_head("GET", self.host, f"{self.path}?x={time.time()}.{self.sequence}"))
+        await self.writer.drain()
+        status, headers = await read_head(self.reader)
+        body = await read_body(self.reader, headers)
+        rtt = (time.perf_counter() - started) * 1000
+        if status != 200 or not body.startswith(b"test=test"):
+            raise HTTPError(f"latency probe returned HTTP {status}")
+        self.busy = self.reused = False
+        if headers.get("connection", "").lower() == "close":
+            await self._drop()
+        return rtt
+
+    async def burst(self, count: int, interval: float = BURST_INTERVAL) -> List[Optional[float]]:
+        samples = []
+        for i in range(count):
+            if i:
+                await asyncio.sleep(interval)
+            samples.append(await self.probe())
+        return samples
+
+    async def run_forever(self, samples: List[Tuple[float, Optional[float]]],
+                          interval: float = LOADED_INTERVAL) -> None:
+        """Probe every ``interval`` seconds, appending ``(sent_at, rtt)``, until cancelled."""
+        while True:
+            started = time.perf_counter()
+            samples.append((started, await self.probe()))
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+    async def close(self) -> None:
+        """Return the connection to the session between probes, otherwise close it."""
+        if self.session is not None and self.writer is not None and not self.busy:
+            reader, writer, self.reader, self.writer = self.reader, self.writer, None, None
+            self.session.release_stream(self.scheme, self.host, self.port, reader, writer)
+        else:
+            await self._drop()
+
+    async def _drop(self) -> None:
+        writer, self.reader, self.writer = self.writer, None, None
+        self.busy = self.reused = False
+        if writer is not None:
+            await close_stream(writer)
+
+
+async def measure_idle(server: Dict, options: "engine.TestOptions", session=None) -> Dict:
+    """Send the configured burst of probes and summarize it."""
+    probe = LatencyProbe(server, options.probe_method, session=session)
+    try:
+        samples = await probe.burst(options.probes)
+    finally:
+        await probe.close()
+    return summarize(samples, options.probe_method)
+
+
+async def measure_during(server: Dict, options: "engine.TestOptions", phase: Awaitable,
+                         interval: float = LOADED_INTERVAL, session=None) -> Tuple[object, Dict]:
+    """Await ``phase`` while probing latency; returns its result and the loaded summary.
+
+    In fixed-duration mode probes sent during the warm-up window are left
+    out, like the bytes moved in it, since the queue is still filling.
+    """
+    probe = LatencyProbe(server, options.probe_method, session=session)
+    samples: List[Tuple[float, Optional[float]]] = []
+    started = time.perf_counter()
+    task = asyncio.ensure_future(probe.run_forever(samples, interval))
+    try:
+        result = await phase
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await probe.close()
+    warmup = options.warmup if options.duration else 0.0
+    loaded = [rtt for sent_at, rtt in samples if sent_at - started >= warmup]
+    return result, summarize(loaded, options.probe_method)
+
+
+def responsiveness_grade(added_ms: float) -> str:
+    """Letter grade for the latency a saturated link adds over idle."""
+    for limit, grade in GRADES:
+        if added_ms < limit:
+            return grade
+    return "F"
+
+
+def bufferbloat_report(latencies: Dict[str, Dict]) -> Dict:
+    """Compare loaded to idle RTTs: percentiles, added latency, RPM and a grade.
+
+    The grade uses the worse of the download and upload median increases.
+    RPM (round trips per minute) is 60000 divided by the worst loaded median
+    RTT, as in the IETF responsiveness draft.
+    """
+    report: Dict = {}
+    idle_median = latencies.get("idle", {}).get("median")
+    for name in ("idle", "download", "upload"):
+        summary = latencies.get(name, {})
+        report[name] = {key: summary.get(key) for key in ("median", "p90", "p95", "p99", "loss")}
+    worst_added = None
+    worst_loaded = None
+    for name in ("download", "upload"):
+        loaded_median = report[name]["median"]
+        if loaded_median is None or idle_median is None:
+            continue
+        added = max(0.0, loaded_median - idle_median)
+        report[name]["added"] = added
+        worst_added = added if worst_added is None else max(worst_added, added)
+        worst_loaded = loaded_median if worst_loaded is None else max(worst_loaded, loaded_median)
+    report["added"] = worst_added
+    report["rpm"] = round(60000 / worst_loaded) if worst_loaded else None
+    report["grade"] = responsiveness_grade(worst_added) if worst_added is not None else None
+    return report
@@ -0,0 +1,232 @@
+"""Optional Prometheus/OpenMetrics endpoint for test results.
+
+``MetricsRegistry`` is fed from the same place results are added to the
+history (and failures from the same place errors are reported). Each update
+re-renders the exposition text once, in both the Prometheus text format and
+OpenMetrics; a scrape only copies the prepared bytes, so scraping costs the
+same however often it happens.
+
+Exported series:
+
+* ``speedtest_download_bps``, ``speedtest_upload_bps``, ``speedtest_ping_ms``:
+  gauges with the last result;
+* ``speedtest_throughput_bps{direction}``: histogram of measured speeds;
+* ``speedtest_latency_ms{phase}``: histogram of every idle and loaded RTT;
+* ``speedtest_phase_duration_seconds{phase}``: gauge, last test's phases;
+* ``speedtest_tests_total``, ``speedtest_failures_total{category}``: counters,
+  with the categories from ``engine.describe_error``;
+* ``speedtest_last_success_timestamp_seconds``.
+"""
+import argparse
+import math
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import engine
+
+THROUGHPUT_BUCKETS = (1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6, 500e6, 1e9, 2.5e9, 10e9)
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+FAILURE_CATEGORIES = (engine.ERROR_CONFIG, engine.ERROR_NO_SERVERS, engine.ERROR_GENERIC)
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set."""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        if not math.isfinite(value):
+            return
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Result-driven metrics with the exposition text prepared on each update."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last: Dict[str, float] = {}
+        self.durations: Dict[str, float] = {}
+        self.throughput = {d: Histogram(THROUGHPUT_BUCKETS) for d in ("download", "upload")}
+        self.latency = {p: Histogram(LATENCY_BUCKETS) for p in ("idle", "download", "upload")}
+        self.tests = 0
+        self.failures = {category: 0 for category in FAILURE_CATEGORIES}
+        self.last_success: Optional[float] = None
+        self.rendered = {False: b"", True: b""}
+        self._render()
+
+    def observe_result(self, result: Dict) -> None:
+        """Fold a successful result in; call it where the result is added to history."""
+        with self.lock:
+            self.tests += 1
+            for key in ("download", "upload", "ping"):
+                if result.get(key) is not None:
+                    self.last[key] = result[key]
+            for direction, histogram in self.throughput.items():
+                if result.get(direction) is not None:
+                    histogram.observe(result[direction])
+            latencies = result.get("latency") or {}
+            for phase, histogram in self.latency.items():
+                for rtt in (latencies.get(phase) or {}).get("samples", []):
+                    if rtt is not None:
+                        histogram.observe(rtt)
+            if not latencies and result.get("ping") is not None:
+                self.latency["idle"].observe(result["ping"])
+            self.durations = dict(result.get("durations") or {})
+            self.last_success = result.get("timestamp")
+            self._render()
+
+    def observe_failure(self, category: str) -> None:
+        """Count a failed test by ``engine.describe_error`` category."""
+        with self.lock:
+            self.tests += 1
+            key = category if category in self.failures else engine.ERROR_GENERIC
+            self.failures[key] += 1
+            self._render()
+
+    def exposition(self, openmetrics: bool = False) -> bytes:
+        with self.lock:
+            return self.rendered[openmetrics]
+
+    def _render(self) -> None:
+        self.rendered = {False: self._text(False).encode(), True: self._text(True).encode()}
+
+    def _text(self, openmetrics: bool) -> str:
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str,
+                   samples: List[Tuple[str, Dict[str, str], float]]) -> None:
+            # OpenMetrics names counter families without the _total suffix
+            declared = name[:-len("_total")] if openmetrics and kind == "counter" else name
+            lines.append(f"# HELP {declared} {help_text}")
+            lines.append(f"# TYPE {declared} {kind}")
+            for sample_name, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_number(value)}" if label_text
+                             else f"{sample_name} {_number(value)}")
+
+        for key, unit, help_text in (("download", "bps", "Download speed of the last test in bits per second."),
+                                     ("upload", "bps", "Upload speed of the last test in bits per second."),
+                                     ("ping", "ms", "Idle ping of the last test in milliseconds.")):
+            name = f"speedtest_{key}_{unit}"
+            family(name, "gauge", help_text,
+                   [(name, {}, self.last[key])] if key in self.last else [])
+
+        self._histograms(family, "speedtest_throughput_bps", "direction", self.throughput,
+                         "Measured throughput in bits per second.")
+        self._histograms(family, "speedtest_latency_ms", "phase", self.latency,
+                         "Latency probe round-trip times in milliseconds, idle and under load.")
+
+        family("speedtest_phase_duration_seconds", "gauge", "Duration of each phase of the last test.",
+               [("speedtest_phase_duration_seconds", {"phase": phase}, seconds)
+                for phase, seconds in self.durations.items()])
+        family("speedtest_tests_total", "counter", "Tests finished, successful or not.",
+               [("speedtest_tests_total", {}, self.tests)])
+        family("speedtest_failures_total", "counter", "Failed tests by error category.",
+               [("speedtest_failures_total", {"category": c}, n) for c, n in self.failures.items()])
+        family("speedtest_last_success_timestamp_seconds", "gauge",
+               "Unix time of the last successful test.",
+               [("speedtest_last_success_timestamp_seconds", {}, self.last_success)]
+               if self.last_success is not None else [])
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histograms(family, name: str, label: str, histograms: Dict[str, Histogram], help_text: str) -> None:
+        samples = []
+        for value, histogram in histograms.items():
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                samples.append((f"{name}_bucket", {label: value, "le": _number(bound)}, count))
+            samples.append((f"{name}_bucket", {label: value, "le": "+Inf"}, histogram.count))
+            samples.append((f"{name}_count", {label: value}, histogram.count))
+            samples.append((f"{name}_sum", {label: value}, histogram.sum))
+        family(name, "histogram", help_text, samples)
+
+
+class MetricsServer:
+    """Serve a registry's prepared text at ``/metrics`` from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = DEFAULT_HOST):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?", 1)[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in handler.headers.get("Accept", "")
+                body = registry.exposition(openmetrics)
+                handler.send_response(200)
+                handler.send_header("Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("metrics")
+    group.add_argument("--metrics-port", type=int, metavar="PORT",
+                       help="serve Prometheus/OpenMetrics metrics at http://HOST:PORT/metrics")
+    group.add_argument("--metrics-host", default=DEFAULT_HOST, metavar="HOST",
+                       help=f"address for the metrics endpoint (default: {DEFAULT_HOST})")
+
+
+def start_from_args(args: argparse.Namespace) -> Optional[MetricsRegistry]:
+    """Start the endpoint if ``--metrics-port`` was given; returns its registry."""
+    if args.metrics_port is None:
+        return None
+    registry = MetricsRegistry()
+    try:
+        MetricsServer(registry, args.metrics_port, args.metrics_host)
+    except OSError as e:
+        print(f"Error starting metrics endpoint: {e}", file=sys.stderr)
+        return None
+    return registry
+
+
+def start_from_argv(argv: List[str]) -> Optional[MetricsRegistry]:
+    """Start the endpoint from a GUI's command line, ignoring other flags."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_metrics_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    return start_from_args(args)
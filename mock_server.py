@@ -0,0 +1,244 @@
+"""Local stand-in for the speedtest.net endpoints, for offline tests and benchmarks.
+
+Serves everything the async core and speedtest-cli request:
+
+* ``/speedtest-config.php`` and ``/speedtest-servers[-static].php``;
+* ``<base>/latency.txt``, ``<base>/random{N}x{N}.jpg`` (about 2*N*N bytes,
+  like the real images) and ``POST <base>/upload.php``.
+
+Traffic can be shaped with one token bucket per direction, shared by every
+connection like a real access link, and ``latency`` milliseconds are added
+before each response (TCP connects are not delayed). Requests may use the
+absolute form a proxy receives, so speedtest-cli, whose config and server
+list URLs are fixed, can be pointed here with ``http_proxy``.
+
+Usage:
+    python mock_server.py --download-rate 200M --upload-rate 50M --latency 20
+"""
+import argparse
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+DEFAULT_HOST = "127.0.0.1"
+BASE_PATH = "/speedtest"
+BLOCK_SIZE = 64 * 1024
+UNITS = {"": 1, "k": 1e3, "m": 1e6, "g": 1e9}
+
+CONFIG_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n<settings>'
+    '<client ip="127.0.0.1" lat="0" lon="0" isp="Mock" isprating="3.7" rating="0" '
+    'ispdlavg="0" ispulavg="0" loggedin="0" country="ZZ"/>'
+    '<server-config threadcount="4" ignoreids="" notonmap="" forcepingid="" preferredserverid=""/>'
+    '<download testlength="10" initialtest="250K" mintestsize="250K" threadsperurl="4"/>'
+    '<upload testlength="10" ratio="5" initialtest="0" mintestsize="32K" threads="2" '
+    'maxchunksize="512K" maxchunkcount="50" threadsperurl="4"/>'
+    '</settings>\n'
+)
+
+
+def parse_rate(text: str) -> float:
+    """Parse a rate in bits per second such as ``"500k"``, ``"100M"`` or ``"1.5G"``."""
+    value = text.strip().lower()
+    for suffix in ("bit/s", "b/s", "bps"):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+            break
+    unit = value[-1:] if value[-1:] in UNITS else ""
+    return float(value[:len(value) - len(unit)]) * UNITS[unit]
+
+
+class TokenBucket:
+    """Pace bytes to ``rate_bps`` across every thread that shares the bucket.
+
+    ``consume`` takes the tokens at once, going into debt if needed, and
+    sleeps until the debt is paid, so concurrent streams share the rate.
+    """
+
+    def __init__(self, rate_bps: float, burst: Optional[int] = None):
+        self.rate = rate_bps / 8
+        self.burst = burst or max(BLOCK_SIZE, int(self.rate * 0.01))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class MockSpeedtestServer:
+    """Threaded HTTP server with speedtest.net's endpoints, shaped and delayed on request."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 0, download_rate: Optional[float] = None,
+                 upload_rate: Optional[float] = None, latency: float = 0.0, server_count: int = 1):
+        self.server_count = server_count
+        self.download_bucket = TokenBucket(download_rate) if download_rate else None
+        self.upload_bucket = TokenBucket(upload_rate) if upload_rate else None
+        self.latency = latency / 1000
+        self.block = memoryview(os.urandom(BLOCK_SIZE))
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def config_url(self) -> str:
+        return f"{self.url}/speedtest-config.php"
+
+    @property
+    def server_list_url(self) -> str:
+        return f"{self.url}/speedtest-servers-static.php"
+
+    def servers_xml(self) -> bytes:
+        """List ``server_count`` servers, all served here, for multi-server tests."""
+        host, port = self.httpd.server_address[:2]
+        entries = "".join(
+            f'<server url="{self.url}{BASE_PATH}/upload.php" lat="0" lon="0" name="Localhost" '
+            f'country="Nowhere" cc="ZZ" sponsor="Mock Speedtest {n}" id="{n}" host="{host}:{port}"/>'
+            for n in range(1, self.server_count + 1))
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<settings><servers>'
+                f'{entries}</servers></settings>\n').encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(handler, format, *args):
+                pass
+
+            def route(handler) -> str:
+                # Proxied requests carry an absolute URL; keep only its path
+                path = urllib.parse.urlsplit(handler.path).path
+                if server.latency:
+                    time.sleep(server.latency)
+                return path
+
+            def reply(handler, body: bytes, content_type: str = "text/plain") -> None:
+                try:
+                    handler.send_response(200)
+                    handler.send_header("Content-Type", content_type)
+                    handler.send_header("Content-Length", str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+                except OSError:
+                    handler.close_connection = True
+
+            def do_GET(handler):
+                path = handler.route()
+                name = path.rsplit("/", 1)[-1]
+                if name == "speedtest-config.php":
+                    handler.reply(CONFIG_XML.encode(), "text/xml")
+                elif name in ("speedtest-servers-static.php", "speedtest-servers.php"):
+                    handler.reply(server.servers_xml(), "text/xml")
+                elif name == "latency.txt":
+                    handler.reply(b"test=test\n")
+                elif name.startswith("random") and name.endswith(".jpg"):
+                    try:
+                        side = int(name[len("random"):].split("x", 1)[0])
+                    except ValueError:
+                        handler.send_error(404)
+                        return
+                    handler.send_image(2 * side * side)
+                else:
+                    handler.send_error(404)
+
+            def send_image(handler, size: int) -> None:
+                handler.send_response(200)
+                handler.send_header("Content-Type", "image/jpeg")
+                handler.send_header("Content-Length", str(size))
+                handler.end_headers()
+                remaining = size
+                try:
+                    while remaining:
+                        chunk = server.block[:min(remaining, BLOCK_SIZE)]
+                        if server.download_bucket:
+                            server.download_bucket.consume(len(chunk))
+                        handler.wfile.write(chunk)
+                        remaining -= len(chunk)
+                except OSError:
+                    handler.close_connection = True
+
+            def do_POST(handler):
+                path = handler.route()
+                if not path.endswith("upload.php"):
+                    handler.send_error(404)
+                    return
+                remaining = int(handler.headers.get("Content-Length", 0))
+                received = 0
+                try:
+                    while remaining:
+                        data = handler.rfile.read(min(remaining, BLOCK_SIZE))
+                        if not data:
+                            handler.close_connection = True
+                            return
+                        if server.upload_bucket:
+                            server.upload_bucket.consume(len(data))
+                        remaining -= len(data)
+                        received += len(data)
+                    handler.reply(f"size={received}".encode())
+                except OSError:
+                    # The client aborted the upload, e.g. at the end of a timed phase
+                    handler.close_connection = True
+
+        return Handler
+
+    def start(self) -> "MockSpeedtestServer":
+        """Serve from a daemon thread; returns self."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-speedtest", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("mock server")
+    group.add_argument("--download-rate", type=parse_rate, metavar="RATE",
+                       help="shape downloads to RATE bits/s, e.g. 100M (default: unshaped)")
+    group.add_argument("--upload-rate", type=parse_rate, metavar="RATE",
+                       help="shape uploads to RATE bits/s (default: unshaped)")
+    group.add_argument("--latency", type=float, default=0.0, metavar="MS",
+                       help="milliseconds added before every response (default: 0)")
+    group.add_argument("--server-count", type=int, default=1, metavar="N",
+                       help="list N servers, all served by this one, for --servers tests (default: 1)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for speedtest.net.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=0, help="port to bind, 0 picks a free one (default: 0)")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockSpeedtestServer(args.host, args.port, args.download_rate, args.upload_rate, args.latency,
+                                 args.server_count)
+    print(f"Mock speedtest server listening on {server.url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,72 @@
+"""Lightweight startup timing used by the --profile-startup switch."""
+import sys
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+
+class StartupProfiler:
+    """Record named startup phases and print a per-phase breakdown.
+
+    ``started`` should be a ``time.perf_counter()`` value taken as early as
+    possible in the entry script, so module import time is included.
+    When disabled every method is a cheap no-op.
+    """
+
+    def __init__(self, started: Optional[float] = None, enabled: bool = False,
+                 output: Optional[str] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.enabled = enabled
+        self.output = output
+        self.phases: List[Tuple[str, float, float]] = []
+        self.reported = False
+
+    @classmethod
+    def from_argv(cls, argv: List[str], started: Optional[float] = None) -> "StartupProfiler":
+        """Build a profiler from ``--profile-startup`` or ``--profile-startup=FILE``."""
+        for arg in argv:
+            if arg == "--profile-startup":
+                return cls(started, enabled=True)
+            if arg.startswith("--profile-startup="):
+                return cls(started, enabled=True, output=arg.split("=", 1)[1])
+        return cls(started)
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, begin - self.started, time.perf_counter() - begin))
+
+    def mark(self, name: str, since: Optional[float] = None):
+        """Record a phase that ran from ``since`` (default: process start) until now."""
+        if not self.enabled:
+            return
+        begin = self.started if since is None else since
+        self.phases.append((name, begin - self.started, time.perf_counter() - begin))
+
+    def report(self):
+        """Write the breakdown once, to stderr or the configured file."""
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+
+        lines = ["Startup profile (ms)", f"  {'phase':<24}{'start':>10}{'duration':>10}"]
+        for name, offset, duration in self.phases:
+            lines.append(f"  {name:<24}{offset * 1000:>10.1f}{duration * 1000:>10.1f}")
+        lines.append(f"  {'total':<24}{'':>10}{(time.perf_counter() - self.started) * 1000:>10.1f}")
+        text = "\n".join(lines) + "\n"
+
+        if self.output:
+            try:
+                with open(self.output, "a", encoding="utf-8") as f:
+                    f.write(text)
+            except OSError as e:
+                print(f"Error writing startup profile: {e}", file=sys.stderr)
+        else:
+            sys.stderr.write(text)
+            sys.stderr.flush()
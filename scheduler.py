@@ -0,0 +1,189 @@
+"""Scheduled background tests with jitter and an overlap guard.
+
+``TestScheduler`` starts a test every ``interval`` seconds (``--schedule``
+takes minutes), offset by a random delay of up to ``jitter`` seconds so a
+fleet of probes started together does not hit the same server at the same
+moment. Slots are kept on a fixed grid
+(``slot + interval``), so jitter and slow tests do not make the schedule drift.
+
+Only one test is ever in flight: a slot that comes due while a test is still
+running (a manual one, or an overrunning scheduled one) is either skipped or
+queued to run as soon as the current test finishes, depending on ``overrun``.
+
+The schedule and its counters are persisted to a JSON file, so it resumes after
+a restart. A slot missed while the app was closed runs once, jittered, rather
+than once per missed slot. All timers run on the ``TestRunner`` loop thread.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from assets import cache_root, write_atomic
+
+SCHEDULE_FILE = "schedule.json"
+OVERRUN_POLICIES = ("skip", "queue")
+DEFAULT_JITTER = 30.0
+
+
+def add_schedule_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the background schedule settings to a command-line parser."""
+    group = parser.add_argument_group("schedule")
+    group.add_argument("--schedule", type=float, metavar="MINUTES",
+                       help="run a test every MINUTES in the background, 0 turns it off "
+                            "(remembered across restarts)")
+    group.add_argument("--jitter", type=float, metavar="SECONDS",
+                       help=f"random delay of up to SECONDS added to each run (default: {DEFAULT_JITTER:g})")
+    group.add_argument("--overrun", choices=OVERRUN_POLICIES,
+                       help="when a run comes due while a test is in flight: skip it, "
+                            "or queue it until the test finishes (default: skip)")
+
+
+def settings_from_argv(argv: List[str]) -> Dict:
+    """Return the schedule flags given on a GUI's command line, ignoring other flags."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_schedule_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    settings = {}
+    if args.schedule is not None:
+        settings["enabled"] = args.schedule > 0
+        if args.schedule > 0:
+            settings["interval"] = args.schedule * 60
+    if args.jitter is not None:
+        settings["jitter"] = max(0.0, args.jitter)
+    if args.overrun is not None:
+        settings["overrun"] = args.overrun
+    return settings
+
+
+class TestScheduler:
+    """Start tests on a jittered schedule through ``start_test``.
+
+    ``start_test()`` is called on the runner's loop thread and must return
+    whether a test was started (``TestRunner.start`` refuses while one runs).
+    """
+
+    def __init__(self, start_test: Callable[[], bool], state_path: Optional[str] = None,
+                 rng: Optional[random.Random] = None):
+        self.runner = None
+        self.start_test = start_test
+        self.state_path = state_path or os.path.join(cache_root(), SCHEDULE_FILE)
+        self.rng = rng or random.Random()
+        self.handle = None
+        self.state = self._load()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("enabled", False)
+        state.setdefault("interval", 0.0)
+        state.setdefault("jitter", DEFAULT_JITTER)
+        state.setdefault("overrun", "skip")
+        state.setdefault("slot", 0.0)
+        state.setdefault("next_run", 0.0)
+        state.setdefault("last_run", 0.0)
+        state.setdefault("queued", False)
+        state.setdefault("runs", 0)
+        state.setdefault("skipped", 0)
+        return state
+
+    def _save(self) -> None:
+        def dump(path):
+            with open(path, "w") as f:
+                json.dump(self.state, f, indent=2)
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            write_atomic(self.state_path, dump)
+        except OSError as e:
+            print(f"Error saving schedule: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.state["enabled"]) and self.state["interval"] > 0
+
+    def configure(self, settings: Dict) -> None:
+        """Apply schedule settings (e.g. from ``settings_from_argv``) and persist them."""
+        if not settings:
+            return
+        if "interval" in settings and settings["interval"] != self.state["interval"]:
+            self.state["slot"] = 0.0  # Start a new grid for the new interval
+        self.state.update(settings)
+        self._save()
+
+    def start(self, runner) -> None:
+        """Arm the timer on ``runner``'s loop for the next run, if the schedule is enabled."""
+        self.runner = runner
+        if self.enabled:
+            runner.call_soon(self._arm)
+
+    def stop(self) -> None:
+        """Disarm the timer; the persisted schedule is kept for the next launch."""
+        if self.runner is not None:
+            self.runner.call_soon(self._disarm)
+
+    def _disarm(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def _arm(self) -> None:
+        self._disarm()
+        now = time.time()
+        state = self.state
+        state["queued"] = False  # A run queued before a restart counts as missed
+        if not state["slot"]:
+            state["slot"] = now
+            self._advance(now)
+        elif state["next_run"] <= now:
+            # Missed while closed: run once soon, then continue on the grid
+            state["next_run"] = now + self._jitter()
+            self._save()
+        self._set_timer(now)
+
+    def _advance(self, now: float) -> None:
+        """Move to the first grid slot after ``now`` and pick its jittered start time."""
+        state = self.state
+        interval = state["interval"]
+        while state["slot"] <= now:
+            state["slot"] += interval
+        state["next_run"] = state["slot"] + self._jitter()
+        self._save()
+
+    def _jitter(self) -> float:
+        return self.rng.uniform(0, min(self.state["jitter"], self.state["interval"] / 2))
+
+    def _set_timer(self, now: float) -> None:
+        self.handle = self.runner.loop.call_later(max(0.0, self.state["next_run"] - now), self._due)
+
+    def _due(self) -> None:
+        self.handle = None
+        now = time.time()
+        if not self._try_start():
+            if self.state["overrun"] == "queue":
+                if not self.state["queued"]:
+                    self.state["queued"] = True
+                    self.runner.when_idle(self._run_queued)
+            else:
+                self.state["skipped"] += 1
+        self._advance(now)
+        self._set_timer(now)
+
+    def _run_queued(self) -> None:
+        self.state["queued"] = False
+        if not self._try_start():
+            # Lost the race to a manual test; wait for that one instead
+            self.state["queued"] = True
+            self.runner.when_idle(self._run_queued)
+        self._save()
+
+    def _try_start(self) -> bool:
+        if self.runner.is_running() or not self.start_test():
+            return False
+        self.state["last_run"] = time.time()
+        self.state["runs"] += 1
+        return True
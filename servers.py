@@ -0,0 +1,168 @@
+"""Best-server selection with a cached server list and remembered winners.
+
+Discovery (config + server list + latency ranking) is the slow start of
+every test. ``ServerSelector`` avoids repeating it:
+
+* the parsed server list is cached on disk for ``ttl`` seconds;
+* candidates are pinged concurrently, at most ``max_concurrency`` at a time;
+* the last ``remember`` winning servers are kept with the latency measured
+  when they won. A later test re-probes only those, and reuses the best one
+  unless its latency has drifted past ``drift_ratio``/``drift_ms`` of that
+  baseline, in which case full discovery runs again.
+"""
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import async_engine
+import engine
+from assets import cache_root, write_atomic
+
+SERVER_CACHE_FILE = "servers.json"
+SERVER_LIST_TTL = 24 * 60 * 60
+CANDIDATES = 10
+MAX_CONCURRENCY = 5
+REMEMBER = 5
+DRIFT_RATIO = 1.5
+DRIFT_MS = 5.0
+
+
+class ServerSelector:
+    """Pick a test server, reusing cached discovery work where it is still valid."""
+
+    def __init__(self, cache_path: Optional[str] = None, ttl: float = SERVER_LIST_TTL,
+                 candidates: int = CANDIDATES, max_concurrency: int = MAX_CONCURRENCY,
+                 remember: int = REMEMBER, drift_ratio: float = DRIFT_RATIO,
+                 drift_ms: float = DRIFT_MS, get_config: Optional[Callable[[], Awaitable[Dict]]] = None):
+        self.get_config = get_config or async_engine.get_config
+        self.cache_path = cache_path or os.path.join(cache_root(), SERVER_CACHE_FILE)
+        self.ttl = ttl
+        self.candidates = candidates
+        self.max_concurrency = max_concurrency
+        self.remember = remember
+        self.drift_ratio = drift_ratio
+        self.drift_ms = drift_ms
+        self.state = self._load()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.cache_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("servers", [])
+        state.setdefault("fetched_at", 0)
+        state.setdefault("winners", [])
+        return state
+
+    def _save(self) -> None:
+        def dump(path):
+            with open(path, "w") as f:
+                json.dump(self.state, f)
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            write_atomic(self.cache_path, dump)
+        except OSError as e:
+            print(f"Error saving server cache: {e}", file=sys.stderr)
+
+    async def _probe(self, servers: List[Dict]) -> List[float]:
+        """Measure latency to each server, with at most ``max_concurrency`` in flight."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def probe(server):
+            async with semaphore:
+                return await async_engine.measure_latency(server)
+
+        return await asyncio.gather(*(probe(s) for s in servers))
+
+    def _within_drift(self, winner: Dict, latency: float) -> bool:
+        baseline = winner["baseline"]
+        return latency <= max(baseline * self.drift_ratio, baseline + self.drift_ms)
+
+    async def reuse_winner(self) -> Optional[Dict]:
+        """Return a remembered winner whose latency has not drifted, if any."""
+        winners = self.state["winners"]
+        if not winners:
+            return None
+        latencies = await self._probe([w["server"] for w in winners])
+        usable = [(latency, w) for latency, w in zip(latencies, winners)
+                  if not math.isinf(latency) and self._within_drift(w, latency)]
+        if not usable:
+            return None
+        latency, winner = min(usable, key=lambda item: item[0])
+        winner["last"] = latency
+        winner["used_at"] = time.time()
+        self._save()
+        best = dict(winner["server"])
+        best["latency"] = latency
+        best["reused"] = True
+        return best
+
+    async def server_list(self, refresh: bool = False) -> List[Dict]:
+        """Return the parsed server list, from the disk cache while it is fresh."""
+        fresh = time.time() - self.state["fetched_at"] < self.ttl
+        if self.state["servers"] and fresh and not refresh:
+            return self.state["servers"]
+        config = await self.get_config()
+        servers = await async_engine.get_servers(config)
+        self.state["servers"] = servers
+        self.state["fetched_at"] = time.time()
+        self._save()
+        return servers
+
+    async def discover(self, refresh: bool = False) -> Dict:
+        """Rank the closest candidates by latency and remember the winner."""
+        return (await self._ranked(refresh, 1))[0]
+
+    async def _ranked(self, refresh: bool, count: int) -> List[Dict]:
+        """Return up to ``count`` reachable candidates, lowest latency first."""
+        cached = not refresh and bool(self.state["servers"])
+        servers = await self.server_list(refresh)
+        closest = sorted(servers, key=lambda s: s["d"])[:max(self.candidates, count)]
+        latencies = await self._probe(closest)
+        ranked = sorted((lat, i) for i, lat in enumerate(latencies) if not math.isinf(lat))
+        if not ranked:
+            if cached:
+                # The cached list may be stale; fetch a fresh one before giving up
+                return await self._ranked(True, count)
+            raise engine.NoMatchedServers("no reachable servers")
+
+        latency, index = ranked[0]
+        self._remember(dict(closest[index]), latency)
+        chosen = []
+        for latency, index in ranked[:count]:
+            server = dict(closest[index])
+            server["latency"] = latency
+            server["reused"] = False
+            chosen.append(server)
+        return chosen
+
+    def _remember(self, server: Dict, latency: float) -> None:
+        now = time.time()
+        winners = [w for w in self.state["winners"] if w["server"].get("id") != server.get("id")]
+        winners.insert(0, {"server": server, "baseline": latency, "last": latency,
+                           "won_at": now, "used_at": now})
+        self.state["winners"] = winners[:self.remember]
+        self._save()
+
+    async def select(self, rediscover: bool = False) -> Dict:
+        """Return the server to test against, skipping discovery when possible."""
+        if not rediscover:
+            best = await self.reuse_winner()
+            if best is not None:
+                return best
+        return await self.discover(refresh=rediscover)
+
+    async def select_top(self, count: int, rediscover: bool = False) -> List[Dict]:
+        """Return the ``count`` best servers (fewer if fewer respond), best first.
+
+        One server goes through ``select`` and may reuse a remembered winner;
+        more always rank the cached candidates, which costs one probe round.
+        """
+        if count <= 1:
+            return [await self.select(rediscover)]
+        return await self._ranked(rediscover, count)
@@ -0,0 +1,189 @@
+"""Long-lived test session: keep-alive connection pool, DNS cache and config cache.
+
+A ``Session`` belongs to the app's ``TestRunner`` and lives on its event
+loop, so the phases of a test and consecutive tests share it:
+
+* connections to the test server go back to a pool after a clean
+  request/response and are handed out again if they have been idle for
+  less than ``idle_timeout`` seconds;
+* host names are resolved once per ``dns_ttl`` seconds;
+* the speedtest.net configuration is kept for ``config_ttl`` seconds and the
+  ``ServerSelector`` stays in memory.
+
+A pooled connection the server has since dropped, or a cached address that no
+longer answers, is replaced by a fresh one rather than failing the test.
+``begin(cold=True)`` (``--cold``) drops everything first so the test pays
+the full setup cost. ``usage()`` counts what the current test opened,
+reused and looked up; it is stored with the result under ``session``.
+
+With ``--processes`` the session also keeps the ``workers.WorkerPool``,
+so worker processes and their own pooled connections outlive a test.
+"""
+import asyncio
+import socket
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import async_engine
+from servers import SERVER_LIST_TTL, ServerSelector
+
+POOL_IDLE_TIMEOUT = 60.0
+POOL_SIZE = 16  # Idle connections kept per (scheme, host, port, kind)
+DNS_TTL = 60 * 60.0
+STREAM = "stream"
+RECEIVER = "receiver"
+COUNTERS = ("connections_opened", "connections_reused", "dns_lookups", "dns_cached", "config_fetches")
+
+
+def _close(kind: str, connection) -> None:
+    if kind == STREAM:
+        connection[1].close()
+    elif connection.transport is not None:
+        connection.transport.close()
+
+
+class Session:
+    """Connections, addresses and configuration reused across phases and tests."""
+
+    def __init__(self, selector: Optional[ServerSelector] = None, idle_timeout: float = POOL_IDLE_TIMEOUT,
+                 dns_ttl: float = DNS_TTL, config_ttl: float = SERVER_LIST_TTL):
+        self.selector = selector or ServerSelector(get_config=self.get_config)
+        self.idle_timeout = idle_timeout
+        self.dns_ttl = dns_ttl
+        self.config_ttl = config_ttl
+        self.idle: Dict[Tuple[str, str, int, str], List[Tuple[float, object]]] = {}
+        self.addresses: Dict[Tuple[str, int], Tuple[float, str]] = {}
+        self.config: Optional[Dict] = None
+        self.config_at = 0.0
+        self.cold = False
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.pool = None  # workers.WorkerPool, made by the first test with --processes
+
+    async def begin(self, cold: bool = False) -> None:
+        """Start counting for a new test; ``cold`` drops every cached connection, address and config."""
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.cold = cold
+        if cold:
+            self.reset()
+
+    def usage(self) -> Dict:
+        return {"cold": self.cold, **self.counts}
+
+    def add_usage(self, usage: Dict) -> None:
+        """Count what a worker process's own session did for this test."""
+        for key in COUNTERS:
+            self.counts[key] += usage.get(key, 0)
+
+    def reset(self) -> None:
+        for key, idle in self.idle.items():
+            for _, connection in idle:
+                _close(key[3], connection)
+        self.idle.clear()
+        self.addresses.clear()
+        self.config = None
+
+    async def close(self) -> None:
+        self.reset()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def worker_pool(self, size: int):
+        """Return the pool of ``size`` worker processes, replacing one of another size."""
+        from workers import WorkerPool
+
+        if self.pool is not None and self.pool.size != size:
+            self.pool.close()
+            self.pool = None
+        if self.pool is None:
+            self.pool = WorkerPool(size)
+        return self.pool
+
+    async def get_config(self) -> Dict:
+        if self.config is None or time.monotonic() - self.config_at >= self.config_ttl:
+            self.config = await async_engine.get_config()
+            self.config_at = time.monotonic()
+            self.counts["config_fetches"] += 1
+        return self.config
+
+    async def resolve(self, host: str, port: int) -> str:
+        """Return an address for ``host``, from the cache while it is fresh."""
+        cached = self.addresses.get((host, port))
+        if cached is not None and time.monotonic() - cached[0] < self.dns_ttl:
+            self.counts["dns_cached"] += 1
+            return cached[1]
+        loop = asyncio.get_running_loop()
+        infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+                                       async_engine.TIMEOUT)
+        if not infos:
+            raise OSError(f"could not resolve {host}")
+        address = infos[0][4][0]
+        self.addresses[(host, port)] = (time.monotonic(), address)
+        self.counts["dns_lookups"] += 1
+        return address
+
+    async def _connect(self, host: str, port: int, connect: Callable[[str], object]):
+        """Connect to the cached address, resolving again once if it no longer answers."""
+        cached = (host, port) in self.addresses
+        address = await self.resolve(host, port)
+        try:
+            connection = await connect(address)
+        except (OSError, asyncio.TimeoutError):
+            if not cached:
+                raise
+            self.addresses.pop((host, port), None)
+            connection = await connect(await self.resolve(host, port))
+        self.counts["connections_opened"] += 1
+        return connection
+
+    def _take(self, key: Tuple[str, str, int, str], alive: Callable[[object], bool]):
+        idle = self.idle.get(key, [])
+        now = time.monotonic()
+        while idle:
+            released_at, connection = idle.pop()
+            if now - released_at < self.idle_timeout and alive(connection):
+                self.counts["connections_reused"] += 1
+                return connection
+            _close(key[3], connection)
+        return None
+
+    def _put(self, key: Tuple[str, str, int, str], connection) -> None:
+        idle = self.idle.setdefault(key, [])
+        if len(idle) < POOL_SIZE:
+            idle.append((time.monotonic(), connection))
+        else:
+            _close(key[3], connection)
+
+    async def open_stream(self, scheme: str, host: str, port: int, fresh: bool = False):
+        """Return ``(reader, writer, reused)``, from the pool unless ``fresh``."""
+        if not fresh:
+            pooled = self._take((scheme, host, port, STREAM),
+                                lambda c: not c[1].is_closing() and not c[0].at_eof())
+            if pooled is not None:
+                return pooled[0], pooled[1], True
+        reader, writer = await self._connect(
+            host, port, lambda address: async_engine.open_stream(scheme, host, port, address))
+        return reader, writer, False
+
+    def release_stream(self, scheme: str, host: str, port: int, reader, writer) -> None:
+        """Pool a stream whose last response was read completely."""
+        self._put((scheme, host, port, STREAM), (reader, writer))
+
+    async def open_receiver(self, scheme: str, host: str, port: int, on_bytes: Callable[[int], None],
+                            fresh: bool = False) -> Tuple["async_engine.BodyReceiver", bool]:
+        """Return ``(receiver, reused)``, from the pool unless ``fresh``."""
+        if not fresh:
+            receiver = self._take((scheme, host, port, RECEIVER),
+                                  lambda r: r.transport is not None and not r.transport.is_closing())
+            if receiver is not None:
+                receiver.reuse(on_bytes)
+                return receiver, True
+        receiver = await self._connect(
+            host, port, lambda address: async_engine.open_receiver(scheme, host, port, on_bytes, address))
+        return receiver, False
+
+    def release_receiver(self, scheme: str, host: str, port: int, receiver) -> None:
+        if receiver.state == async_engine.IDLE:
+            self._put((scheme, host, port, RECEIVER), receiver)
+        else:
+            _close(RECEIVER, receiver)
@@ -0,0 +1,119 @@
+"""Idle-aware timers for the GUI clocks.
+
+``SecondTicker`` fires on wall-clock second boundaries (so the displayed
+time flips exactly when the second changes, with one wakeup per second
+rather than a drifting 1000 ms interval) and can be paused while the window
+is minimized or hidden. Wakeups are recorded in a ``WakeupCounter`` so the
+idle cost can be checked with ``--wakeup-stats``.
+
+The ticker is toolkit-agnostic: it is given ``call_later(ms, fn)`` and
+``cancel(handle)`` functions (``root.after``/``root.after_cancel`` for Tk,
+a single-shot ``QTimer`` for Qt).
+"""
+import sys
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+WINDOW_SECONDS = 60.0
+# Fire just after the boundary so the new second is already visible
+BOUNDARY_SLACK_MS = 5
+
+
+def ms_to_next_second(now: Optional[float] = None) -> int:
+    """Return the delay in milliseconds until just after the next wall-clock second."""
+    now = time.time() if now is None else now
+    return int((1.0 - now % 1.0) * 1000) + BOUNDARY_SLACK_MS
+
+
+class WakeupCounter:
+    """Count event-loop wakeups, overall and over the last minute, by source."""
+
+    def __init__(self, window: float = WINDOW_SECONDS):
+        self.window = window
+        self.started = time.monotonic()
+        self.recent: deque = deque()
+        self.totals: Dict[str, int] = {}
+
+    def record(self, source: str) -> None:
+        now = time.monotonic()
+        self.recent.append(now)
+        self.totals[source] = self.totals.get(source, 0) + 1
+        self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        while self.recent and now - self.recent[0] > self.window:
+            self.recent.popleft()
+
+    def per_minute(self) -> int:
+        """Return the number of wakeups in the last ``window`` seconds."""
+        self._prune(time.monotonic())
+        return len(self.recent)
+
+    def average_per_minute(self) -> float:
+        """Return the average wakeup rate since the counter was created."""
+        minutes = max(time.monotonic() - self.started, 1e-9) / 60
+        return sum(self.totals.values()) / minutes
+
+    def report(self) -> str:
+        sources = ", ".join(f"{name}={count}" for name, count in sorted(self.totals.items()))
+        return (f"Wakeups: {self.per_minute()} in the last minute, "
+                f"{self.average_per_minute():.1f}/min average ({sources or 'none'})")
+
+    @staticmethod
+    def wanted(argv: List[str]) -> bool:
+        """True if ``--wakeup-stats`` was passed."""
+        return "--wakeup-stats" in argv
+
+    def print_report(self) -> None:
+        sys.stderr.write(self.report() + "\n")
+        sys.stderr.flush()
+
+
+class SecondTicker:
+    """Call ``tick`` on every wall-clock second while resumed."""
+
+    def __init__(self, tick: Callable[[], None], call_later: Callable, cancel: Callable,
+                 counter: Optional[WakeupCounter] = None, name: str = "clock"):
+        self.tick = tick
+        self.call_later = call_later
+        self.cancel = cancel
+        self.counter = counter
+        self.name = name
+        self.handle = None
+        self.running = False
+
+    def resume(self) -> None:
+        """Start ticking, refreshing immediately so a restored window is current."""
+        if self.running:
+            return
+        self.running = True
+        self.tick()
+        self._schedule()
+
+    def pause(self) -> None:
+        """Stop ticking until ``resume``; no wakeups happen while paused."""
+        if not self.running:
+            return
+        self.running = False
+        if self.handle is not None:
+            self.cancel(self.handle)
+        self.handle = None
+
+    def set_active(self, active: bool) -> None:
+        if active:
+            self.resume()
+        else:
+            self.pause()
+
+    def _schedule(self) -> None:
+        self.handle = self.call_later(ms_to_next_second(), self._fire)
+
+    def _fire(self) -> None:
+        self.handle = None
+        if not self.running:
+            return
+        if self.counter is not None:
+            self.counter.record(self.name)
+        self.tick()
+        self._schedule()
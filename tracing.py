@@ -0,0 +1,101 @@
+"""Per-phase timing of a test run, with optional Chrome trace-event output.
+
+A ``Trace`` records spans timed with ``time.perf_counter_ns`` relative to the
+start of the test. Each span has a name, an optional byte count, and a track
+(``tid``). Phases go on track 0 and each throughput stream gets its own
+track, so a trace viewer shows the streams of a phase side by side.
+
+``breakdown()`` is stored with each result under ``trace``. ``write_chrome``
+writes the trace-event JSON that chrome://tracing and Perfetto open.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+PHASE_TRACK = 0
+
+
+class Trace:
+    """Spans of one test run, in nanoseconds since the trace started."""
+
+    def __init__(self):
+        self.origin_ns = time.perf_counter_ns()
+        self.started_at = time.time()
+        self.spans: List[Dict] = []
+        self.tracks: Dict[int, str] = {PHASE_TRACK: "phases"}
+
+    def now_ns(self) -> int:
+        return time.perf_counter_ns() - self.origin_ns
+
+    def add(self, name: str, start_ns: int, end_ns: int, nbytes: Optional[int] = None,
+            track: int = PHASE_TRACK, **args) -> Dict:
+        span = {"name": name, "start_ns": start_ns, "duration_ns": end_ns - start_ns, "track": track}
+        if nbytes is not None:
+            span["bytes"] = nbytes
+        if args:
+            span["args"] = args
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, track: int = PHASE_TRACK) -> Iterator[Dict]:
+        """Time the ``with`` body; set ``info["bytes"]`` inside it to record bytes moved."""
+        info: Dict = {}
+        start = self.now_ns()
+        try:
+            yield info
+        finally:
+            self.add(name, start, self.now_ns(), info.pop("bytes", None), track, **info)
+
+    def track(self, name: str) -> int:
+        """Allocate a new track (a thread row in trace viewers) and return its id."""
+        track = len(self.tracks)
+        self.tracks[track] = name
+        return track
+
+    def phases(self) -> List[Dict]:
+        return [s for s in self.spans if s["track"] == PHASE_TRACK]
+
+    def durations(self) -> Dict[str, float]:
+        """Seconds per phase, keyed by phase name."""
+        return {s["name"]: s["duration_ns"] / 1e9 for s in self.phases()}
+
+    def breakdown(self) -> List[Dict]:
+        """Phase spans in start order, in milliseconds, for storing with a result."""
+        rows = []
+        for span in sorted(self.phases(), key=lambda s: s["start_ns"]):
+            row = {"name": span["name"], "start_ms": round(span["start_ns"] / 1e6, 3),
+                   "duration_ms": round(span["duration_ns"] / 1e6, 3)}
+            if "bytes" in span:
+                row["bytes"] = span["bytes"]
+                seconds = span["duration_ns"] / 1e9
+                row["bps"] = round(span["bytes"] * 8 / seconds, 1) if seconds > 0 else 0.0
+            rows.append(row)
+        return rows
+
+    def chrome_events(self) -> List[Dict]:
+        """Complete ("X") events plus thread-name metadata, timestamps in microseconds."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": name}}
+                  for track, name in self.tracks.items()]
+        for span in self.spans:
+            args = dict(span.get("args", {}))
+            if "bytes" in span:
+                args["bytes"] = span["bytes"]
+            events.append({"name": span["name"], "ph": "X", "pid": pid, "tid": span["track"],
+                           "ts": span["start_ns"] / 1000, "dur": span["duration_ns"] / 1000,
+                           "args": args})
+        return events
+
+    def write_chrome(self, path: str) -> None:
+        """Write the trace as Chrome trace-event JSON (overwrites ``path``)."""
+        data = {"traceEvents": self.chrome_events(), "displayTimeUnit": "ms",
+                "otherData": {"started_at": self.started_at}}
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"Error writing trace: {e}", file=sys.stderr)
@@ -0,0 +1,151 @@
+"""Event-driven, coalescing update bus between worker threads and the Tk loop.
+
+Workers ``put`` update dicts (``{"type": ..., ...}``) from any thread. The
+first message after a flush wakes the Tk loop once; further messages just
+queue until that wakeup is handled, so the UI wakes once per batch and never
+polls while idle.
+
+``put`` never makes a Tcl call itself, because a Tcl call from another
+thread waits, without a timeout, for the Tk thread to run it. It writes a
+byte to a pipe that Tk watches with ``createfilehandler`` instead. Where Tk
+has no file handlers (Windows), a helper thread posts a virtual event, and
+only that helper waits on the Tk thread.
+
+On flush, messages that target the same widget are coalesced so only the
+newest one is applied (e.g. ten progress values in one frame become one
+``config`` call), and everything is dispatched through a handler table.
+Messages whose ``coalesce_key`` is ``None`` (errors, history rows) are all
+delivered in order.
+"""
+import os
+import threading
+import time
+import tkinter as tk
+from typing import Callable, Dict, Hashable, List, Optional
+
+from timers import WakeupCounter
+
+WAKE_EVENT = "<<UpdateBus>>"
+FRAME_SECONDS = 1 / 60
+
+# Widget targeted by each coalescable message type
+WIDGET_KEYS = {
+    "status": "status",
+    "server": "server",
+    "download": "download",
+    "upload": "upload",
+    "ping": "ping",
+    "progress": "progress",
+    "button": "button",
+}
+
+
+def coalesce_key(message: Dict) -> Optional[Hashable]:
+    """Return the widget a message updates, or None if it must not be dropped."""
+    kind = message.get("type")
+    if kind == "sample":
+        return message.get("phase")
+    return WIDGET_KEYS.get(kind)
+
+
+class UpdateBus:
+    """Deliver updates to the Tk thread in coalesced batches."""
+
+    def __init__(self, root, handlers: Dict[str, Callable[[Dict], None]],
+                 counter: Optional[WakeupCounter] = None):
+        self.root = root
+        self.handlers = handlers
+        self.lock = threading.Lock()
+        self.messages: List[Dict] = []
+        self.pending = True  # Cleared by the first flush once the main loop runs
+        self.last_flush = 0.0
+        self.flush_job = None
+        self.counter = counter
+        self.closed = False
+
+        self.wake_fds = None
+        if os.name == "posix" and hasattr(root.tk, "createfilehandler"):
+            self.wake_fds = os.pipe()
+            os.set_blocking(self.wake_fds[1], False)
+            root.tk.createfilehandler(self.wake_fds[0], tk.READABLE, self.on_pipe)
+        else:
+            self.wake_needed = threading.Event()
+            root.bind(WAKE_EVENT, self.on_wake)
+            threading.Thread(target=self._post_wakeups, name="update-bus-waker", daemon=True).start()
+        root.after_idle(self.flush)
+
+    def put(self, message: Dict) -> None:
+        """Queue a message from any thread and wake the Tk loop if needed."""
+        with self.lock:
+            self.messages.append(message)
+            if self.pending or self.closed:
+                return
+            self.pending = True
+            if self.wake_fds is not None:
+                try:
+                    os.write(self.wake_fds[1], b"\0")
+                except BlockingIOError:
+                    pass  # Pipe full, so a wakeup is already pending
+                return
+        self.wake_needed.set()
+
+    def _post_wakeups(self) -> None:
+        while True:
+            self.wake_needed.wait()
+            self.wake_needed.clear()
+            if self.closed:
+                return
+            try:
+                self.root.event_generate(WAKE_EVENT, when="tail")
+            except (RuntimeError, tk.TclError):
+                # Main loop not running (yet or anymore): the next flush picks it up
+                pass
+
+    def on_pipe(self, fd, mask) -> None:
+        os.read(fd, 512)
+        self.on_wake()
+
+    def close(self) -> None:
+        """Stop waking the Tk loop; call on the Tk thread before destroying the root."""
+        with self.lock:
+            self.closed = True
+            if self.wake_fds is None:
+                self.wake_needed.set()
+                return
+            self.root.tk.deletefilehandler(self.wake_fds[0])
+            for fd in self.wake_fds:
+                os.close(fd)
+            self.wake_fds = None
+
+    def on_wake(self, event=None) -> None:
+        """Flush now, or at the next frame boundary if a flush just happened."""
+        if self.counter is not None:
+            self.counter.record("updates")
+        wait = self.last_flush + FRAME_SECONDS - time.perf_counter()
+        if wait > 0:
+            if self.flush_job is None:
+                self.flush_job = self.root.after(int(wait * 1000) + 1, self.flush)
+        else:
+            self.flush()
+
+    def flush(self) -> None:
+        """Apply every queued message, keeping only the newest per widget."""
+        self.flush_job = None
+        with self.lock:
+            messages, self.messages = self.messages, []
+            self.pending = False
+        self.last_flush = time.perf_counter()
+
+        latest: Dict[Hashable, int] = {}
+        for index, message in enumerate(messages):
+            key = coalesce_key(message)
+            if key is not None:
+                latest[key] = index
+
+        for index, message in enumerate(messages):
+            key = coalesce_key(message)
+            if key is not None and latest[key] != index:
+                continue
+            handler = self.handlers.get(message.get("type"))
+            if handler is not None:
+                handler(message)
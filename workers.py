@@ -0,0 +1,352 @@
+"""Worker processes for the measurement, so the app process keeps the GIL.
+
+With ``--processes N`` a throughput phase's streams are split across ``N``
+worker processes, each running its own event loop and ``session.Session``.
+The app process only coordinates:
+
+* byte counts and progress come back through shared memory (two doubles
+  per worker, written every ``PUBLISH_INTERVAL``), so sampling costs the
+  app process no per-byte work and no messages;
+* control messages and each worker's result go over a ``multiprocessing``
+  pipe.
+
+Server selection and latency probes stay in the app process. The
+speedtest-cli backend runs the whole test in one worker and its progress
+events are forwarded over the pipe. Unlike in-process speedtest-cli,
+cancelling such a test terminates the worker.
+
+Workers are started with the ``spawn`` method (safe next to the GUI and
+loop threads) and kept in a ``WorkerPool`` owned by the session, so
+consecutive tests reuse them and their pooled connections.
+"""
+import asyncio
+import dataclasses
+import multiprocessing
+import pickle
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import async_engine
+import engine
+from async_engine import DEFAULT_THREADS, SAMPLE_INTERVAL, TIMEOUT
+
+PUBLISH_INTERVAL = SAMPLE_INTERVAL / 2
+START_TIMEOUT = 30.0  # Spawning re-imports the app's modules, which is slow in a frozen build
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+def _worker_main(conn, counters, slot: int) -> None:
+    from session import Session
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    session = Session()
+    conn.send(("ready", None))
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+            kind, payload = message
+            try:
+                if kind == "phase":
+                    reply = ("done", loop.run_until_complete(
+                        _serve_phase(conn, counters, slot, session, **payload)))
+                elif kind == "cli":
+                    reply = ("done", _serve_cli(conn, payload))
+                else:
+                    # A cancel that arrived after its phase had already finished
+                    continue
+            except asyncio.CancelledError:
+                reply = ("cancelled", None)
+            except Exception as e:
+                reply = ("error", _picklable(e))
+            conn.send(reply)
+    finally:
+        loop.run_until_complete(session.close())
+        loop.close()
+
+
+def _picklable(error: Exception) -> Exception:
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+async def _serve_phase(conn, counters, slot: int, session, servers: List[Dict], direction: str,
+                       options: "engine.TestOptions", share: Tuple[int, int], cold: bool) -> Dict:
+    await session.begin(cold=cold)
+    if len(servers) == 1:
+        phase = async_engine.ThroughputPhase(servers[0], direction, options, session=session)
+        phases = [phase]
+    else:
+        phase = async_engine.MultiServerPhase(servers, direction, options, session=session)
+        phases = phase.phases
+    for part in phases:
+        part.share = share
+
+    task = asyncio.ensure_future(phase.run())
+    started = time.perf_counter()
+    try:
+        while not task.done():
+            await asyncio.wait([task], timeout=PUBLISH_INTERVAL)
+            counters[2 * slot] = phase.bytes
+            counters[2 * slot + 1] = phase.fraction(time.perf_counter() - started)
+            if conn.poll():
+                conn.recv()
+                task.cancel()
+        speed = task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    counters[2 * slot] = phase.bytes
+    return {"speed": speed, "bytes": phase.bytes, "elapsed": phase.elapsed, "cpu": phase.cpu_report(),
+            "per_server": getattr(phase, "per_server", None), "session": session.usage()}
+
+
+def _serve_cli(conn, options: "engine.TestOptions") -> Dict:
+    # speedtest-cli reports progress from its own threads
+    lock = threading.Lock()
+
+    def emit(kind, value):
+        with lock:
+            conn.send(("event", (kind, value)))
+
+    return engine.run_speedtest_cli(emit, options)
+
+
+# ---------------------------------------------------------------------------
+# App process side
+# ---------------------------------------------------------------------------
+
+class Worker:
+    """One worker process and the app's end of its pipe."""
+
+    def __init__(self, context, counters, slot: int):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, counters, slot),
+                                       name=f"speedtest-worker-{slot}", daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+
+    def alive(self) -> bool:
+        return self.process.is_alive() and not self.conn.closed
+
+    def send(self, kind: str, payload=None) -> None:
+        self.conn.send((kind, payload))
+
+    def _recv(self, timeout: Optional[float] = None):
+        if timeout is not None and not self.conn.poll(timeout):
+            raise TimeoutError("worker process did not answer")
+        kind, value = self.conn.recv()
+        if kind == "error":
+            raise value
+        return kind, value
+
+    def reply(self, timeout: Optional[float] = None) -> asyncio.Future:
+        """Wait for the next message without blocking the loop; errors are raised."""
+        return asyncio.get_running_loop().run_in_executor(None, self._recv, timeout)
+
+    def terminate(self) -> None:
+        self.process.terminate()
+        self.process.join(TIMEOUT)
+        self.conn.close()
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(TIMEOUT)
+        self.conn.close()
+
+
+class WorkerPool:
+    """``size`` worker processes, started on first use and restarted if they die."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.context = multiprocessing.get_context("spawn")
+        self.counters = self.context.RawArray("d", 2 * size)
+        self.workers: List[Optional[Worker]] = [None] * size
+
+    async def start(self, count: int) -> List[Worker]:
+        """Return the first ``count`` workers once every one of them is ready."""
+        for slot in range(count):
+            worker = self.workers[slot]
+            if worker is None or not worker.alive():
+                if worker is not None:
+                    worker.terminate()
+                self.workers[slot] = Worker(self.context, self.counters, slot)
+        starting = [worker for worker in self.workers[:count] if not worker.ready]
+        try:
+            await asyncio.gather(*(worker.reply(START_TIMEOUT) for worker in starting))
+        except BaseException:
+            for worker in starting:
+                worker.terminate()
+                self.workers[self.workers.index(worker)] = None
+            raise
+        for worker in starting:
+            worker.ready = True
+        return self.workers[:count]
+
+    def discard(self, worker: Worker) -> None:
+        """Terminate a worker whose state is unknown; it is restarted on next use."""
+        worker.terminate()
+        self.workers[self.workers.index(worker)] = None
+
+    def close(self) -> None:
+        for worker in self.workers:
+            if worker is not None:
+                worker.close()
+        self.workers = [None] * self.size
+
+
+class ProcessPhase(async_engine.PhaseSampler):
+    """A throughput phase whose streams run in the pool's worker processes.
+
+    ``threads`` streams are spread over up to ``pool.size`` workers. Each
+    worker runs a ``ThroughputPhase`` (a ``MultiServerPhase`` for several
+    servers) with its share of the streams and, in fixed-byte mode, the
+    requests dealt to those streams. The aggregate is the sum of the workers'
+    rates in fixed-duration mode and total bytes over the longest worker's
+    time in fixed-byte mode. Per-server results are summed over workers.
+    """
+
+    def __init__(self, pool: WorkerPool, servers: List[Dict], direction: str, options: "engine.TestOptions",
+                 emit: Optional["engine.EventCallback"] = None, interval: float = SAMPLE_INTERVAL,
+                 trace=None, session=None):
+        self.pool = pool
+        self.servers = servers
+        self.direction = direction
+        self.options = options
+        self.emit = emit or engine.ignore_event
+        self.interval = interval
+        self.trace = trace
+        self.session = session
+        streams = options.threads or DEFAULT_THREADS
+        count = min(pool.size, streams)
+        self.shares = [streams // count + (slot < streams % count) for slot in range(count)]
+        self.threads = streams * len(servers)
+        self.samples: List[Tuple[float, float]] = []
+        self.per_server: List[Dict] = []
+        self.reports: List[Dict] = []
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def bytes(self) -> int:
+        return int(sum(self.pool.counters[2 * slot] for slot in range(len(self.shares))))
+
+    def fraction(self, elapsed: float) -> float:
+        return min(self.pool.counters[2 * slot + 1] for slot in range(len(self.shares)))
+
+    async def run(self) -> float:
+        """Return the aggregate speed in bits per second."""
+        for slot in range(2 * len(self.shares)):
+            self.pool.counters[slot] = 0.0
+        workers = await self.pool.start(len(self.shares))
+        started = self.trace.now_ns() if self.trace else 0
+        ended: Dict[int, int] = {}
+        replies: List[asyncio.Future] = []
+        sampler = asyncio.ensure_future(self._sample())
+        try:
+            for slot, (worker, threads) in enumerate(zip(workers, self.shares)):
+                worker.send("phase", {
+                    "servers": self.servers, "direction": self.direction,
+                    "options": dataclasses.replace(self.options, threads=threads, processes=0, trace=None),
+                    "share": (sum(self.shares[:slot]), sum(self.shares)),
+                    "cold": self.options.cold and self.direction == "download",
+                })
+                reply = worker.reply()
+                if self.trace:
+                    reply.add_done_callback(lambda _, slot=slot: ended.setdefault(slot, self.trace.now_ns()))
+                replies.append(reply)
+            results = [value for _, value in await asyncio.gather(*map(asyncio.shield, replies))]
+        finally:
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+            await self._settle(workers, replies)
+
+        for slot, result in enumerate(results):
+            if self.session is not None:
+                self.session.add_usage(result["session"])
+            if self.trace:
+                self.trace.add(f"{self.direction} process", started, ended.get(slot, self.trace.now_ns()),
+                               result["bytes"], self.trace.track(f"{self.direction} process {slot}"),
+                               streams=self.shares[slot])
+        self.reports = [result["cpu"] for result in results]
+        self.cpu_seconds = sum(report["seconds"] for report in self.reports)
+        self.elapsed = max(result["elapsed"] for result in results)
+        if len(self.servers) > 1:
+            self.per_server = [dict(entry, bps=sum(r["per_server"][i]["bps"] for r in results),
+                                    bytes=sum(r["per_server"][i]["bytes"] for r in results))
+                               for i, entry in enumerate(results[0]["per_server"])]
+        if self.options.duration:
+            return sum(result["speed"] for result in results)
+        return self.bytes * 8 / self.elapsed if self.elapsed > 0 else 0.0
+
+    async def _settle(self, workers: List[Worker], replies: List[asyncio.Future]) -> None:
+        """Stop workers still measuring after a failure or cancellation."""
+        pending = [(worker, reply) for worker, reply in zip(workers, replies) if not reply.done()]
+        for worker, _ in pending:
+            try:
+                worker.send("cancel")
+            except OSError:
+                pass
+        if pending:
+            await asyncio.wait([reply for _, reply in pending], timeout=TIMEOUT)
+        for worker, reply in pending:
+            if not reply.done():
+                self.pool.discard(worker)
+        for reply in replies:
+            if reply.done() and not reply.cancelled():
+                reply.exception()
+
+    def cpu_report(self) -> Dict:
+        # Each worker measures on its own core, so ``share`` may exceed 1.0 here;
+        # ``limited`` is set when any single worker was saturated
+        report = engine.cpu_report(self.cpu_seconds, self.elapsed, self.bytes)
+        report["limited"] = any(r["limited"] for r in self.reports)
+        report["processes"] = len(self.shares)
+        report["per_process"] = self.reports
+        if self.direction == "upload" and self.reports:
+            report["method"] = self.reports[0].get("method")
+        return report
+
+
+async def run_speedtest_cli(emit: Optional["engine.EventCallback"], options: "engine.TestOptions",
+                            session=None) -> Dict:
+    """Run the speedtest-cli test in a worker process and forward its events."""
+    emit = emit or engine.ignore_event
+    pool = session.worker_pool(1) if session is not None else WorkerPool(1)
+    try:
+        worker, = await pool.start(1)
+        worker.send("cli", dataclasses.replace(options, processes=0))
+        try:
+            while True:
+                kind, value = await worker.reply()
+                if kind != "event":
+                    return value
+                emit(*value)
+        except asyncio.CancelledError:
+            # speedtest-cli cannot be interrupted, so stop its process instead
+            pool.discard(worker)
+            raise
+    finally:
+        if session is None:
+            pool.close()